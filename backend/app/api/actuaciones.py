@@ -10,15 +10,16 @@ from app.models.usuario import Usuario
 from app.models.historial_incidencia import HistorialIncidencia
 from app.schemas.actuacion import ActuacionCreate, ActuacionUpdate, ActuacionResponse
 from app.api.dependencies import get_current_user
+from app.core.user_cache import UsuarioActual
 from app.api.incidencias import get_inmuebles_propietario
 from app.core.cache import (
-    get_from_cache_async, set_to_cache_async, generate_cache_key,
-    invalidate_actuaciones_cache, invalidate_incidencias_cache, delete_from_cache
+    get_from_cache_async, set_to_cache_async, generate_cache_key_async,
+    invalidate_actuaciones_cache_async, invalidate_incidencias_cache_async, delete_from_cache_async
 )
 
 router = APIRouter(prefix="/actuaciones", tags=["actuaciones"])
 
-def get_proveedor_from_user(db: Session, usuario: Usuario) -> Proveedor:
+def get_proveedor_from_user(db: Session, usuario: UsuarioActual) -> Proveedor:
     """Obtiene el proveedor asociado al usuario actual"""
     proveedor = db.query(Proveedor).filter(Proveedor.usuario_id == usuario.id).first()
     if not proveedor:
@@ -60,7 +61,7 @@ def registrar_cambio_estado(db: Session, incidencia_id: int, usuario_id: int,
 async def listar_incidencias_asignadas(
     estado: Optional[EstadoIncidencia] = Query(None),
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Lista las incidencias asignadas al proveedor actual"""
     if current_user.rol != "proveedor":
@@ -70,7 +71,7 @@ async def listar_incidencias_asignadas(
         )
     
     # Generar clave de caché (específica por usuario)
-    cache_key = generate_cache_key("actuaciones:mis-incidencias", usuario_id=current_user.id, estado=estado.value if estado else None)
+    cache_key = await generate_cache_key_async("actuaciones:mis-incidencias", usuario_id=current_user.id, estado=estado.value if estado else None)
     
     # Intentar obtener de caché
     cached_result = await get_from_cache_async(cache_key)
@@ -131,11 +132,11 @@ async def listar_incidencias_asignadas(
 async def listar_actuaciones_incidencia(
     incidencia_id: int,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Lista las actuaciones de una incidencia específica"""
     # Generar clave de caché
-    cache_key = generate_cache_key("actuaciones:incidencia", incidencia_id=incidencia_id)
+    cache_key = await generate_cache_key_async("actuaciones:incidencia", incidencia_id=incidencia_id)
     
     # Intentar obtener de caché
     cached_result = await get_from_cache_async(cache_key)
@@ -172,7 +173,7 @@ async def listar_actuaciones_incidencia(
 async def crear_actuacion(
     actuacion_data: ActuacionCreate,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Crea una nueva actuación para una incidencia asignada"""
     if current_user.rol != "proveedor":
@@ -207,8 +208,8 @@ async def crear_actuacion(
     db.commit()
     db.refresh(nueva_actuacion)
     
-    invalidate_incidencias_cache()
-    delete_from_cache(generate_cache_key("actuaciones:incidencia", incidencia_id=actuacion_data.incidencia_id))
+    await invalidate_incidencias_cache_async()
+    await delete_from_cache_async(await generate_cache_key_async("actuaciones:incidencia", incidencia_id=actuacion_data.incidencia_id))
     
     return nueva_actuacion
 
@@ -217,7 +218,7 @@ async def actualizar_actuacion(
     actuacion_id: int,
     actuacion_data: ActuacionUpdate,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Actualiza una actuación existente"""
     if current_user.rol != "proveedor":
@@ -257,7 +258,7 @@ async def cambiar_estado_incidencia(
     nuevo_estado: EstadoIncidencia,
     comentario: Optional[str] = None,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Permite al proveedor cambiar el estado de una incidencia asignada"""
     if current_user.rol != "proveedor":
@@ -296,7 +297,7 @@ async def cambiar_estado_incidencia(
     db.refresh(incidencia)
     
     # Invalidar caché de incidencias para que todos los usuarios vean el cambio
-    invalidate_incidencias_cache()
+    await invalidate_incidencias_cache_async()
     
     return {
         "id": incidencia.id,
@@ -309,7 +310,7 @@ async def cambiar_estado_incidencia(
 async def eliminar_actuacion(
     actuacion_id: int,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Elimina una actuación (solo el proveedor que la creó o admin)"""
     actuacion = db.query(Actuacion).filter(Actuacion.id == actuacion_id).first()
@@ -336,9 +337,9 @@ async def eliminar_actuacion(
     db.delete(actuacion)
     db.commit()
     
-    invalidate_actuaciones_cache()
-    invalidate_incidencias_cache()
-    delete_from_cache(generate_cache_key("actuaciones:incidencia", incidencia_id=incidencia_id))
+    await invalidate_actuaciones_cache_async()
+    await invalidate_incidencias_cache_async()
+    await delete_from_cache_async(await generate_cache_key_async("actuaciones:incidencia", incidencia_id=incidencia_id))
     
     return None
 
@@ -16,9 +16,10 @@ from app.schemas.usuario import (
     Token,
     EliminarCuentaConfirmacion,
 )
-from app.api.dependencies import get_current_user
+from app.api.dependencies import get_current_user_db
 from app.core.security import verify_password, get_password_hash, create_access_token
 from app.core.config import settings
+from app.core.user_cache import invalidar_usuario_cache
 from app.core.brute_force import (
     get_client_identifier,
     is_login_blocked,
@@ -26,10 +27,8 @@ from app.core.brute_force import (
     clear_login_attempts,
 )
 from app.core.cache import (
-    invalidate_usuarios_cache,
-    invalidate_conductores_cache,
-    invalidate_propietarios_cache,
-    invalidate_proveedores_cache,
+    invalidate_usuarios_cache_async, invalidate_conductores_cache_async,
+    invalidate_propietarios_cache_async, invalidate_proveedores_cache_async
 )
 
 router = APIRouter(prefix="/auth", tags=["autenticación"])
@@ -152,7 +151,7 @@ async def register(user_data: UsuarioCreate, db: Session = Depends(get_db)):
 @router.get("/me/datos")
 async def exportar_mis_datos(
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user),
+    current_user: Usuario = Depends(get_current_user_db),
 ):
     """
     Exporta los datos personales del usuario autenticado (Art. 15 y 20 RGPD).
@@ -239,7 +238,7 @@ async def exportar_mis_datos(
 async def eliminar_mi_cuenta(
     body: Optional[EliminarCuentaConfirmacion] = None,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user),
+    current_user: Usuario = Depends(get_current_user_db),
 ):
     """
     Ejercicio del derecho de supresión (Art. 17 RGPD). El usuario autenticado puede solicitar
@@ -268,6 +267,7 @@ async def eliminar_mi_cuenta(
             )
 
     # Anonimizar usuario (datos personales borrados; referencias se mantienen)
+    email_anterior = current_user.email
     current_user.nombre = "Usuario eliminado"
     current_user.email = f"eliminado_{current_user.id}@cuenta-eliminada.local"
     current_user.hash_password = get_password_hash(secrets.token_urlsafe(32))
@@ -299,12 +299,13 @@ async def eliminar_mi_cuenta(
         proveedor.activo = False
 
     db.commit()
-    invalidate_usuarios_cache()
+    await invalidar_usuario_cache(email_anterior)
+    await invalidate_usuarios_cache_async()
     if conductor:
-        invalidate_conductores_cache()
+        await invalidate_conductores_cache_async()
     if propietario:
-        invalidate_propietarios_cache()
+        await invalidate_propietarios_cache_async()
     if proveedor:
-        invalidate_proveedores_cache()
+        await invalidate_proveedores_cache_async()
     return None
 
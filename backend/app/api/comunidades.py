@@ -4,12 +4,13 @@ from typing import List, Optional
 from app.database import get_db
 from app.models.comunidad import Comunidad
 from app.models.incidencia import Incidencia
-from app.models.usuario import Usuario
 from app.schemas.comunidad import ComunidadCreate, ComunidadUpdate, ComunidadResponse
 from app.api.dependencies import get_current_user
+from app.core.user_cache import UsuarioActual
 from app.core.cache import (
-    get_from_cache_async, set_to_cache_async, generate_cache_key,
-    invalidate_comunidades_cache, invalidate_inmuebles_cache, invalidate_propietarios_cache, delete_from_cache
+    get_from_cache_async, set_to_cache_async, generate_cache_key_async,
+    invalidate_comunidades_cache_async, invalidate_inmuebles_cache_async,
+    invalidate_propietarios_cache_async, delete_from_cache
 )
 
 router = APIRouter(prefix="/comunidades", tags=["comunidades"])
@@ -19,10 +20,10 @@ async def listar_comunidades(
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=100),
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     # Generar clave de caché
-    cache_key = generate_cache_key("comunidades:list", skip=skip, limit=limit)
+    cache_key = await generate_cache_key_async("comunidades:list", skip=skip, limit=limit)
     
     # Intentar obtener de caché (versión async con hilos - no bloquea el event loop)
     cached_result = await get_from_cache_async(cache_key)
@@ -71,10 +72,10 @@ async def listar_comunidades(
 async def obtener_comunidad(
     comunidad_id: int,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     # Generar clave de caché
-    cache_key = generate_cache_key("comunidades:item", id=comunidad_id)
+    cache_key = await generate_cache_key_async("comunidades:item", id=comunidad_id)
     
     # Intentar obtener de caché (versión async con hilos - no bloquea el event loop)
     cached_result = await get_from_cache_async(cache_key)
@@ -119,7 +120,7 @@ async def obtener_comunidad(
 async def crear_comunidad(
     comunidad_data: ComunidadCreate,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     if current_user.rol not in ["super_admin", "admin_fincas"]:
         raise HTTPException(
@@ -133,7 +134,7 @@ async def crear_comunidad(
     db.refresh(nueva_comunidad)
     
     # Invalidar caché de comunidades
-    invalidate_comunidades_cache()
+    await invalidate_comunidades_cache_async()
     
     # Construir respuesta manualmente (sin inmuebles ya que es nueva)
     result_dict = {
@@ -153,7 +154,7 @@ async def actualizar_comunidad(
     comunidad_id: int,
     comunidad_data: ComunidadUpdate,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     if current_user.rol not in ["super_admin", "admin_fincas"]:
         raise HTTPException(
@@ -198,7 +199,7 @@ async def actualizar_comunidad(
 async def eliminar_comunidad(
     comunidad_id: int,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     if current_user.rol not in ["super_admin", "admin_fincas"]:
         raise HTTPException(
@@ -233,9 +234,9 @@ async def eliminar_comunidad(
     
     # Invalidar caché de comunidades, inmuebles y propietarios
     # (siempre invalidar propietarios porque pueden tener inmuebles de esta comunidad)
-    invalidate_comunidades_cache()
-    invalidate_inmuebles_cache()
-    invalidate_propietarios_cache()
+    await invalidate_comunidades_cache_async()
+    await invalidate_inmuebles_cache_async()
+    await invalidate_propietarios_cache_async()
     
     return None
 
@@ -11,9 +11,10 @@ from app.models.mantenimiento import Mantenimiento
 from app.schemas.conductor import ConductorCreate, ConductorUpdate, ConductorResponse
 from app.api.dependencies import get_current_user
 from app.core.security import get_password_hash
+from app.core.user_cache import UsuarioActual, invalidar_usuario_cache
 from app.core.cache import (
-    get_from_cache_async, set_to_cache_async, generate_cache_key,
-    invalidate_conductores_cache, invalidate_usuarios_cache, delete_from_cache
+    get_from_cache_async, set_to_cache_async, generate_cache_key_async,
+    invalidate_conductores_cache_async, invalidate_usuarios_cache_async, delete_from_cache
 )
 
 router = APIRouter(prefix="/conductores", tags=["conductores"])
@@ -35,10 +36,10 @@ async def listar_conductores(
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=100),
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     # Generar clave de caché
-    cache_key = generate_cache_key(
+    cache_key = await generate_cache_key_async(
         "conductores:list",
         activo=activo,
         licencias_proximas_caducar=licencias_proximas_caducar,
@@ -100,11 +101,11 @@ async def listar_conductores(
 async def obtener_alertas_licencias(
     dias_alerta: int = Query(30, ge=1, le=365, description="Días de anticipación para alertar"),
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Obtener conductores con licencias próximas a caducar"""
     # Generar clave de caché
-    cache_key = generate_cache_key("conductores:alertas", dias_alerta=dias_alerta)
+    cache_key = await generate_cache_key_async("conductores:alertas", dias_alerta=dias_alerta)
     
     # Intentar obtener de caché
     cached_result = await get_from_cache_async(cache_key)
@@ -161,10 +162,10 @@ async def obtener_alertas_licencias(
 async def obtener_conductor(
     conductor_id: int,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     # Generar clave de caché
-    cache_key = generate_cache_key("conductores:item", id=conductor_id)
+    cache_key = await generate_cache_key_async("conductores:item", id=conductor_id)
     
     # Intentar obtener de caché
     cached_result = await get_from_cache_async(cache_key)
@@ -206,7 +207,7 @@ async def obtener_conductor(
 async def obtener_historial_conductor(
     conductor_id: int,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Obtener historial del conductor: rutas (con vehículo, estado, fechas) y mantenimientos de los vehículos que ha usado."""
     conductor = db.query(Conductor).filter(Conductor.id == conductor_id).first()
@@ -284,7 +285,7 @@ async def obtener_historial_conductor(
 async def crear_conductor(
     conductor_data: ConductorCreate,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     # Verificar permisos
     if current_user.rol not in ["super_admin", "admin_transportes"]:
@@ -345,7 +346,7 @@ async def crear_conductor(
         db.add(nuevo_usuario)
         db.flush()
         usuario_id = nuevo_usuario.id
-        invalidate_usuarios_cache()
+        await invalidate_usuarios_cache_async()
     
     # Crear conductor (excluyendo password del dump)
     conductor_dict = conductor_data.model_dump(exclude={'password'})
@@ -355,7 +356,7 @@ async def crear_conductor(
     db.refresh(nuevo_conductor)
     
     # Invalidar caché de conductores
-    invalidate_conductores_cache()
+    await invalidate_conductores_cache_async()
     
     dias_restantes = calcular_dias_restantes(nuevo_conductor.fecha_caducidad_licencia)
     proxima_caducar = licencia_proxima_caducar(nuevo_conductor.fecha_caducidad_licencia)
@@ -384,7 +385,7 @@ async def actualizar_conductor(
     conductor_id: int,
     conductor_data: ConductorUpdate,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     if current_user.rol not in ["super_admin", "admin_transportes"]:
         raise HTTPException(
@@ -399,14 +400,17 @@ async def actualizar_conductor(
             detail="Conductor no encontrado"
         )
     
+    # Usuarios cuyo acceso cambia: se sacan de la caché de autenticación tras el commit
+    emails_usuario_cache = []
     # Quitar acceso: eliminar usuario asociado
     if conductor_data.quitar_acceso and conductor.usuario_id:
         usuario = db.query(Usuario).filter(Usuario.id == conductor.usuario_id).first()
         if usuario:
+            emails_usuario_cache.append(usuario.email)
             db.delete(usuario)
             db.flush()
         conductor.usuario_id = None
-        invalidate_usuarios_cache()
+        await invalidate_usuarios_cache_async()
     
     # Crear usuario: si no tiene y se solicita
     if conductor_data.crear_usuario and not conductor.usuario_id:
@@ -438,7 +442,7 @@ async def actualizar_conductor(
         db.add(nuevo_usuario)
         db.flush()
         conductor.usuario_id = nuevo_usuario.id
-        invalidate_usuarios_cache()
+        await invalidate_usuarios_cache_async()
     
     password = conductor_data.password
     update_data = conductor_data.model_dump(
@@ -485,6 +489,7 @@ async def actualizar_conductor(
         if conductor.usuario_id:
             usuario_asociado = db.query(Usuario).filter(Usuario.id == conductor.usuario_id).first()
             if usuario_asociado:
+                emails_usuario_cache.append(usuario_asociado.email)
                 usuario_asociado.email = update_data["email"]
     
     # Actualizar contraseña del usuario existente (si se proporciona)
@@ -503,18 +508,21 @@ async def actualizar_conductor(
         if usuario_asociado:
             nombre_completo = f"{conductor.nombre} {conductor.apellidos or ''}".strip()
             usuario_asociado.nombre = nombre_completo
+            emails_usuario_cache.append(usuario_asociado.email)
     
     # Actualizar estado activo del usuario si cambia
     if conductor.usuario_id and "activo" in update_data:
         usuario_asociado = db.query(Usuario).filter(Usuario.id == conductor.usuario_id).first()
         if usuario_asociado:
             usuario_asociado.activo = update_data["activo"]
+            emails_usuario_cache.append(usuario_asociado.email)
     
     db.commit()
     db.refresh(conductor)
     
     # Invalidar caché de conductores
-    invalidate_conductores_cache()
+    await invalidar_usuario_cache(*emails_usuario_cache)
+    await invalidate_conductores_cache_async()
     
     dias_restantes = calcular_dias_restantes(conductor.fecha_caducidad_licencia)
     proxima_caducar = licencia_proxima_caducar(conductor.fecha_caducidad_licencia)
@@ -543,7 +551,7 @@ async def actualizar_conductor(
 async def eliminar_conductor(
     conductor_id: int,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     if current_user.rol not in ["super_admin", "admin_transportes"]:
         raise HTTPException(
@@ -559,17 +567,20 @@ async def eliminar_conductor(
         )
     
     usuario_id = conductor.usuario_id
+    email_usuario_eliminado = None
     db.delete(conductor)
     db.flush()
     
     if usuario_id:
         usuario = db.query(Usuario).filter(Usuario.id == usuario_id).first()
         if usuario:
+            email_usuario_eliminado = usuario.email
             db.delete(usuario)
-            invalidate_usuarios_cache()
+            await invalidate_usuarios_cache_async()
     
     db.commit()
-    invalidate_conductores_cache()
+    await invalidar_usuario_cache(email_usuario_eliminado)
+    await invalidate_conductores_cache_async()
     
     return None
 
@@ -4,13 +4,23 @@ from sqlalchemy.orm import Session
 from app.database import get_db
 from app.models.usuario import Usuario
 from app.core.security import decode_access_token
+from app.core.user_cache import (
+    UsuarioActual, obtener_usuario_cache, guardar_usuario_cache, invalidar_usuario_cache, leer_version_usuario
+)
 
 security = HTTPBearer()
 
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: Session = Depends(get_db)
-) -> Usuario:
+) -> UsuarioActual:
+    """
+    Usuario autenticado (id, nombre, email, rol, activo).
+
+    Se sirve desde la caché de usuarios (app/core/user_cache.py) cuando es posible,
+    sin consultar la base de datos. Para leer o modificar el registro completo usar
+    get_current_user_db.
+    """
     token = credentials.credentials
     payload = decode_access_token(token)
     
@@ -28,6 +38,12 @@ async def get_current_user(
             detail="Token inválido",
         )
     
+    usuario = await obtener_usuario_cache(email)
+    if usuario is not None:
+        return usuario
+    
+    # Antes de consultar: si se invalida mientras tanto, no se guarda lo leído
+    version = await leer_version_usuario(email)
     user = db.query(Usuario).filter(Usuario.email == email).first()
     if user is None or not user.activo:
         raise HTTPException(
@@ -35,5 +51,20 @@ async def get_current_user(
             detail="Usuario no encontrado o inactivo",
         )
     
-    return user
+    usuario = UsuarioActual.desde_modelo(user)
+    await guardar_usuario_cache(usuario, version)
+    return usuario
 
+async def get_current_user_db(
+    current_user: UsuarioActual = Depends(get_current_user),
+    db: Session = Depends(get_db)
+) -> Usuario:
+    """Modelo Usuario completo del usuario autenticado, en la sesión de la petición."""
+    user = db.query(Usuario).filter(Usuario.id == current_user.id).first()
+    if user is None or not user.activo:
+        await invalidar_usuario_cache(current_user.email)
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Usuario no encontrado o inactivo",
+        )
+    return user
@@ -1,9 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form, Query
-from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
 from typing import List, Optional
 import os
-import uuid
 from datetime import datetime
 from app.database import get_db
 from app.models.documento import Documento
@@ -13,17 +11,16 @@ from app.models.propietario import Propietario
 from app.models.usuario import Usuario
 from app.schemas.documento import DocumentoResponse
 from app.api.dependencies import get_current_user
+from app.core.user_cache import UsuarioActual
 from app.core.security import decode_access_token
+from app.core.storage import store_upload, release_file, file_exists, file_response
 from app.core.cache import (
-    get_from_cache_async, set_to_cache_async, generate_cache_key,
-    invalidate_documentos_cache, invalidate_incidencias_cache, delete_from_cache
+    get_from_cache_async, set_to_cache_async, generate_cache_key_async,
+    invalidate_documentos_cache_async, invalidate_incidencias_cache_async, delete_from_cache_async
 )
 
 router = APIRouter(prefix="/documentos", tags=["documentos"])
 
-# Directorio para almacenar archivos
-UPLOAD_DIR = "/app/uploads/documentos"
-
 # Tipos de archivo permitidos
 ALLOWED_EXTENSIONS = {
     'image/jpeg', 'image/png', 'image/gif', 'image/webp',
@@ -34,7 +31,7 @@ ALLOWED_EXTENSIONS = {
 
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
 
-def verificar_acceso_incidencia(db: Session, incidencia_id: int, usuario: Usuario) -> Incidencia:
+def verificar_acceso_incidencia(db: Session, incidencia_id: int, usuario: UsuarioActual) -> Incidencia:
     """Verifica que el usuario tiene acceso a la incidencia"""
     incidencia = db.query(Incidencia).filter(Incidencia.id == incidencia_id).first()
     if not incidencia:
@@ -81,13 +78,13 @@ def documento_to_response(doc: Documento, db: Session) -> dict:
 async def listar_documentos(
     incidencia_id: int,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Lista todos los documentos de una incidencia"""
     verificar_acceso_incidencia(db, incidencia_id, current_user)
     
     # Generar clave de caché
-    cache_key = generate_cache_key("documentos:incidencia", incidencia_id=incidencia_id)
+    cache_key = await generate_cache_key_async("documentos:incidencia", incidencia_id=incidencia_id)
     
     # Intentar obtener de caché
     cached_result = await get_from_cache_async(cache_key)
@@ -111,7 +108,7 @@ async def subir_documento(
     nombre: str = Form(...),
     archivo: UploadFile = File(...),
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Sube un documento a una incidencia"""
     # Verificar acceso
@@ -124,22 +121,13 @@ async def subir_documento(
             detail=f"Tipo de archivo no permitido. Permitidos: imágenes, PDF, Word, Excel"
         )
     
-    # Leer contenido para validar tamano
-    contenido = await archivo.read()
-    if len(contenido) > MAX_FILE_SIZE:
-        raise HTTPException(status_code=400, detail="El archivo excede el tamano máximo de 10MB")
-    
-    # Crear directorio si no existe
-    os.makedirs(UPLOAD_DIR, exist_ok=True)
-    
-    # Generar nombre único para el archivo
+    # Guardar archivo por fragmentos en el almacén por contenido (un PDF repetido se
+    # guarda una sola vez), validando el tamaño mientras se lee
     extension = os.path.splitext(archivo.filename)[1] if archivo.filename else ""
-    nombre_unico = f"{uuid.uuid4()}{extension}"
-    ruta_completa = os.path.join(UPLOAD_DIR, nombre_unico)
-    
-    # Guardar archivo
-    with open(ruta_completa, "wb") as f:
-        f.write(contenido)
+    guardado = await store_upload(
+        db, archivo, extension, MAX_FILE_SIZE,
+        "El archivo excede el tamano máximo de 10MB"
+    )
     
     # Crear registro en BD
     nuevo_documento = Documento(
@@ -148,17 +136,17 @@ async def subir_documento(
         nombre=nombre,
         nombre_archivo=archivo.filename or "archivo",
         tipo_archivo=archivo.content_type,
-        ruta_archivo=ruta_completa,
-        tamano=len(contenido)
+        ruta_archivo=guardado.ruta,
+        tamano=guardado.tamano
     )
     db.add(nuevo_documento)
     db.commit()
     db.refresh(nuevo_documento)
     
     # Invalidar caché de documentos y de incidencias (para actualizar documentos_count)
-    invalidate_documentos_cache()
-    invalidate_incidencias_cache()
-    delete_from_cache(generate_cache_key("documentos:incidencia", incidencia_id=incidencia_id))
+    await invalidate_documentos_cache_async()
+    await invalidate_incidencias_cache_async()
+    await delete_from_cache_async(await generate_cache_key_async("documentos:incidencia", incidencia_id=incidencia_id))
     
     return documento_to_response(nuevo_documento, db)
 
@@ -192,7 +180,7 @@ async def descargar_documento(
     verificar_acceso_incidencia(db, documento.incidencia_id, current_user)
     
     # Verificar que el archivo existe
-    if not os.path.exists(documento.ruta_archivo):
+    if not file_exists(documento.ruta_archivo):
         raise HTTPException(status_code=404, detail="Archivo no encontrado en el servidor")
     
     # Determinar si mostrar inline o descargar
@@ -201,14 +189,14 @@ async def descargar_documento(
     inline_types = {'image/jpeg', 'image/png', 'image/gif', 'image/webp', 'application/pdf'}
     
     if media_type in inline_types:
-        return FileResponse(
+        return file_response(
             documento.ruta_archivo,
             media_type=media_type,
             filename=documento.nombre_archivo,
             headers={"Content-Disposition": f"inline; filename={documento.nombre_archivo}"}
         )
     else:
-        return FileResponse(
+        return file_response(
             documento.ruta_archivo,
             media_type=media_type,
             filename=documento.nombre_archivo
@@ -218,7 +206,7 @@ async def descargar_documento(
 async def eliminar_documento(
     documento_id: int,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Elimina un documento (solo el propietario del documento)"""
     documento = db.query(Documento).filter(Documento.id == documento_id).first()
@@ -232,9 +220,8 @@ async def eliminar_documento(
             detail="Solo puede eliminar documentos que usted haya subido"
         )
     
-    # Eliminar archivo físico
-    if os.path.exists(documento.ruta_archivo):
-        os.remove(documento.ruta_archivo)
+    # Quitar la referencia al archivo (se borra si ningún otro documento lo usa)
+    release_file(db, documento.ruta_archivo)
     
     # Eliminar registro
     incidencia_id = documento.incidencia_id
@@ -242,9 +229,9 @@ async def eliminar_documento(
     db.commit()
     
     # Invalidar caché de documentos y de incidencias
-    invalidate_documentos_cache()
-    invalidate_incidencias_cache()
-    delete_from_cache(generate_cache_key("documentos:incidencia", incidencia_id=incidencia_id))
+    await invalidate_documentos_cache_async()
+    await invalidate_incidencias_cache_async()
+    await delete_from_cache_async(await generate_cache_key_async("documentos:incidencia", incidencia_id=incidencia_id))
     
     return None
 
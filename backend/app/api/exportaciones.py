@@ -0,0 +1,127 @@
+"""
+Exportaciones PDF en segundo plano para informes e historial.
+
+POST /exportaciones/{tipo} crea un trabajo y responde 202 con su id; un proceso del
+pool de exportación genera el PDF fuera de la petición. El cliente consulta
+GET /exportaciones/{job_id} hasta que el estado sea "completado" y descarga el
+fichero en GET /exportaciones/{job_id}/descarga.
+"""
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import FileResponse
+from typing import Optional
+from app.api.dependencies import get_current_user
+from app.core.user_cache import UsuarioActual
+from app.api.informes import verificar_admin_informes
+from app.api.historial import _verificar_permisos_transportes
+from app.core.export_jobs import crear_job, obtener_job, ruta_fichero_job, ESTADO_COMPLETADO
+
+router = APIRouter(prefix="/exportaciones", tags=["exportaciones"])
+
+# tipo -> generador del contenido ("modulo:funcion"), parámetros que admite y
+# comprobación de permisos (la misma que la exportación directa equivalente)
+TIPOS_EXPORTACION = {
+    "informes_comunidades": {
+        "generador": "app.api.informes:pdf_informes_comunidades",
+        "params": ("fecha_inicio", "fecha_fin"),
+        "permisos": None,
+    },
+    "informes_proveedores": {
+        "generador": "app.api.informes:pdf_informes_proveedores",
+        "params": ("fecha_inicio", "fecha_fin"),
+        "permisos": verificar_admin_informes,
+    },
+    "historial_pedidos": {
+        "generador": "app.api.historial:pdf_historial_pedidos",
+        "params": ("fecha_desde", "fecha_hasta", "solo_con_ruta"),
+        "permisos": _verificar_permisos_transportes,
+    },
+}
+
+
+def _job_to_response(job: dict) -> dict:
+    completado = job.get("estado") == ESTADO_COMPLETADO
+    return {
+        "id": job.get("id"),
+        "tipo": job.get("tipo"),
+        "estado": job.get("estado"),
+        "creado_en": job.get("creado_en") or None,
+        "finalizado_en": job.get("finalizado_en") or None,
+        "error": job.get("error") or None,
+        "descarga_url": f"/api/exportaciones/{job.get('id')}/descarga" if completado else None,
+    }
+
+
+async def _obtener_job_usuario(job_id: str, current_user: UsuarioActual) -> dict:
+    """Devuelve el trabajo si existe y pertenece al usuario actual."""
+    job = await obtener_job(job_id)
+    if not job or job.get("usuario_id") != str(current_user.id):
+        raise HTTPException(status_code=404, detail="Exportación no encontrada o caducada")
+    return job
+
+
+@router.post("/{tipo}", status_code=status.HTTP_202_ACCEPTED)
+async def crear_exportacion(
+    tipo: str,
+    fecha_inicio: Optional[str] = Query(None, description="Informes: fecha de inicio (YYYY-MM-DD)"),
+    fecha_fin: Optional[str] = Query(None, description="Informes: fecha de fin (YYYY-MM-DD)"),
+    fecha_desde: Optional[str] = Query(None, description="Historial: fecha de entrega desde (YYYY-MM-DD)"),
+    fecha_hasta: Optional[str] = Query(None, description="Historial: fecha de entrega hasta (YYYY-MM-DD)"),
+    solo_con_ruta: bool = Query(False, description="Historial: solo pedidos con ruta asignada"),
+    current_user: UsuarioActual = Depends(get_current_user)
+):
+    """
+    Crea un trabajo de exportación PDF en segundo plano.
+    Tipos: informes_comunidades, informes_proveedores, historial_pedidos.
+    """
+    config = TIPOS_EXPORTACION.get(tipo)
+    if config is None:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Tipo de exportación no válido. Use: {', '.join(TIPOS_EXPORTACION)}"
+        )
+    if config["permisos"]:
+        config["permisos"](current_user)
+
+    valores = {
+        "fecha_inicio": fecha_inicio,
+        "fecha_fin": fecha_fin,
+        "fecha_desde": fecha_desde,
+        "fecha_hasta": fecha_hasta,
+        "solo_con_ruta": solo_con_ruta,
+    }
+    params = {nombre: valores[nombre] for nombre in config["params"]}
+
+    job = await crear_job(tipo, config["generador"], params, current_user.id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="El servicio de exportaciones no está disponible. Use la exportación directa."
+        )
+    return _job_to_response(job)
+
+
+@router.get("/{job_id}")
+async def obtener_exportacion(
+    job_id: str,
+    current_user: UsuarioActual = Depends(get_current_user)
+):
+    """Consulta el estado de un trabajo de exportación."""
+    job = await _obtener_job_usuario(job_id, current_user)
+    return _job_to_response(job)
+
+
+@router.get("/{job_id}/descarga")
+async def descargar_exportacion(
+    job_id: str,
+    current_user: UsuarioActual = Depends(get_current_user)
+):
+    """Descarga el PDF de un trabajo completado."""
+    job = await _obtener_job_usuario(job_id, current_user)
+    if job.get("estado") != ESTADO_COMPLETADO:
+        raise HTTPException(status_code=409, detail="La exportación todavía no está lista")
+
+    ruta = ruta_fichero_job(job_id)
+    if ruta is None:
+        raise HTTPException(status_code=404, detail="Exportación no encontrada o caducada")
+
+    return FileResponse(ruta, media_type="application/pdf", filename=job.get("filename") or f"{job_id}.pdf")
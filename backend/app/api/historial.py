@@ -1,25 +1,28 @@
 """
 RF9. Historial de Rutas: listado de pedidos con ruta, conductor, vehículo y fecha de entrega realizada.
 """
-from fastapi import APIRouter, Depends, HTTPException, Query
-from fastapi.responses import Response
-from sqlalchemy.orm import Session
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy import func, select, tuple_
+from typing import Iterator, List, Optional, Tuple
 from datetime import datetime, date
 from app.database import get_db
 from app.models.pedido import Pedido
 from app.models.ruta import Ruta, RutaParada, EstadoParada, TipoOperacion
 from app.models.conductor import Conductor
 from app.models.vehiculo import Vehiculo
-from app.models.usuario import Usuario
 from app.api.dependencies import get_current_user
-import io
-import csv
+from app.core.user_cache import UsuarioActual
+from app.core.export import (
+    validar_formato, iterar_query, csv_streaming_response, xlsx_streaming_response
+)
+from app.core.pdf import pdf_response
+import base64
 
 router = APIRouter(prefix="/historial", tags=["historial"])
 
 
-def _verificar_permisos_transportes(usuario: Usuario):
+def _verificar_permisos_transportes(usuario: UsuarioActual):
     if usuario.rol not in ["super_admin", "admin_transportes"]:
         raise HTTPException(
             status_code=403,
@@ -64,49 +67,6 @@ def estado_pedido_label(estado: Optional[str]) -> str:
     return labels.get(key, estado or "-")
 
 
-def _build_pdf(titulo: str, subtitulo: str, headers: list, rows: list) -> bytes:
-    try:
-        from reportlab.lib.pagesizes import A4, landscape
-        from reportlab.lib import colors
-        from reportlab.lib.styles import getSampleStyleSheet
-        from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-    except ImportError:
-        raise HTTPException(status_code=500, detail="reportlab no está instalado")
-
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(
-        buffer, pagesize=landscape(A4),
-        leftMargin=20, rightMargin=20, topMargin=24, bottomMargin=24
-    )
-    styles = getSampleStyleSheet()
-    story = []
-    story.append(Paragraph(titulo, styles["Title"]))
-    story.append(Paragraph(subtitulo, styles["Normal"]))
-    story.append(Spacer(1, 12))
-    data = [headers] + rows
-    table = Table(data, repeatRows=1)
-    table.setStyle(TableStyle([
-        ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#f2f4f7")),
-        ("TEXTCOLOR", (0, 0), (-1, 0), colors.HexColor("#2f343d")),
-        ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
-        ("FONTSIZE", (0, 0), (-1, 0), 9),
-        ("ALIGN", (0, 0), (-1, 0), "CENTER"),
-        ("GRID", (0, 0), (-1, -1), 0.25, colors.HexColor("#e0e0e0")),
-        ("FONTSIZE", (0, 1), (-1, -1), 8),
-        ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
-        ("ROWBACKGROUNDS", (0, 1), (-1, -1), [colors.white, colors.HexColor("#fafafa")]),
-        ("LEFTPADDING", (0, 0), (-1, -1), 4),
-        ("RIGHTPADDING", (0, 0), (-1, -1), 4),
-        ("TOPPADDING", (0, 0), (-1, -1), 3),
-        ("BOTTOMPADDING", (0, 0), (-1, -1), 3),
-    ]))
-    story.append(table)
-    doc.build(story)
-    pdf_bytes = buffer.getvalue()
-    buffer.close()
-    return pdf_bytes
-
-
 def get_first_and_last_day_of_month(year: int, month: int):
     from calendar import monthrange
     first_day = date(year, month, 1)
@@ -114,16 +74,83 @@ def get_first_and_last_day_of_month(year: int, month: int):
     return first_day, last_day
 
 
-async def obtener_historial_pedidos(
+def _codificar_cursor(fila) -> str:
+    """Cursor opaco con la clave de ordenación (fecha_entrega_deseada, creado_en, id) de una fila."""
+    valor = f"{fila.fecha_entrega_deseada.isoformat()}|{fila.creado_en.isoformat()}|{fila.id}"
+    return base64.urlsafe_b64encode(valor.encode("utf-8")).decode("ascii")
+
+
+def _decodificar_cursor(cursor: str) -> Tuple[date, datetime, int]:
+    try:
+        fecha, creado_en, pedido_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|")
+        return date.fromisoformat(fecha), datetime.fromisoformat(creado_en), int(pedido_id)
+    except (ValueError, UnicodeError):
+        raise HTTPException(status_code=400, detail="Cursor no válido")
+
+
+def _query_historial_pedidos(
     fecha_desde: Optional[str],
     fecha_hasta: Optional[str],
     solo_con_ruta: bool,
     db: Session,
-    current_user: Usuario,
+    cursor: Optional[str] = None,
 ):
-    _verificar_permisos_transportes(current_user)
+    """
+    Consulta única del historial: cada pedido con la ruta de su primera parada
+    (conductor y vehículo) y la fecha de su parada de DESCARGA entregada.
 
-    query = db.query(Pedido)
+    Las paradas se localizan con subconsultas correlacionadas sobre
+    ruta_paradas(pedido_id, id), así que el coste no depende del número de paradas
+    de otros pedidos. Ordenada por (fecha_entrega_deseada, creado_en, id) descendente
+    para poder paginar por keyset con el cursor de la página anterior.
+    """
+    parada_ruta = aliased(RutaParada)
+    parada_descarga = aliased(RutaParada)
+
+    # Ruta asignada: primera RutaParada del pedido (cualquiera) para obtener ruta_id
+    primera_parada_id = (
+        select(func.min(RutaParada.id))
+        .where(RutaParada.pedido_id == Pedido.id)
+        .correlate(Pedido)
+        .scalar_subquery()
+    )
+    # Fecha entregado: parada de DESCARGA del pedido marcada como ENTREGADO
+    descarga_entregada_id = (
+        select(func.min(RutaParada.id))
+        .where(
+            RutaParada.pedido_id == Pedido.id,
+            RutaParada.tipo_operacion == TipoOperacion.DESCARGA,
+            RutaParada.estado == EstadoParada.ENTREGADO,
+        )
+        .correlate(Pedido)
+        .scalar_subquery()
+    )
+
+    query = db.query(
+        Pedido.id,
+        Pedido.cliente,
+        Pedido.origen,
+        Pedido.destino,
+        Pedido.tipo_mercancia,
+        Pedido.fecha_entrega_deseada,
+        Pedido.estado,
+        Pedido.creado_en,
+        Ruta.id.label("ruta_id"),
+        Conductor.nombre.label("conductor_nombre"),
+        Conductor.apellidos.label("conductor_apellidos"),
+        Vehiculo.matricula.label("vehiculo_matricula"),
+        parada_descarga.fecha_hora_completada.label("fecha_hora_completada"),
+    ).select_from(Pedido)
+
+    # Solo pedidos que tienen al menos una RutaParada (asignados a alguna ruta)
+    unir_parada = query.join if solo_con_ruta else query.outerjoin
+    query = (
+        unir_parada(parada_ruta, parada_ruta.id == primera_parada_id)
+        .outerjoin(Ruta, Ruta.id == parada_ruta.ruta_id)
+        .outerjoin(Conductor, Conductor.id == Ruta.conductor_id)
+        .outerjoin(Vehiculo, Vehiculo.id == Ruta.vehiculo_id)
+        .outerjoin(parada_descarga, parada_descarga.id == descarga_entregada_id)
+    )
 
     # Por defecto: mes actual si no se especifican fechas
     if not fecha_desde and not fecha_hasta:
@@ -144,88 +171,140 @@ async def obtener_historial_pedidos(
             f_hasta = date.today()
         query = query.filter(Pedido.fecha_entrega_deseada <= f_hasta)
 
-    # Obtener pedidos que cumplan filtro de fecha
-    pedidos = query.order_by(Pedido.fecha_entrega_deseada.desc(), Pedido.creado_en.desc()).all()
-
-    if solo_con_ruta:
-        # Solo pedidos que tienen al menos una RutaParada (asignados a alguna ruta)
-        pedidos_con_ruta_ids = {row[0] for row in db.query(RutaParada.pedido_id).distinct().all()}
-        pedidos = [p for p in pedidos if p.id in pedidos_con_ruta_ids]
-
-    resultado = []
-    for pedido in pedidos:
-        # Ruta asignada: primera RutaParada del pedido (cualquiera) para obtener ruta_id
-        ruta_parada_cualquiera = (
-            db.query(RutaParada)
-            .filter(RutaParada.pedido_id == pedido.id)
-            .first()
+    if cursor:
+        query = query.filter(
+            tuple_(Pedido.fecha_entrega_deseada, Pedido.creado_en, Pedido.id) < tuple_(*_decodificar_cursor(cursor))
         )
-        ruta_info = None
-        if ruta_parada_cualquiera and ruta_parada_cualquiera.ruta_id:
-            ruta = db.query(Ruta).filter(Ruta.id == ruta_parada_cualquiera.ruta_id).first()
-            if ruta:
-                conductor_nombre = None
-                if ruta.conductor_id:
-                    c = db.query(Conductor).filter(Conductor.id == ruta.conductor_id).first()
-                    if c:
-                        conductor_nombre = f"{c.nombre or ''} {c.apellidos or ''}".strip() or c.nombre
-                vehiculo_matricula = None
-                if ruta.vehiculo_id:
-                    v = db.query(Vehiculo).filter(Vehiculo.id == ruta.vehiculo_id).first()
-                    if v:
-                        vehiculo_matricula = v.matricula
-                ruta_info = {
-                    "id": ruta.id,
-                    "conductor": conductor_nombre,
-                    "vehiculo": vehiculo_matricula,
-                    "tooltip": f"Conductor: {conductor_nombre or '-'}\nVehículo: {vehiculo_matricula or '-'}",
-                }
-
-        # Fecha entregado: parada de DESCARGA del pedido marcada como ENTREGADO
-        parada_descarga = (
-            db.query(RutaParada)
-            .filter(
-                RutaParada.pedido_id == pedido.id,
-                RutaParada.tipo_operacion == TipoOperacion.DESCARGA,
-                RutaParada.estado == EstadoParada.ENTREGADO,
-            )
-            .first()
-        )
-        fecha_entregado = None
-        if parada_descarga and parada_descarga.fecha_hora_completada:
-            fecha_entregado = parada_descarga.fecha_hora_completada.isoformat() if hasattr(parada_descarga.fecha_hora_completada, "isoformat") else str(parada_descarga.fecha_hora_completada)
 
-        estado_val = pedido.estado.value if hasattr(pedido.estado, "value") else str(pedido.estado)
-        fecha_entrega_val = pedido.fecha_entrega_deseada.isoformat() if pedido.fecha_entrega_deseada else None
+    return query.order_by(Pedido.fecha_entrega_deseada.desc(), Pedido.creado_en.desc(), Pedido.id.desc())
+
+
+def _fila_a_historial(fila) -> dict:
+    """Convierte una fila de _query_historial_pedidos al formato de respuesta del historial."""
+    ruta_info = None
+    if fila.ruta_id:
+        conductor_nombre = None
+        if fila.conductor_nombre is not None:
+            conductor_nombre = f"{fila.conductor_nombre or ''} {fila.conductor_apellidos or ''}".strip() or fila.conductor_nombre
+        vehiculo_matricula = fila.vehiculo_matricula
+        ruta_info = {
+            "id": fila.ruta_id,
+            "conductor": conductor_nombre,
+            "vehiculo": vehiculo_matricula,
+            "tooltip": f"Conductor: {conductor_nombre or '-'}\nVehículo: {vehiculo_matricula or '-'}",
+        }
+
+    fecha_entregado = None
+    if fila.fecha_hora_completada:
+        fecha_entregado = fila.fecha_hora_completada.isoformat() if hasattr(fila.fecha_hora_completada, "isoformat") else str(fila.fecha_hora_completada)
+
+    estado_val = fila.estado.value if hasattr(fila.estado, "value") else str(fila.estado)
+    fecha_entrega_val = fila.fecha_entrega_deseada.isoformat() if fila.fecha_entrega_deseada else None
+
+    return {
+        "id": fila.id,
+        "empresa": fila.cliente or "",
+        "origen": fila.origen or "",
+        "destino": fila.destino or "",
+        "tipo_mercancia": fila.tipo_mercancia or "",
+        "fecha_entrega": fecha_entrega_val,
+        "estado": estado_val,
+        "ruta": ruta_info,
+        "fecha_entregado": fecha_entregado,
+    }
+
+
+def _iterar_historial_pedidos(
+    fecha_desde: Optional[str],
+    fecha_hasta: Optional[str],
+    solo_con_ruta: bool,
+    db: Session,
+) -> Iterator[dict]:
+    """Genera las filas del historial leyendo la consulta con un cursor de servidor."""
+    query = _query_historial_pedidos(fecha_desde, fecha_hasta, solo_con_ruta, db)
+    for fila in iterar_query(query):
+        yield _fila_a_historial(fila)
 
-        resultado.append({
-            "id": pedido.id,
-            "empresa": pedido.cliente or "",
-            "origen": pedido.origen or "",
-            "destino": pedido.destino or "",
-            "tipo_mercancia": pedido.tipo_mercancia or "",
-            "fecha_entrega": fecha_entrega_val,
-            "estado": estado_val,
-            "ruta": ruta_info,
-            "fecha_entregado": fecha_entregado,
-        })
 
-    return resultado
+async def obtener_historial_pedidos(
+    fecha_desde: Optional[str],
+    fecha_hasta: Optional[str],
+    solo_con_ruta: bool,
+    db: Session,
+    current_user: UsuarioActual,
+):
+    _verificar_permisos_transportes(current_user)
+    return list(_iterar_historial_pedidos(fecha_desde, fecha_hasta, solo_con_ruta, db))
 
 
 @router.get("/pedidos")
 async def listar_historial_pedidos(
+    response: Response,
     fecha_desde: Optional[str] = Query(None, description="Fecha de entrega desde (YYYY-MM-DD)"),
     fecha_hasta: Optional[str] = Query(None, description="Fecha de entrega hasta (YYYY-MM-DD)"),
     solo_con_ruta: bool = Query(False, description="Solo pedidos con ruta asignada"),
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Tamaño de página (sin límite si se omite)"),
+    cursor: Optional[str] = Query(None, description="Cursor de la página anterior (cabecera X-Next-Cursor)"),
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user),
+    current_user: UsuarioActual = Depends(get_current_user),
 ):
     """
     Historial de pedidos con empresa, origen, destino, tipo mercancía, fecha entrega,
     estado, ruta (conductor/vehículo) y fecha en que se entregó (parada descarga completada).
+
+    Con limit, la respuesta es una página y, si hay más, la cabecera X-Next-Cursor
+    contiene el cursor para pedir la siguiente (paginación por keyset).
     """
-    return await obtener_historial_pedidos(fecha_desde, fecha_hasta, solo_con_ruta, db, current_user)
+    if limit is None and cursor is None:
+        return await obtener_historial_pedidos(fecha_desde, fecha_hasta, solo_con_ruta, db, current_user)
+
+    _verificar_permisos_transportes(current_user)
+    limit = limit or 100
+    query = _query_historial_pedidos(fecha_desde, fecha_hasta, solo_con_ruta, db, cursor=cursor)
+    filas = query.limit(limit + 1).all()
+    if len(filas) > limit:
+        response.headers["X-Next-Cursor"] = _codificar_cursor(filas[limit - 1])
+    return [_fila_a_historial(fila) for fila in filas[:limit]]
+
+
+HEADERS_HISTORIAL = [
+    "Empresa", "Origen", "Destino", "Tipo mercancía", "Fecha entrega", "Estado",
+    "Ruta (ID)", "Conductor", "Vehículo", "Fecha entregado"
+]
+
+
+def _fila_historial(item: dict) -> list:
+    r = item.get("ruta") or {}
+    return [
+        item.get("empresa") or "",
+        item.get("origen") or "",
+        item.get("destino") or "",
+        item.get("tipo_mercancia") or "",
+        formatear_fecha_espanol(item["fecha_entrega"]) if item.get("fecha_entrega") else "",
+        estado_pedido_label(item.get("estado")),
+        str(r.get("id", "")),
+        r.get("conductor") or "",
+        r.get("vehiculo") or "",
+        formatear_datetime_espanol(item.get("fecha_entregado")) or "",
+    ]
+
+
+def pdf_historial_pedidos(
+    db: Session,
+    fecha_desde: Optional[str] = None,
+    fecha_hasta: Optional[str] = None,
+    solo_con_ruta: bool = False,
+) -> dict:
+    """Contenido del PDF del historial (exportación directa y trabajos en segundo plano)."""
+    datos = _iterar_historial_pedidos(fecha_desde, fecha_hasta, solo_con_ruta, db)
+    return {
+        "filename": "historial_pedidos.pdf",
+        "titulo": "Historial de rutas - Pedidos",
+        "subtitulo": "Listado de pedidos con ruta, conductor y fecha de entrega",
+        "headers": HEADERS_HISTORIAL,
+        "rows": (_fila_historial(item) for item in datos),
+        "compacto": True,
+    }
 
 
 @router.get("/pedidos/exportar/{formato}")
@@ -235,83 +314,21 @@ async def exportar_historial_pedidos(
     fecha_hasta: Optional[str] = Query(None),
     solo_con_ruta: bool = Query(False),
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user),
+    current_user: UsuarioActual = Depends(get_current_user),
 ):
-    """Exporta historial de pedidos en CSV, Excel o PDF."""
-    datos = await obtener_historial_pedidos(fecha_desde, fecha_hasta, solo_con_ruta, db, current_user)
-
-    headers_display = [
-        "Empresa", "Origen", "Destino", "Tipo mercancía", "Fecha entrega", "Estado",
-        "Ruta (ID)", "Conductor", "Vehículo", "Fecha entregado"
-    ]
+    """Exporta historial de pedidos en CSV, Excel o PDF (CSV y Excel en streaming)."""
+    _verificar_permisos_transportes(current_user)
+    formato = validar_formato(formato)
+    if formato == "pdf":
+        return await pdf_response(pdf_historial_pedidos(db, fecha_desde, fecha_hasta, solo_con_ruta))
 
-    def row_for_export(item: dict) -> list:
-        r = item.get("ruta") or {}
-        return [
-            item.get("empresa") or "",
-            item.get("origen") or "",
-            item.get("destino") or "",
-            item.get("tipo_mercancia") or "",
-            formatear_fecha_espanol(item["fecha_entrega"]) if item.get("fecha_entrega") else "",
-            estado_pedido_label(item.get("estado")),
-            str(r.get("id", "")),
-            r.get("conductor") or "",
-            r.get("vehiculo") or "",
-            formatear_datetime_espanol(item.get("fecha_entregado")) or "",
-        ]
-
-    if formato.lower() == "csv":
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(["Historial de rutas - Pedidos"])
-        writer.writerow([])
-        writer.writerow(headers_display)
-        for item in datos:
-            writer.writerow(row_for_export(item))
-        csv_content = output.getvalue()
-        output.close()
-        filename = "historial_pedidos.csv"
-        return Response(
-            content=csv_content,
-            media_type="text/csv",
-            headers={"Content-Disposition": f"attachment; filename={filename}"},
-        )
+    titulo = "Historial de rutas - Pedidos"
+    datos = _iterar_historial_pedidos(fecha_desde, fecha_hasta, solo_con_ruta, db)
+    filas = (_fila_historial(item) for item in datos)
 
-    if formato.lower() == "excel":
-        try:
-            import openpyxl
-            from openpyxl.styles import Font, Alignment
-            wb = openpyxl.Workbook()
-            ws = wb.active
-            ws.title = "Historial Pedidos"
-            ws.append(["Historial de rutas - Pedidos"])
-            ws.append([])
-            ws.append(headers_display)
-            for item in datos:
-                ws.append(row_for_export(item))
-            for cell in ws[3]:
-                cell.font = Font(bold=True)
-                cell.alignment = Alignment(horizontal="center")
-            output = io.BytesIO()
-            wb.save(output)
-            output.seek(0)
-            return Response(
-                content=output.read(),
-                media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                headers={"Content-Disposition": "attachment; filename=historial_pedidos.xlsx"},
-            )
-        except ImportError:
-            raise HTTPException(status_code=500, detail="openpyxl no está instalado")
-
-    if formato.lower() == "pdf":
-        titulo = "Historial de rutas - Pedidos"
-        subtitulo = "Listado de pedidos con ruta, conductor y fecha de entrega"
-        rows = [row_for_export(item) for item in datos]
-        pdf_bytes = _build_pdf(titulo, subtitulo, headers_display, rows)
-        return Response(
-            content=pdf_bytes,
-            media_type="application/pdf",
-            headers={"Content-Disposition": "attachment; filename=historial_pedidos.pdf"},
-        )
+    if formato == "csv":
+        return csv_streaming_response("historial_pedidos.csv", HEADERS_HISTORIAL, filas, titulo=titulo)
 
-    raise HTTPException(status_code=400, detail="Formato no válido. Use: csv, excel o pdf")
+    return xlsx_streaming_response(
+        "historial_pedidos.xlsx", "Historial Pedidos", HEADERS_HISTORIAL, filas, titulo=titulo
+    )
@@ -1,24 +1,34 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session, joinedload
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy import func, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from datetime import datetime, timezone
-import os
-from app.database import get_db
+import base64
+from app.database import get_db, get_async_db
 from app.models.incidencia import Incidencia, EstadoIncidencia, PrioridadIncidencia
 from app.models.usuario import Usuario
 from app.models.propietario import Propietario
 from app.models.inmueble import Inmueble
 from app.models.historial_incidencia import HistorialIncidencia
 from app.models.documento import Documento
+from app.models.actuacion import Actuacion
 from app.schemas.incidencia import IncidenciaCreate, IncidenciaUpdate, IncidenciaResponse, HistorialIncidenciaResponse
 from app.api.dependencies import get_current_user
+from app.core.user_cache import UsuarioActual
+from app.core.storage import release_file
 from app.core.cache import (
-    get_from_cache_async, set_to_cache_async, generate_cache_key,
-    invalidate_incidencias_cache, delete_from_cache
+    get_from_cache_async, set_to_cache_async, get_or_set_cache_async, generate_cache_key_async,
+    invalidate_incidencias_cache_async, delete_from_cache, CachedJSON
 )
 
 router = APIRouter(prefix="/incidencias", tags=["incidencias"])
 
+# Incidencias que se leen y serializan en cada vuelta del streaming NDJSON
+SIN_RESOLVER_NDJSON_CHUNK = 200
+MEDIA_TYPE_NDJSON = "application/x-ndjson"
+
 def registrar_cambio_estado(db: Session, incidencia_id: int, usuario_id: int, 
                             estado_anterior: Optional[str], estado_nuevo: str, 
                             comentario: Optional[str] = None):
@@ -32,56 +42,85 @@ def registrar_cambio_estado(db: Session, incidencia_id: int, usuario_id: int,
     )
     db.add(historial)
 
+def _contar_por_incidencia(db: Session, modelo, incidencia_ids: List[int]) -> Dict[int, int]:
+    """Cuenta filas de modelo por incidencia_id en una sola consulta agrupada."""
+    if not incidencia_ids:
+        return {}
+    filas = db.query(modelo.incidencia_id, func.count(modelo.id)).filter(
+        modelo.incidencia_id.in_(incidencia_ids)
+    ).group_by(modelo.incidencia_id).all()
+    return {incidencia_id: total for incidencia_id, total in filas}
+
+
+def incidencias_to_response(incidencias: List[Incidencia], db: Session) -> List[dict]:
+    """
+    Convierte una lista de incidencias a dicts con historial, actuaciones_count y
+    documentos_count.
+
+    Los nombres de los usuarios del historial y los contadores se resuelven con
+    tres consultas para toda la lista (IN + GROUP BY), no con consultas por
+    incidencia. El historial, inmueble y proveedor deben venir ya cargados
+    (joinedload/selectinload) para no disparar cargas perezosas.
+    """
+    incidencia_ids = [inc.id for inc in incidencias]
+    usuario_ids = {h.usuario_id for inc in incidencias for h in inc.historial}
+    nombres_usuarios = {}
+    if usuario_ids:
+        nombres_usuarios = dict(
+            db.query(Usuario.id, Usuario.nombre).filter(Usuario.id.in_(usuario_ids)).all()
+        )
+    actuaciones_count = _contar_por_incidencia(db, Actuacion, incidencia_ids)
+    documentos_count = _contar_por_incidencia(db, Documento, incidencia_ids)
+
+    resultado = []
+    for incidencia in incidencias:
+        historial = [
+            {
+                "id": h.id,
+                "estado_anterior": h.estado_anterior,
+                "estado_nuevo": h.estado_nuevo,
+                "comentario": h.comentario,
+                "fecha": h.fecha,
+                "usuario_nombre": nombres_usuarios.get(h.usuario_id)
+            }
+            for h in incidencia.historial
+        ]
+
+        # Preparar datos del proveedor si existe
+        proveedor_data = None
+        if incidencia.proveedor:
+            proveedor_data = {
+                "id": incidencia.proveedor.id,
+                "nombre": incidencia.proveedor.nombre,
+                "email": incidencia.proveedor.email,
+                "telefono": incidencia.proveedor.telefono,
+                "especialidad": incidencia.proveedor.especialidad
+            }
+
+        resultado.append({
+            "id": incidencia.id,
+            "titulo": incidencia.titulo,
+            "descripcion": incidencia.descripcion,
+            "prioridad": incidencia.prioridad,
+            "inmueble_id": incidencia.inmueble_id,
+            "creador_usuario_id": incidencia.creador_usuario_id,
+            "proveedor_id": incidencia.proveedor_id,
+            "estado": incidencia.estado.value if incidencia.estado else None,
+            "fecha_alta": incidencia.fecha_alta,
+            "fecha_cierre": incidencia.fecha_cierre,
+            "version": incidencia.version,
+            "creado_en": incidencia.creado_en,
+            "inmueble": incidencia.inmueble,
+            "proveedor": proveedor_data,
+            "historial": historial,
+            "actuaciones_count": actuaciones_count.get(incidencia.id, 0),
+            "documentos_count": documentos_count.get(incidencia.id, 0)
+        })
+    return resultado
+
 def incidencia_to_response(incidencia: Incidencia, db: Session) -> dict:
     """Convierte una incidencia a dict con historial y actuaciones_count"""
-    historial = []
-    for h in incidencia.historial:
-        usuario = db.query(Usuario).filter(Usuario.id == h.usuario_id).first()
-        historial.append({
-            "id": h.id,
-            "estado_anterior": h.estado_anterior,
-            "estado_nuevo": h.estado_nuevo,
-            "comentario": h.comentario,
-            "fecha": h.fecha,
-            "usuario_nombre": usuario.nombre if usuario else None
-        })
-    
-    # Contar actuaciones y documentos
-    from app.models.actuacion import Actuacion
-    from app.models.documento import Documento
-    actuaciones_count = db.query(Actuacion).filter(Actuacion.incidencia_id == incidencia.id).count()
-    documentos_count = db.query(Documento).filter(Documento.incidencia_id == incidencia.id).count()
-    
-    # Preparar datos del proveedor si existe
-    proveedor_data = None
-    if incidencia.proveedor:
-        proveedor_data = {
-            "id": incidencia.proveedor.id,
-            "nombre": incidencia.proveedor.nombre,
-            "email": incidencia.proveedor.email,
-            "telefono": incidencia.proveedor.telefono,
-            "especialidad": incidencia.proveedor.especialidad
-        }
-    
-    return {
-        "id": incidencia.id,
-        "titulo": incidencia.titulo,
-        "descripcion": incidencia.descripcion,
-        "prioridad": incidencia.prioridad,
-        "inmueble_id": incidencia.inmueble_id,
-        "creador_usuario_id": incidencia.creador_usuario_id,
-        "proveedor_id": incidencia.proveedor_id,
-        "estado": incidencia.estado.value if incidencia.estado else None,
-        "fecha_alta": incidencia.fecha_alta,
-        "fecha_cierre": incidencia.fecha_cierre,
-        "version": incidencia.version,
-        "creado_en": incidencia.creado_en,
-        "inmueble": incidencia.inmueble,
-        "proveedor": proveedor_data,
-        "historial": historial,
-        "actuaciones_count": actuaciones_count,
-        "documentos_count": documentos_count
-    }
+    return incidencias_to_response([incidencia], db)[0]
 
 def get_inmuebles_propietario(db: Session, usuario_id: int) -> List[int]:
     """Obtiene los IDs de inmuebles asociados al propietario del usuario"""
@@ -90,32 +129,21 @@ def get_inmuebles_propietario(db: Session, usuario_id: int) -> List[int]:
         return []
     return [inmueble.id for inmueble in propietario.inmuebles]
 
-@router.get("/", response_model=List[IncidenciaResponse])
-async def listar_incidencias(
-    estado: Optional[EstadoIncidencia] = Query(None),
-    prioridad: Optional[PrioridadIncidencia] = Query(None),
-    skip: int = Query(0, ge=0),
-    limit: int = Query(100, ge=1, le=100),
-    db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
-):
-    # Generar clave de caché (incluir rol para diferenciar por usuario)
-    cache_key = generate_cache_key(
-        f"incidencias:list:{current_user.rol}",
-        estado=estado.value if estado else None,
-        prioridad=prioridad.value if prioridad else None,
-        skip=skip,
-        limit=limit
-    )
-    
-    # Intentar obtener de caché (versión async con hilos - no bloquea el event loop)
-    cached_result = await get_from_cache_async(cache_key)
-    if cached_result is not None:
-        return cached_result
-    
+def _listar_incidencias(
+    db: Session,
+    current_user: UsuarioActual,
+    estado: Optional[EstadoIncidencia],
+    prioridad: Optional[PrioridadIncidencia],
+    skip: int,
+    limit: int,
+) -> Optional[List[dict]]:
+    """
+    Página de incidencias visibles para el usuario, ya serializada.
+    Devuelve None si el usuario no puede ver ninguna (sin inmuebles o sin proveedor).
+    """
     query = db.query(Incidencia).options(
         joinedload(Incidencia.inmueble),
-        joinedload(Incidencia.historial),
+        selectinload(Incidencia.historial),
         joinedload(Incidencia.proveedor)
     )
     
@@ -126,7 +154,7 @@ async def listar_incidencias(
         if inmueble_ids:
             query = query.filter(Incidencia.inmueble_id.in_(inmueble_ids))
         else:
-            return []  # Sin inmuebles, sin incidencias
+            return None  # Sin inmuebles, sin incidencias
     elif current_user.rol == "proveedor":
         # Proveedores solo ven incidencias asignadas a ellos
         from app.models.proveedor import Proveedor
@@ -134,7 +162,7 @@ async def listar_incidencias(
         if proveedor:
             query = query.filter(Incidencia.proveedor_id == proveedor.id)
         else:
-            return []  # Sin proveedor asociado, sin incidencias
+            return None  # Sin proveedor asociado, sin incidencias
     
     if estado:
         query = query.filter(Incidencia.estado == estado)
@@ -142,51 +170,184 @@ async def listar_incidencias(
         query = query.filter(Incidencia.prioridad == prioridad)
     
     incidencias = query.order_by(Incidencia.fecha_alta.desc()).offset(skip).limit(limit).all()
-    result = [IncidenciaResponse.model_validate(incidencia_to_response(inc, db)).model_dump() for inc in incidencias]
+    return [IncidenciaResponse.model_validate(item).model_dump() for item in incidencias_to_response(incidencias, db)]
+
+@router.get("/", response_model=List[IncidenciaResponse])
+async def listar_incidencias(
+    request: Request,
+    estado: Optional[EstadoIncidencia] = Query(None),
+    prioridad: Optional[PrioridadIncidencia] = Query(None),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: UsuarioActual = Depends(get_current_user)
+):
+    # Clave de caché por rol; propietarios y proveedores ven solo sus incidencias
+    cache_key = await generate_cache_key_async(
+        f"incidencias:list:{current_user.rol}",
+        usuario_id=current_user.id if current_user.rol in ("propietario", "proveedor") else None,
+        estado=estado.value if estado else None,
+        prioridad=prioridad.value if prioridad else None,
+        skip=skip,
+        limit=limit
+    )
     
-    # Almacenar en caché (5 minutos) - versión async con hilos
-    await set_to_cache_async(cache_key, result, expire=300)
+    async def calcular():
+        # La consulta y la serialización por lotes se ejecutan sobre la conexión asyncpg
+        # (run_sync): las esperas a PostgreSQL no bloquean el event loop
+        result = await db.run_sync(_listar_incidencias, current_user, estado, prioridad, skip, limit)
+        return CachedJSON.from_value(List[IncidenciaResponse], result) if result is not None else None
     
-    return result
+    # Se cachea el cuerpo JSON final: un acierto se devuelve sin validar ni serializar.
+    # Ante un fallo de caché concurrente solo una petición calcula (single-flight); None no se cachea
+    respuesta = await get_or_set_cache_async(cache_key, calcular, expire=300)
+    return respuesta.to_response(request) if respuesta is not None else []
 
-@router.get("/sin-resolver", response_model=List[IncidenciaResponse])
-async def listar_incidencias_sin_resolver(
-    db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
-):
-    """Lista incidencias que no están cerradas"""
+def _codificar_cursor_incidencia(incidencia: Incidencia) -> str:
+    """Cursor opaco con la clave de ordenación (fecha_alta, id) de una incidencia."""
+    valor = f"{incidencia.fecha_alta.isoformat()}|{incidencia.id}"
+    return base64.urlsafe_b64encode(valor.encode("utf-8")).decode("ascii")
+
+
+def _decodificar_cursor_incidencia(cursor: str) -> Tuple[datetime, int]:
+    try:
+        fecha_alta, incidencia_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|")
+        return datetime.fromisoformat(fecha_alta), int(incidencia_id)
+    except (ValueError, UnicodeError):
+        raise HTTPException(status_code=400, detail="Cursor no válido")
+
+
+def _query_incidencias_sin_resolver(db: Session, current_user: UsuarioActual):
+    """
+    Consulta de incidencias no cerradas visibles para el usuario, ordenada por
+    (fecha_alta, id) descendente. Devuelve None si el usuario no puede ver ninguna.
+    """
     query = db.query(Incidencia).options(
         joinedload(Incidencia.inmueble),
-        joinedload(Incidencia.historial),
+        selectinload(Incidencia.historial),
         joinedload(Incidencia.proveedor)
     ).filter(Incidencia.estado != EstadoIncidencia.CERRADA)
     
     # Filtros según rol
     if current_user.rol == "propietario":
         inmueble_ids = get_inmuebles_propietario(db, current_user.id)
-        if inmueble_ids:
-            query = query.filter(Incidencia.inmueble_id.in_(inmueble_ids))
-        else:
-            return []
+        if not inmueble_ids:
+            return None
+        query = query.filter(Incidencia.inmueble_id.in_(inmueble_ids))
     elif current_user.rol == "proveedor":
         from app.models.proveedor import Proveedor
         proveedor = db.query(Proveedor).filter(Proveedor.usuario_id == current_user.id).first()
-        if proveedor:
-            query = query.filter(Incidencia.proveedor_id == proveedor.id)
-        else:
-            return []
+        if not proveedor:
+            return None
+        query = query.filter(Incidencia.proveedor_id == proveedor.id)
     
-    incidencias = query.order_by(Incidencia.fecha_alta.desc()).all()
-    return [IncidenciaResponse.model_validate(incidencia_to_response(inc, db)) for inc in incidencias]
+    return query.order_by(Incidencia.fecha_alta.desc(), Incidencia.id.desc())
+
+
+def _pagina_incidencias(query, limit: int, cursor: Optional[str]) -> Tuple[List[Incidencia], Optional[str]]:
+    """Lee una página por keyset; devuelve las incidencias y el cursor de la siguiente (o None)."""
+    if cursor:
+        query = query.filter(
+            tuple_(Incidencia.fecha_alta, Incidencia.id) < tuple_(*_decodificar_cursor_incidencia(cursor))
+        )
+    incidencias = query.limit(limit + 1).all()
+    if len(incidencias) > limit:
+        return incidencias[:limit], _codificar_cursor_incidencia(incidencias[limit - 1])
+    return incidencias, None
+
+
+def _leer_incidencias_sin_resolver(
+    db: Session,
+    current_user: UsuarioActual,
+    limit: Optional[int],
+    cursor: Optional[str],
+) -> Optional[Tuple[List[IncidenciaResponse], Optional[str]]]:
+    """
+    Lee y serializa las incidencias sin resolver (todas, o una página si hay limit/cursor).
+    Devuelve (incidencias, cursor siguiente) o None si el usuario no puede ver ninguna.
+    """
+    query = _query_incidencias_sin_resolver(db, current_user)
+    if query is None:
+        return None
+    if limit is None and cursor is None:
+        incidencias, next_cursor = query.all(), None
+    else:
+        incidencias, next_cursor = _pagina_incidencias(query, limit or 100, cursor)
+    modelos = [IncidenciaResponse.model_validate(item) for item in incidencias_to_response(incidencias, db)]
+    # Soltar las entidades ya serializadas: el streaming NDJSON lee muchas páginas con la misma sesión
+    db.expunge_all()
+    return modelos, next_cursor
+
+
+async def _generar_ndjson_incidencias(db: AsyncSession, current_user: UsuarioActual) -> AsyncIterator[str]:
+    """
+    Genera una incidencia por línea (NDJSON) recorriendo la consulta por páginas de
+    SIN_RESOLVER_NDJSON_CHUNK, con el serializador por lotes en cada página.
+    """
+    cursor = None
+    while True:
+        leido = await db.run_sync(_leer_incidencias_sin_resolver, current_user, SIN_RESOLVER_NDJSON_CHUNK, cursor)
+        if leido is None:
+            return
+        modelos, cursor = leido
+        if modelos:
+            yield "".join(modelo.model_dump_json() + "\n" for modelo in modelos)
+        if cursor is None:
+            return
+
+
+@router.get("/sin-resolver", response_model=List[IncidenciaResponse])
+async def listar_incidencias_sin_resolver(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Tamaño de página (sin límite si se omite)"),
+    cursor: Optional[str] = Query(None, description="Cursor de la página anterior (cabecera X-Next-Cursor)"),
+    formato: Optional[str] = Query(None, description="ndjson: una incidencia por línea, en streaming"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: UsuarioActual = Depends(get_current_user)
+):
+    """
+    Lista incidencias que no están cerradas.
+
+    Con limit, la respuesta es una página y, si hay más, la cabecera X-Next-Cursor
+    contiene el cursor para pedir la siguiente (paginación por keyset sobre
+    fecha_alta e id). Con formato=ndjson se envían todas en streaming, una por línea.
+    """
+    if formato is not None:
+        if formato.lower() != "ndjson":
+            raise HTTPException(status_code=400, detail="Formato no válido. Use: ndjson")
+        return StreamingResponse(_generar_ndjson_incidencias(db, current_user), media_type=MEDIA_TYPE_NDJSON)
+
+    # Clave de caché por rol; propietarios y proveedores ven solo sus incidencias
+    cache_key = await generate_cache_key_async(
+        f"incidencias:sin_resolver:{current_user.rol}",
+        usuario_id=current_user.id if current_user.rol in ("propietario", "proveedor") else None,
+        limit=limit,
+        cursor=cursor
+    )
+
+    async def calcular():
+        leido = await db.run_sync(_leer_incidencias_sin_resolver, current_user, limit, cursor)
+        if leido is None:
+            return None
+        modelos, next_cursor = leido
+        return CachedJSON.from_value(
+            List[IncidenciaResponse], modelos, headers={"X-Next-Cursor": next_cursor} if next_cursor else None
+        )
+
+    # Caché de 5 minutos del cuerpo JSON final; un solo cálculo por clave ante fallos concurrentes
+    pagina = await get_or_set_cache_async(cache_key, calcular, expire=300)
+    if pagina is None:
+        return []
+    return pagina.to_response(request)
 
 @router.get("/{incidencia_id}", response_model=IncidenciaResponse)
 async def obtener_incidencia(
     incidencia_id: int,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     # Generar clave de caché (incluir usuario para diferenciar por permisos)
-    cache_key = generate_cache_key("incidencias:item", id=incidencia_id, usuario_id=current_user.id)
+    cache_key = await generate_cache_key_async("incidencias:item", id=incidencia_id, usuario_id=current_user.id)
     
     # Intentar obtener de caché (versión async con hilos - no bloquea el event loop)
     cached_result = await get_from_cache_async(cache_key)
@@ -225,7 +386,7 @@ async def obtener_incidencia(
 async def crear_incidencia(
     incidencia_data: IncidenciaCreate,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     # Propietarios solo pueden crear incidencias en sus inmuebles
     if current_user.rol == "propietario" and incidencia_data.inmueble_id:
@@ -263,7 +424,7 @@ async def crear_incidencia(
     db.refresh(nueva_incidencia)
     
     # Invalidar caché de incidencias
-    invalidate_incidencias_cache()
+    await invalidate_incidencias_cache_async()
     
     return IncidenciaResponse.model_validate(incidencia_to_response(nueva_incidencia, db))
 
@@ -272,7 +433,7 @@ async def actualizar_incidencia(
     incidencia_id: int,
     incidencia_data: IncidenciaUpdate,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     incidencia = db.query(Incidencia).options(
         joinedload(Incidencia.inmueble),
@@ -337,7 +498,7 @@ async def actualizar_incidencia(
     db.refresh(incidencia)
     
     # Invalidar caché de incidencias
-    invalidate_incidencias_cache()
+    await invalidate_incidencias_cache_async()
     
     return IncidenciaResponse.model_validate(incidencia_to_response(incidencia, db))
 
@@ -345,7 +506,7 @@ async def actualizar_incidencia(
 async def eliminar_incidencia(
     incidencia_id: int,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     incidencia = db.query(Incidencia).filter(Incidencia.id == incidencia_id).first()
     if not incidencia:
@@ -375,14 +536,11 @@ async def eliminar_incidencia(
             detail="No tiene permisos para eliminar esta incidencia"
         )
     
-    # Eliminar archivos físicos de documentos asociados antes de eliminar la incidencia
+    # Quitar las referencias a los archivos de los documentos asociados: cada archivo
+    # se borra solo si ningún otro documento usa el mismo contenido
     documentos = db.query(Documento).filter(Documento.incidencia_id == incidencia_id).all()
     for documento in documentos:
-        if os.path.exists(documento.ruta_archivo):
-            try:
-                os.remove(documento.ruta_archivo)
-            except OSError:
-                pass  # Si no se puede eliminar, continuar con la eliminación de la BD
+        release_file(db, documento.ruta_archivo)
     
     # Eliminar historial asociado primero (no tiene cascade configurado)
     db.query(HistorialIncidencia).filter(HistorialIncidencia.incidencia_id == incidencia_id).delete()
@@ -392,7 +550,7 @@ async def eliminar_incidencia(
     db.commit()
     
     # Invalidar caché de incidencias
-    invalidate_incidencias_cache()
+    await invalidate_incidencias_cache_async()
     
     return None
 
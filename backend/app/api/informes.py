@@ -1,8 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
-from fastapi.responses import StreamingResponse, Response
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_, or_
-from typing import List, Optional
+from sqlalchemy import func, or_, select
+from typing import Iterable, Iterator, List, Optional
 from datetime import datetime, date
 from app.database import get_db
 from app.models.comunidad import Comunidad
@@ -10,10 +9,12 @@ from app.models.inmueble import Inmueble
 from app.models.incidencia import Incidencia
 from app.models.actuacion import Actuacion
 from app.models.proveedor import Proveedor
-from app.models.usuario import Usuario
 from app.api.dependencies import get_current_user
-import io
-import csv
+from app.core.user_cache import UsuarioActual
+from app.core.export import (
+    validar_formato, iterar_query, csv_streaming_response, xlsx_streaming_response
+)
+from app.core.pdf import pdf_response
 from decimal import Decimal
 
 router = APIRouter(prefix="/informes", tags=["informes"])
@@ -21,7 +22,7 @@ router = APIRouter(prefix="/informes", tags=["informes"])
 ROLES_ADMIN_INFORMES = ["super_admin", "admin_fincas", "admin_transportes"]
 
 
-def verificar_admin_informes(usuario: Usuario):
+def verificar_admin_informes(usuario: UsuarioActual):
     """Solo super_admin y administradores pueden consultar informes."""
     if usuario.rol not in ROLES_ADMIN_INFORMES:
         raise HTTPException(
@@ -38,50 +39,29 @@ def formatear_fecha_espanol(fecha_str: str) -> str:
     except:
         return fecha_str
 
-def _build_pdf(titulo: str, subtitulo: str, headers: list, rows: list) -> bytes:
+def _coste_por_incidencia_subquery(fecha_inicio_dt: datetime, fecha_fin_dt: datetime):
     """
-    Genera un PDF simple en memoria usando ReportLab.
+    Subconsulta con el coste total de actuaciones agrupado por incidencia, solo para
+    las incidencias dadas de alta en el período del informe.
+
+    Se agrega antes de unir con las incidencias para que el JOIN no multiplique
+    las filas de incidencias (y por tanto los COUNT) cuando hay varias actuaciones.
+    El filtro de fechas va dentro: PostgreSQL no lo empuja a una tabla derivada
+    agregada, y sin él se sumarían todas las actuaciones del histórico.
     """
-    try:
-        from reportlab.lib.pagesizes import A4, landscape
-        from reportlab.lib import colors
-        from reportlab.lib.styles import getSampleStyleSheet
-        from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-    except ImportError:
-        raise HTTPException(status_code=500, detail="reportlab no está instalado. Instálelo con: pip install reportlab")
-
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=landscape(A4), leftMargin=24, rightMargin=24, topMargin=24, bottomMargin=24)
-    styles = getSampleStyleSheet()
-
-    story = []
-    story.append(Paragraph(titulo, styles["Title"]))
-    story.append(Paragraph(subtitulo, styles["Normal"]))
-    story.append(Spacer(1, 12))
-
-    data = [headers] + rows
-    table = Table(data, repeatRows=1)
-    table.setStyle(TableStyle([
-        ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#f2f4f7")),
-        ("TEXTCOLOR", (0, 0), (-1, 0), colors.HexColor("#2f343d")),
-        ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
-        ("FONTSIZE", (0, 0), (-1, 0), 10),
-        ("ALIGN", (0, 0), (-1, 0), "CENTER"),
-        ("GRID", (0, 0), (-1, -1), 0.25, colors.HexColor("#e0e0e0")),
-        ("FONTSIZE", (0, 1), (-1, -1), 9),
-        ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
-        ("ROWBACKGROUNDS", (0, 1), (-1, -1), [colors.white, colors.HexColor("#fafafa")]),
-        ("LEFTPADDING", (0, 0), (-1, -1), 6),
-        ("RIGHTPADDING", (0, 0), (-1, -1), 6),
-        ("TOPPADDING", (0, 0), (-1, -1), 4),
-        ("BOTTOMPADDING", (0, 0), (-1, -1), 4),
-    ]))
-
-    story.append(table)
-    doc.build(story)
-    pdf = buffer.getvalue()
-    buffer.close()
-    return pdf
+    return (
+        select(
+            Actuacion.incidencia_id.label("incidencia_id"),
+            func.sum(Actuacion.coste).label("coste"),
+        )
+        .join(Incidencia, Incidencia.id == Actuacion.incidencia_id)
+        .where(
+            Incidencia.fecha_alta >= fecha_inicio_dt,
+            Incidencia.fecha_alta <= fecha_fin_dt,
+        )
+        .group_by(Actuacion.incidencia_id)
+        .subquery()
+    )
 
 def get_first_and_last_day_of_month(year: int, month: int):
     """Obtiene el primer y último día del mes"""
@@ -90,116 +70,198 @@ def get_first_and_last_day_of_month(year: int, month: int):
     last_day = date(year, month, monthrange(year, month)[1])
     return first_day, last_day
 
-@router.get("/comunidades")
-async def obtener_informes_comunidades(
-    fecha_inicio: Optional[str] = Query(None, description="Fecha de inicio (YYYY-MM-DD)"),
-    fecha_fin: Optional[str] = Query(None, description="Fecha de fin (YYYY-MM-DD)"),
-    db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
-):
+def _rango_fechas(fecha_inicio: Optional[str], fecha_fin: Optional[str]):
     """
-    Obtiene informes de comunidades con sus inmuebles, número de incidencias y costes totales.
+    Devuelve (fecha_inicio_str, fecha_fin_str, fecha_inicio_dt, fecha_fin_dt).
     Por defecto usa el mes actual si no se especifican fechas.
     """
-    # Si no se especifican fechas, usar el mes actual
     if not fecha_inicio or not fecha_fin:
         today = date.today()
-        fecha_inicio, fecha_fin = get_first_and_last_day_of_month(today.year, today.month)
-        fecha_inicio_str = fecha_inicio.isoformat()
-        fecha_fin_str = fecha_fin.isoformat()
+        primer_dia, ultimo_dia = get_first_and_last_day_of_month(today.year, today.month)
+        fecha_inicio_str = primer_dia.isoformat()
+        fecha_fin_str = ultimo_dia.isoformat()
     else:
         fecha_inicio_str = fecha_inicio
         fecha_fin_str = fecha_fin
-    
+
     # Convertir a datetime para la consulta
     fecha_inicio_dt = datetime.fromisoformat(fecha_inicio_str).replace(hour=0, minute=0, second=0)
     fecha_fin_dt = datetime.fromisoformat(fecha_fin_str).replace(hour=23, minute=59, second=59)
-    
-    # Obtener todas las comunidades con sus inmuebles
-    comunidades = db.query(Comunidad).all()
-    
-    resultado = []
-    
-    for comunidad in comunidades:
-        # Obtener inmuebles de la comunidad
-        inmuebles = db.query(Inmueble).filter(Inmueble.comunidad_id == comunidad.id).all()
-        
-        inmuebles_data = []
-        total_incidencias_comunidad = 0
-        total_coste_comunidad = Decimal('0.00')
-        
-        for inmueble in inmuebles:
-            # Obtener incidencias del inmueble en el rango de fechas
-            incidencias = db.query(Incidencia).filter(
-                and_(
-                    Incidencia.inmueble_id == inmueble.id,
-                    Incidencia.fecha_alta >= fecha_inicio_dt,
-                    Incidencia.fecha_alta <= fecha_fin_dt
-                )
-            ).all()
-            
-            # Calcular coste total de las actuaciones de estas incidencias y agrupar por estado
-            coste_total = Decimal('0.00')
-            incidencias_por_estado = {}
-            
-            for incidencia in incidencias:
-                estado = incidencia.estado.value if hasattr(incidencia.estado, 'value') else str(incidencia.estado)
-                if estado not in incidencias_por_estado:
-                    incidencias_por_estado[estado] = {"count": 0, "coste": Decimal('0.00')}
-                
-                incidencias_por_estado[estado]["count"] += 1
-                
-                actuaciones = db.query(Actuacion).filter(
-                    Actuacion.incidencia_id == incidencia.id
-                ).all()
-                for actuacion in actuaciones:
-                    if actuacion.coste:
-                        coste_actuacion = Decimal(str(actuacion.coste))
-                        coste_total += coste_actuacion
-                        incidencias_por_estado[estado]["coste"] += coste_actuacion
-            
-            num_incidencias = len(incidencias)
-            total_incidencias_comunidad += num_incidencias
-            total_coste_comunidad += coste_total
-            
-            inmuebles_data.append({
-                "id": inmueble.id,
-                "referencia": inmueble.referencia,
-                "direccion": inmueble.direccion,
-                "metros": float(inmueble.metros) if inmueble.metros else None,
-                "tipo": inmueble.tipo,
-                "num_incidencias": num_incidencias,
-                "coste_total": float(coste_total),
-                "incidencias_por_estado": {k: {"count": v["count"], "coste": float(v["coste"])} for k, v in incidencias_por_estado.items()}
-            })
-        
-        # Calcular incidencias por estado a nivel de comunidad
-        incidencias_comunidad_por_estado = {}
-        for inmueble_data in inmuebles_data:
-            if "incidencias_por_estado" in inmueble_data:
-                for estado, datos in inmueble_data["incidencias_por_estado"].items():
-                    if estado not in incidencias_comunidad_por_estado:
-                        incidencias_comunidad_por_estado[estado] = {"count": 0, "coste": 0.0}
-                    incidencias_comunidad_por_estado[estado]["count"] += datos["count"]
-                    incidencias_comunidad_por_estado[estado]["coste"] += datos["coste"]
-        
-        # Solo agregar comunidades que tengan incidencias
-        if total_incidencias_comunidad > 0:
-            resultado.append({
-                "id": comunidad.id,
-                "nombre": comunidad.nombre,
-                "cif": comunidad.cif,
-                "direccion": comunidad.direccion,
-                "num_incidencias": total_incidencias_comunidad,
-                "coste_total": float(total_coste_comunidad),
-                "incidencias_por_estado": incidencias_comunidad_por_estado,
-                "inmuebles": [inm for inm in inmuebles_data if inm["num_incidencias"] > 0]  # Solo inmuebles con incidencias
-            })
-    
+    return fecha_inicio_str, fecha_fin_str, fecha_inicio_dt, fecha_fin_dt
+
+def _iterar_comunidades(db: Session, fecha_inicio_dt: datetime, fecha_fin_dt: datetime) -> Iterator[dict]:
+    """
+    Genera el informe de cada comunidad (con sus inmuebles) de una en una.
+
+    Una sola consulta agrupada: comunidad → inmueble → incidencias (por estado) con el
+    coste de sus actuaciones ya sumado en la base de datos. El número de consultas es
+    constante aunque crezca el número de comunidades, inmuebles o incidencias, y las
+    filas se leen con un cursor de servidor, así que solo se mantiene en memoria la
+    comunidad en curso. Solo aparecen comunidades e inmuebles con incidencias.
+    """
+    coste_incidencia = _coste_por_incidencia_subquery(fecha_inicio_dt, fecha_fin_dt)
+    filas = (
+        db.query(
+            Comunidad.id.label("comunidad_id"),
+            Comunidad.nombre,
+            Comunidad.cif,
+            Comunidad.direccion.label("comunidad_direccion"),
+            Inmueble.id.label("inmueble_id"),
+            Inmueble.referencia,
+            Inmueble.direccion.label("inmueble_direccion"),
+            Inmueble.metros,
+            Inmueble.tipo,
+            Incidencia.estado,
+            func.count(Incidencia.id).label("num_incidencias"),
+            func.coalesce(func.sum(coste_incidencia.c.coste), 0).label("coste"),
+        )
+        .join(Inmueble, Inmueble.comunidad_id == Comunidad.id)
+        .join(Incidencia, Incidencia.inmueble_id == Inmueble.id)
+        .outerjoin(coste_incidencia, coste_incidencia.c.incidencia_id == Incidencia.id)
+        .filter(
+            Incidencia.fecha_alta >= fecha_inicio_dt,
+            Incidencia.fecha_alta <= fecha_fin_dt,
+        )
+        .group_by(
+            Comunidad.id, Comunidad.nombre, Comunidad.cif, Comunidad.direccion,
+            Inmueble.id, Inmueble.referencia, Inmueble.direccion, Inmueble.metros, Inmueble.tipo,
+            Incidencia.estado,
+        )
+        .order_by(Comunidad.id, Inmueble.id)
+    )
+
+    def cerrar(comunidad: dict) -> dict:
+        comunidad["coste_total"] = float(comunidad["coste_total"])
+        for inmueble in comunidad["inmuebles"]:
+            inmueble["coste_total"] = float(inmueble["coste_total"])
+        return comunidad
+
+    comunidad = None
+    inmueble = None
+    for fila in iterar_query(filas):
+        if comunidad is None or comunidad["id"] != fila.comunidad_id:
+            if comunidad is not None:
+                yield cerrar(comunidad)
+            comunidad = {
+                "id": fila.comunidad_id,
+                "nombre": fila.nombre,
+                "cif": fila.cif,
+                "direccion": fila.comunidad_direccion,
+                "num_incidencias": 0,
+                "coste_total": Decimal('0.00'),
+                "incidencias_por_estado": {},
+                "inmuebles": []
+            }
+            inmueble = None
+
+        if inmueble is None or inmueble["id"] != fila.inmueble_id:
+            inmueble = {
+                "id": fila.inmueble_id,
+                "referencia": fila.referencia,
+                "direccion": fila.inmueble_direccion,
+                "metros": float(fila.metros) if fila.metros else None,
+                "tipo": fila.tipo,
+                "num_incidencias": 0,
+                "coste_total": Decimal('0.00'),
+                "incidencias_por_estado": {}
+            }
+            comunidad["inmuebles"].append(inmueble)
+
+        estado = fila.estado.value if hasattr(fila.estado, 'value') else str(fila.estado)
+        coste = Decimal(str(fila.coste or 0))
+
+        inmueble["num_incidencias"] += fila.num_incidencias
+        inmueble["coste_total"] += coste
+        inmueble["incidencias_por_estado"][estado] = {"count": fila.num_incidencias, "coste": float(coste)}
+
+        comunidad["num_incidencias"] += fila.num_incidencias
+        comunidad["coste_total"] += coste
+        por_estado = comunidad["incidencias_por_estado"].setdefault(estado, {"count": 0, "coste": 0.0})
+        por_estado["count"] += fila.num_incidencias
+        por_estado["coste"] += float(coste)
+
+    if comunidad is not None:
+        yield cerrar(comunidad)
+
+def _iterar_proveedores(db: Session, fecha_inicio_dt: datetime, fecha_fin_dt: datetime) -> Iterator[dict]:
+    """
+    Genera el informe de cada proveedor de uno en uno.
+
+    Una sola consulta agrupada por (proveedor_id, estado) con el número de incidencias
+    y la suma de Actuacion.coste calculada en la base de datos, leída con un cursor
+    de servidor. Solo aparecen proveedores con incidencias en el período.
+    """
+    coste_incidencia = _coste_por_incidencia_subquery(fecha_inicio_dt, fecha_fin_dt)
+    filas = (
+        db.query(
+            Proveedor.id.label("proveedor_id"),
+            Proveedor.nombre,
+            Proveedor.email,
+            Proveedor.telefono,
+            Proveedor.especialidad,
+            Incidencia.estado,
+            func.count(Incidencia.id).label("num_incidencias"),
+            func.coalesce(func.sum(coste_incidencia.c.coste), 0).label("coste"),
+        )
+        .join(Incidencia, Incidencia.proveedor_id == Proveedor.id)
+        .outerjoin(coste_incidencia, coste_incidencia.c.incidencia_id == Incidencia.id)
+        .filter(
+            Incidencia.fecha_alta >= fecha_inicio_dt,
+            Incidencia.fecha_alta <= fecha_fin_dt,
+        )
+        .group_by(
+            Proveedor.id, Proveedor.nombre, Proveedor.email, Proveedor.telefono, Proveedor.especialidad,
+            Incidencia.estado,
+        )
+        .order_by(Proveedor.id)
+    )
+
+    def cerrar(proveedor: dict) -> dict:
+        proveedor["coste_total"] = float(proveedor["coste_total"])
+        return proveedor
+
+    proveedor = None
+    for fila in iterar_query(filas):
+        if proveedor is None or proveedor["id"] != fila.proveedor_id:
+            if proveedor is not None:
+                yield cerrar(proveedor)
+            proveedor = {
+                "id": fila.proveedor_id,
+                "nombre": fila.nombre,
+                "email": fila.email,
+                "telefono": fila.telefono,
+                "especialidad": fila.especialidad,
+                "num_incidencias": 0,
+                "coste_total": Decimal('0.00'),
+                "incidencias_por_estado": {}
+            }
+
+        estado = fila.estado.value if hasattr(fila.estado, 'value') else str(fila.estado)
+        coste = Decimal(str(fila.coste or 0))
+        proveedor["num_incidencias"] += fila.num_incidencias
+        proveedor["coste_total"] += coste
+        proveedor["incidencias_por_estado"][estado] = {"count": fila.num_incidencias, "coste": float(coste)}
+
+    if proveedor is not None:
+        yield cerrar(proveedor)
+
+@router.get("/comunidades")
+async def obtener_informes_comunidades(
+    fecha_inicio: Optional[str] = Query(None, description="Fecha de inicio (YYYY-MM-DD)"),
+    fecha_fin: Optional[str] = Query(None, description="Fecha de fin (YYYY-MM-DD)"),
+    db: Session = Depends(get_db),
+    current_user: UsuarioActual = Depends(get_current_user)
+):
+    """
+    Obtiene informes de comunidades con sus inmuebles, número de incidencias y costes totales.
+    Por defecto usa el mes actual si no se especifican fechas.
+    """
+    fecha_inicio_str, fecha_fin_str, fecha_inicio_dt, fecha_fin_dt = _rango_fechas(fecha_inicio, fecha_fin)
+
     return {
         "fecha_inicio": fecha_inicio_str,
         "fecha_fin": fecha_fin_str,
-        "comunidades": resultado
+        "comunidades": list(_iterar_comunidades(db, fecha_inicio_dt, fecha_fin_dt))
     }
 
 @router.get("/proveedores")
@@ -207,79 +269,85 @@ async def obtener_informes_proveedores(
     fecha_inicio: Optional[str] = Query(None, description="Fecha de inicio (YYYY-MM-DD)"),
     fecha_fin: Optional[str] = Query(None, description="Fecha de fin (YYYY-MM-DD)"),
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """
     Obtiene informes de proveedores con número de incidencias y costes totales.
     Por defecto usa el mes actual si no se especifican fechas.
     """
     verificar_admin_informes(current_user)
-    # Si no se especifican fechas, usar el mes actual
-    if not fecha_inicio or not fecha_fin:
-        today = date.today()
-        fecha_inicio, fecha_fin = get_first_and_last_day_of_month(today.year, today.month)
-        fecha_inicio_str = fecha_inicio.isoformat()
-        fecha_fin_str = fecha_fin.isoformat()
-    else:
-        fecha_inicio_str = fecha_inicio
-        fecha_fin_str = fecha_fin
-
-    # Convertir a datetime para la consulta
-    fecha_inicio_dt = datetime.fromisoformat(fecha_inicio_str).replace(hour=0, minute=0, second=0)
-    fecha_fin_dt = datetime.fromisoformat(fecha_fin_str).replace(hour=23, minute=59, second=59)
+    fecha_inicio_str, fecha_fin_str, fecha_inicio_dt, fecha_fin_dt = _rango_fechas(fecha_inicio, fecha_fin)
 
-    # Obtener todos los proveedores
-    proveedores = db.query(Proveedor).all()
-    
-    resultado = []
-    
-    for proveedor in proveedores:
-        # Obtener incidencias asignadas al proveedor en el rango de fechas
-        incidencias = db.query(Incidencia).filter(
-            and_(
-                Incidencia.proveedor_id == proveedor.id,
-                Incidencia.fecha_alta >= fecha_inicio_dt,
-                Incidencia.fecha_alta <= fecha_fin_dt
-            )
-        ).all()
-        
-        # Calcular coste total de las actuaciones de estas incidencias y agrupar por estado
-        coste_total = Decimal('0.00')
-        incidencias_por_estado = {}
-        
-        for incidencia in incidencias:
-            estado = incidencia.estado.value if hasattr(incidencia.estado, 'value') else str(incidencia.estado)
-            if estado not in incidencias_por_estado:
-                incidencias_por_estado[estado] = {"count": 0, "coste": Decimal('0.00')}
-            
-            incidencias_por_estado[estado]["count"] += 1
-            
-            actuaciones = db.query(Actuacion).filter(
-                Actuacion.incidencia_id == incidencia.id
-            ).all()
-            for actuacion in actuaciones:
-                if actuacion.coste:
-                    coste_actuacion = Decimal(str(actuacion.coste))
-                    coste_total += coste_actuacion
-                    incidencias_por_estado[estado]["coste"] += coste_actuacion
-        
-        # Solo agregar proveedores que tengan incidencias
-        if len(incidencias) > 0:
-            resultado.append({
-                "id": proveedor.id,
-                "nombre": proveedor.nombre,
-                "email": proveedor.email,
-                "telefono": proveedor.telefono,
-                "especialidad": proveedor.especialidad,
-                "num_incidencias": len(incidencias),
-                "coste_total": float(coste_total),
-                "incidencias_por_estado": {k: {"count": v["count"], "coste": float(v["coste"])} for k, v in incidencias_por_estado.items()}
-            })
-    
     return {
         "fecha_inicio": fecha_inicio_str,
         "fecha_fin": fecha_fin_str,
-        "proveedores": resultado
+        "proveedores": list(_iterar_proveedores(db, fecha_inicio_dt, fecha_fin_dt))
+    }
+
+HEADERS_COMUNIDADES = ["Comunidad", "CIF", "Dirección", "Inmueble", "Referencia Inmueble", "Nº Incidencias", "Coste Total (€)"]
+HEADERS_PROVEEDORES = ["Proveedor", "Email", "Teléfono", "Especialidad", "Nº Incidencias", "Coste Total (€)"]
+
+def _formatear_coste(coste: float) -> str:
+    return f"{coste:.2f}"
+
+def _filas_comunidades(comunidades: Iterable[dict], coste=_formatear_coste) -> Iterator[list]:
+    """Una fila por comunidad seguida de una fila por cada uno de sus inmuebles."""
+    for comunidad in comunidades:
+        # Fila de comunidad (sin inmueble específico)
+        yield [
+            comunidad["nombre"],
+            comunidad.get("cif") or "",
+            comunidad.get("direccion") or "",
+            "",
+            "",
+            comunidad["num_incidencias"],
+            coste(comunidad["coste_total"]),
+        ]
+        # Filas de inmuebles
+        for inmueble in comunidad.get("inmuebles", []):
+            yield [
+                "",
+                "",
+                "",
+                inmueble.get("direccion") or "",
+                inmueble.get("referencia") or "",
+                inmueble["num_incidencias"],
+                coste(inmueble["coste_total"]),
+            ]
+
+def _filas_proveedores(proveedores: Iterable[dict], coste=_formatear_coste) -> Iterator[list]:
+    for proveedor in proveedores:
+        yield [
+            proveedor["nombre"],
+            proveedor.get("email") or "",
+            proveedor.get("telefono") or "",
+            proveedor.get("especialidad") or "",
+            proveedor["num_incidencias"],
+            coste(proveedor["coste_total"]),
+        ]
+
+def pdf_informes_comunidades(db: Session, fecha_inicio: Optional[str] = None, fecha_fin: Optional[str] = None) -> dict:
+    """Contenido del PDF de comunidades (exportación directa y trabajos en segundo plano)."""
+    fecha_inicio_str, fecha_fin_str, fecha_inicio_dt, fecha_fin_dt = _rango_fechas(fecha_inicio, fecha_fin)
+    comunidades = _iterar_comunidades(db, fecha_inicio_dt, fecha_fin_dt)
+    return {
+        "filename": f"informes_comunidades_{fecha_inicio_str}_{fecha_fin_str}.pdf",
+        "titulo": "Informe de costes por comunidades",
+        "subtitulo": f"Período: {formatear_fecha_espanol(fecha_inicio_str)} - {formatear_fecha_espanol(fecha_fin_str)}",
+        "headers": ["Comunidad", "CIF", "Dirección", "Inmueble", "Referencia", "Nº Incidencias", "Coste Total (€)"],
+        "rows": ([str(valor) for valor in fila] for fila in _filas_comunidades(comunidades)),
+    }
+
+def pdf_informes_proveedores(db: Session, fecha_inicio: Optional[str] = None, fecha_fin: Optional[str] = None) -> dict:
+    """Contenido del PDF de proveedores (exportación directa y trabajos en segundo plano)."""
+    fecha_inicio_str, fecha_fin_str, fecha_inicio_dt, fecha_fin_dt = _rango_fechas(fecha_inicio, fecha_fin)
+    proveedores = _iterar_proveedores(db, fecha_inicio_dt, fecha_fin_dt)
+    return {
+        "filename": f"informes_proveedores_{fecha_inicio_str}_{fecha_fin_str}.pdf",
+        "titulo": "Informe de costes por proveedores",
+        "subtitulo": f"Período: {formatear_fecha_espanol(fecha_inicio_str)} - {formatear_fecha_espanol(fecha_fin_str)}",
+        "headers": HEADERS_PROVEEDORES,
+        "rows": ([str(valor) for valor in fila] for fila in _filas_proveedores(proveedores)),
     }
 
 @router.get("/comunidades/exportar/{formato}")
@@ -288,179 +356,36 @@ async def exportar_informes_comunidades(
     fecha_inicio: Optional[str] = Query(None, description="Fecha de inicio (YYYY-MM-DD)"),
     fecha_fin: Optional[str] = Query(None, description="Fecha de fin (YYYY-MM-DD)"),
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """
     Exporta informes de comunidades en formato PDF, Excel o CSV.
+    CSV y Excel se generan en streaming a partir del cursor de la consulta.
     """
-    # Obtener los datos
-    datos = await obtener_informes_comunidades(fecha_inicio, fecha_fin, db, current_user)
-    
-    if formato.lower() == "csv":
-        # Generar CSV
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Período en formato español
-        fecha_inicio_es = formatear_fecha_espanol(datos['fecha_inicio'])
-        fecha_fin_es = formatear_fecha_espanol(datos['fecha_fin'])
-        writer.writerow([f"Período: {fecha_inicio_es} - {fecha_fin_es}"])
-        writer.writerow([])  # Línea en blanco
-        
-        # Encabezados
-        writer.writerow(["Comunidad", "CIF", "Dirección", "Inmueble", "Referencia Inmueble", "Nº Incidencias", "Coste Total (€)"])
-        
-        # Datos
-        for comunidad in datos["comunidades"]:
-            # Fila de comunidad (sin inmueble específico)
-            writer.writerow([
-                comunidad["nombre"],
-                comunidad["cif"] or "",
-                comunidad["direccion"] or "",
-                "",
-                "",
-                comunidad["num_incidencias"],
-                f"{comunidad['coste_total']:.2f}"
-            ])
-            
-            # Filas de inmuebles
-            for inmueble in comunidad["inmuebles"]:
-                writer.writerow([
-                    "",
-                    "",
-                    "",
-                    inmueble["direccion"] or "",
-                    inmueble["referencia"],
-                    inmueble["num_incidencias"],
-                    f"{inmueble['coste_total']:.2f}"
-                ])
-        
-        csv_content = output.getvalue()
-        output.close()
-        
-        return Response(
-            content=csv_content,
-            media_type="text/csv",
-            headers={
-                "Content-Disposition": f"attachment; filename=informes_comunidades_{datos['fecha_inicio']}_{datos['fecha_fin']}.csv"
-            }
-        )
-    
-    elif formato.lower() == "excel":
-        # Para Excel necesitaríamos openpyxl o xlsxwriter
-        # Por ahora devolvemos CSV con extensión .xlsx (o mejor, implementamos con openpyxl)
-        try:
-            import openpyxl
-            from openpyxl.styles import Font, Alignment
-            
-            wb = openpyxl.Workbook()
-            ws = wb.active
-            ws.title = "Informes Comunidades"
-            
-            # Período en formato español
-            fecha_inicio_es = formatear_fecha_espanol(datos['fecha_inicio'])
-            fecha_fin_es = formatear_fecha_espanol(datos['fecha_fin'])
-            periodo_cell = ws.cell(row=1, column=1, value=f"Período: {fecha_inicio_es} - {fecha_fin_es}")
-            periodo_cell.font = Font(bold=True, size=12)
-            ws.append([])  # Línea en blanco
-            
-            # Encabezados
-            headers = ["Comunidad", "CIF", "Dirección", "Inmueble", "Referencia Inmueble", "Nº Incidencias", "Coste Total (€)"]
-            ws.append(headers)
-            
-            # Estilo para encabezados
-            for cell in ws[1]:
-                cell.font = Font(bold=True)
-                cell.alignment = Alignment(horizontal="center")
-            
-            # Datos
-            for comunidad in datos["comunidades"]:
-                # Fila de comunidad
-                ws.append([
-                    comunidad["nombre"],
-                    comunidad["cif"] or "",
-                    comunidad["direccion"] or "",
-                    "",
-                    "",
-                    comunidad["num_incidencias"],
-                    comunidad["coste_total"]
-                ])
-                
-                # Filas de inmuebles
-                for inmueble in comunidad["inmuebles"]:
-                    ws.append([
-                        "",
-                        "",
-                        "",
-                        inmueble["direccion"] or "",
-                        inmueble["referencia"],
-                        inmueble["num_incidencias"],
-                        inmueble["coste_total"]
-                    ])
-            
-            # Ajustar ancho de columnas
-            ws.column_dimensions['A'].width = 30
-            ws.column_dimensions['B'].width = 15
-            ws.column_dimensions['C'].width = 40
-            ws.column_dimensions['D'].width = 40
-            ws.column_dimensions['E'].width = 20
-            ws.column_dimensions['F'].width = 15
-            ws.column_dimensions['G'].width = 15
-            
-            # Guardar en memoria
-            output = io.BytesIO()
-            wb.save(output)
-            output.seek(0)
-            
-            return Response(
-                content=output.read(),
-                media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                headers={
-                    "Content-Disposition": f"attachment; filename=informes_comunidades_{datos['fecha_inicio']}_{datos['fecha_fin']}.xlsx"
-                }
-            )
-        except ImportError:
-            raise HTTPException(status_code=500, detail="openpyxl no está instalado. Instálelo con: pip install openpyxl")
-    
-    elif formato.lower() == "pdf":
-        titulo = "Informe de costes por comunidades"
-        fecha_inicio_es = formatear_fecha_espanol(datos['fecha_inicio'])
-        fecha_fin_es = formatear_fecha_espanol(datos['fecha_fin'])
-        subtitulo = f"Período: {fecha_inicio_es} - {fecha_fin_es}"
-        headers = ["Comunidad", "CIF", "Dirección", "Inmueble", "Referencia", "Nº Incidencias", "Coste Total (€)"]
-        rows = []
-        for comunidad in datos["comunidades"]:
-            rows.append([
-                comunidad["nombre"],
-                comunidad.get("cif") or "",
-                comunidad.get("direccion") or "",
-                "",
-                "",
-                str(comunidad["num_incidencias"]),
-                f"{comunidad['coste_total']:.2f}",
-            ])
-            for inmueble in comunidad.get("inmuebles", []):
-                rows.append([
-                    "",
-                    "",
-                    "",
-                    inmueble.get("direccion") or "",
-                    inmueble.get("referencia") or "",
-                    str(inmueble["num_incidencias"]),
-                    f"{inmueble['coste_total']:.2f}",
-                ])
-
-        pdf_bytes = _build_pdf(titulo, subtitulo, headers, rows)
-        return Response(
-            content=pdf_bytes,
-            media_type="application/pdf",
-            headers={
-                "Content-Disposition": f"attachment; filename=informes_comunidades_{datos['fecha_inicio']}_{datos['fecha_fin']}.pdf"
-            },
+    formato = validar_formato(formato)
+    if formato == "pdf":
+        return await pdf_response(pdf_informes_comunidades(db, fecha_inicio, fecha_fin))
+
+    fecha_inicio_str, fecha_fin_str, fecha_inicio_dt, fecha_fin_dt = _rango_fechas(fecha_inicio, fecha_fin)
+    comunidades = _iterar_comunidades(db, fecha_inicio_dt, fecha_fin_dt)
+
+    # Período en formato español
+    periodo = f"Período: {formatear_fecha_espanol(fecha_inicio_str)} - {formatear_fecha_espanol(fecha_fin_str)}"
+    nombre_base = f"informes_comunidades_{fecha_inicio_str}_{fecha_fin_str}"
+
+    if formato == "csv":
+        return csv_streaming_response(
+            f"{nombre_base}.csv", HEADERS_COMUNIDADES, _filas_comunidades(comunidades), titulo=periodo
         )
-    
-    else:
-        raise HTTPException(status_code=400, detail="Formato no válido. Use: csv, excel o pdf")
+
+    return xlsx_streaming_response(
+        f"{nombre_base}.xlsx",
+        "Informes Comunidades",
+        HEADERS_COMUNIDADES,
+        _filas_comunidades(comunidades, coste=float),
+        titulo=periodo,
+        anchos={"A": 30, "B": 15, "C": 40, "D": 40, "E": 20, "F": 15, "G": 15},
+    )
 
 @router.get("/proveedores/exportar/{formato}")
 async def exportar_informes_proveedores(
@@ -468,127 +393,33 @@ async def exportar_informes_proveedores(
     fecha_inicio: Optional[str] = Query(None, description="Fecha de inicio (YYYY-MM-DD)"),
     fecha_fin: Optional[str] = Query(None, description="Fecha de fin (YYYY-MM-DD)"),
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """
     Exporta informes de proveedores en formato PDF, Excel o CSV.
+    CSV y Excel se generan en streaming a partir del cursor de la consulta.
     """
-    # Obtener los datos
-    datos = await obtener_informes_proveedores(fecha_inicio, fecha_fin, db, current_user)
-    
-    if formato.lower() == "csv":
-        # Generar CSV
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Período en formato español
-        fecha_inicio_es = formatear_fecha_espanol(datos['fecha_inicio'])
-        fecha_fin_es = formatear_fecha_espanol(datos['fecha_fin'])
-        writer.writerow([f"Período: {fecha_inicio_es} - {fecha_fin_es}"])
-        writer.writerow([])  # Línea en blanco
-        
-        # Encabezados
-        writer.writerow(["Proveedor", "Email", "Teléfono", "Especialidad", "Nº Incidencias", "Coste Total (€)"])
-        
-        # Datos
-        for proveedor in datos["proveedores"]:
-            writer.writerow([
-                proveedor["nombre"],
-                proveedor["email"] or "",
-                proveedor["telefono"] or "",
-                proveedor["especialidad"] or "",
-                proveedor["num_incidencias"],
-                f"{proveedor['coste_total']:.2f}"
-            ])
-        
-        csv_content = output.getvalue()
-        output.close()
-        
-        return Response(
-            content=csv_content,
-            media_type="text/csv",
-            headers={
-                "Content-Disposition": f"attachment; filename=informes_proveedores_{datos['fecha_inicio']}_{datos['fecha_fin']}.csv"
-            }
-        )
-    
-    elif formato.lower() == "excel":
-        try:
-            import openpyxl
-            from openpyxl.styles import Font, Alignment
-            
-            wb = openpyxl.Workbook()
-            ws = wb.active
-            ws.title = "Informes Proveedores"
-            
-            # Encabezados
-            headers = ["Proveedor", "Email", "Teléfono", "Especialidad", "Nº Incidencias", "Coste Total (€)"]
-            ws.append(headers)
-            
-            # Estilo para encabezados
-            for cell in ws[1]:
-                cell.font = Font(bold=True)
-                cell.alignment = Alignment(horizontal="center")
-            
-            # Datos
-            for proveedor in datos["proveedores"]:
-                ws.append([
-                    proveedor["nombre"],
-                    proveedor["email"] or "",
-                    proveedor["telefono"] or "",
-                    proveedor["especialidad"] or "",
-                    proveedor["num_incidencias"],
-                    proveedor["coste_total"]
-                ])
-            
-            # Ajustar ancho de columnas
-            ws.column_dimensions['A'].width = 30
-            ws.column_dimensions['B'].width = 30
-            ws.column_dimensions['C'].width = 15
-            ws.column_dimensions['D'].width = 20
-            ws.column_dimensions['E'].width = 15
-            ws.column_dimensions['F'].width = 15
-            
-            # Guardar en memoria
-            output = io.BytesIO()
-            wb.save(output)
-            output.seek(0)
-            
-            return Response(
-                content=output.read(),
-                media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                headers={
-                    "Content-Disposition": f"attachment; filename=informes_proveedores_{datos['fecha_inicio']}_{datos['fecha_fin']}.xlsx"
-                }
-            )
-        except ImportError:
-            raise HTTPException(status_code=500, detail="openpyxl no está instalado. Instálelo con: pip install openpyxl")
-    
-    elif formato.lower() == "pdf":
-        titulo = "Informe de costes por proveedores"
-        fecha_inicio_es = formatear_fecha_espanol(datos['fecha_inicio'])
-        fecha_fin_es = formatear_fecha_espanol(datos['fecha_fin'])
-        subtitulo = f"Período: {fecha_inicio_es} - {fecha_fin_es}"
-        headers = ["Proveedor", "Email", "Teléfono", "Especialidad", "Nº Incidencias", "Coste Total (€)"]
-        rows = []
-        for proveedor in datos["proveedores"]:
-            rows.append([
-                proveedor["nombre"],
-                proveedor.get("email") or "",
-                proveedor.get("telefono") or "",
-                proveedor.get("especialidad") or "",
-                str(proveedor["num_incidencias"]),
-                f"{proveedor['coste_total']:.2f}",
-            ])
-
-        pdf_bytes = _build_pdf(titulo, subtitulo, headers, rows)
-        return Response(
-            content=pdf_bytes,
-            media_type="application/pdf",
-            headers={
-                "Content-Disposition": f"attachment; filename=informes_proveedores_{datos['fecha_inicio']}_{datos['fecha_fin']}.pdf"
-            },
+    verificar_admin_informes(current_user)
+    formato = validar_formato(formato)
+    if formato == "pdf":
+        return await pdf_response(pdf_informes_proveedores(db, fecha_inicio, fecha_fin))
+
+    fecha_inicio_str, fecha_fin_str, fecha_inicio_dt, fecha_fin_dt = _rango_fechas(fecha_inicio, fecha_fin)
+    proveedores = _iterar_proveedores(db, fecha_inicio_dt, fecha_fin_dt)
+
+    # Período en formato español
+    periodo = f"Período: {formatear_fecha_espanol(fecha_inicio_str)} - {formatear_fecha_espanol(fecha_fin_str)}"
+    nombre_base = f"informes_proveedores_{fecha_inicio_str}_{fecha_fin_str}"
+
+    if formato == "csv":
+        return csv_streaming_response(
+            f"{nombre_base}.csv", HEADERS_PROVEEDORES, _filas_proveedores(proveedores), titulo=periodo
         )
-    
-    else:
-        raise HTTPException(status_code=400, detail="Formato no válido. Use: csv, excel o pdf")
+
+    return xlsx_streaming_response(
+        f"{nombre_base}.xlsx",
+        "Informes Proveedores",
+        HEADERS_PROVEEDORES,
+        _filas_proveedores(proveedores, coste=float),
+        anchos={"A": 30, "B": 30, "C": 15, "D": 20, "E": 15, "F": 15},
+    )
@@ -6,12 +6,13 @@ from app.models.inmueble import Inmueble
 from app.models.comunidad import Comunidad
 from app.models.incidencia import Incidencia
 from app.models.propietario import Propietario
-from app.models.usuario import Usuario
 from app.schemas.inmueble import InmuebleCreate, InmuebleUpdate, InmuebleResponse, InmuebleSimple
 from app.api.dependencies import get_current_user
+from app.core.user_cache import UsuarioActual
 from app.core.cache import (
-    get_from_cache_async, set_to_cache_async, generate_cache_key,
-    invalidate_inmuebles_cache, invalidate_comunidades_cache, invalidate_propietarios_cache, delete_from_cache
+    get_from_cache_async, set_to_cache_async, generate_cache_key_async,
+    invalidate_inmuebles_cache_async, invalidate_comunidades_cache_async,
+    invalidate_propietarios_cache_async, delete_from_cache
 )
 
 router = APIRouter(prefix="/inmuebles", tags=["inmuebles"])
@@ -23,7 +24,7 @@ def get_propietario_by_usuario(db: Session, usuario_id: int) -> Optional[Propiet
 @router.get("/mis-inmuebles", response_model=List[InmuebleSimple])
 async def listar_mis_inmuebles(
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Lista los inmuebles del propietario actual (versión simplificada para móvil)"""
     if current_user.rol != "propietario":
@@ -33,7 +34,7 @@ async def listar_mis_inmuebles(
         )
     
     # Generar clave de caché (específica por usuario)
-    cache_key = generate_cache_key("inmuebles:mis-inmuebles", usuario_id=current_user.id)
+    cache_key = await generate_cache_key_async("inmuebles:mis-inmuebles", usuario_id=current_user.id)
     
     # Intentar obtener de caché (versión async con hilos - no bloquea el event loop)
     cached_result = await get_from_cache_async(cache_key)
@@ -59,10 +60,10 @@ async def listar_inmuebles(
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=100),
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     # Generar clave de caché (incluir rol para diferenciar por usuario)
-    cache_key = generate_cache_key(
+    cache_key = await generate_cache_key_async(
         f"inmuebles:list:{current_user.rol}",
         comunidad_id=comunidad_id,
         tipo=tipo,
@@ -133,10 +134,10 @@ async def listar_inmuebles(
 async def obtener_inmueble(
     inmueble_id: int,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     # Generar clave de caché
-    cache_key = generate_cache_key("inmuebles:item", id=inmueble_id, usuario_id=current_user.id)
+    cache_key = await generate_cache_key_async("inmuebles:item", id=inmueble_id, usuario_id=current_user.id)
     
     # Intentar obtener de caché (versión async con hilos - no bloquea el event loop)
     cached_result = await get_from_cache_async(cache_key)
@@ -197,7 +198,7 @@ async def obtener_inmueble(
 async def crear_inmueble(
     inmueble_data: InmuebleCreate,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     if current_user.rol not in ["super_admin", "admin_fincas"]:
         raise HTTPException(
@@ -235,10 +236,10 @@ async def crear_inmueble(
     ).filter(Inmueble.id == nuevo_inmueble.id).first()
     
     # Invalidar caché de inmuebles, comunidades y propietarios (si se asignaron propietarios)
-    invalidate_inmuebles_cache()
-    invalidate_comunidades_cache()
+    await invalidate_inmuebles_cache_async()
+    await invalidate_comunidades_cache_async()
     if inmueble_data.propietario_ids:
-        invalidate_propietarios_cache()
+        await invalidate_propietarios_cache_async()
     
     # Construir respuesta manualmente
     inmueble_dict = {
@@ -270,7 +271,7 @@ async def actualizar_inmueble(
     inmueble_id: int,
     inmueble_data: InmuebleUpdate,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     if current_user.rol not in ["super_admin", "admin_fincas"]:
         raise HTTPException(
@@ -310,9 +311,9 @@ async def actualizar_inmueble(
     ).filter(Inmueble.id == inmueble_id).first()
     
     # Invalidar caché de inmuebles, comunidades y propietarios (porque los propietarios pueden haber cambiado)
-    invalidate_inmuebles_cache()
-    invalidate_comunidades_cache()
-    invalidate_propietarios_cache()
+    await invalidate_inmuebles_cache_async()
+    await invalidate_comunidades_cache_async()
+    await invalidate_propietarios_cache_async()
     
     # Construir respuesta manualmente
     inmueble_dict = {
@@ -343,7 +344,7 @@ async def actualizar_inmueble(
 async def eliminar_inmueble(
     inmueble_id: int,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     if current_user.rol not in ["super_admin", "admin_fincas"]:
         raise HTTPException(
@@ -381,10 +382,10 @@ async def eliminar_inmueble(
     db.commit()
     
     # Invalidar caché de inmuebles, comunidades y propietarios (si tenía propietarios)
-    invalidate_inmuebles_cache()
-    invalidate_comunidades_cache()
+    await invalidate_inmuebles_cache_async()
+    await invalidate_comunidades_cache_async()
     if tiene_propietarios:
-        invalidate_propietarios_cache()
+        await invalidate_propietarios_cache_async()
     
     return None
 
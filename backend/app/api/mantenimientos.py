@@ -1,16 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
 from sqlalchemy.orm import Session, joinedload
 from typing import List, Optional
 from datetime import datetime, date, timedelta, timezone
-from app.database import get_db
+from app.database import get_db, run_sync_in_session
 from app.models.mantenimiento import Mantenimiento, TipoMantenimiento, EstadoMantenimiento
 from app.models.vehiculo import Vehiculo, EstadoVehiculo
-from app.models.usuario import Usuario
 from app.schemas.mantenimiento import MantenimientoCreate, MantenimientoUpdate, MantenimientoResponse
 from app.api.dependencies import get_current_user
+from app.core.user_cache import UsuarioActual
 from app.core.cache import (
-    get_from_cache_async, set_to_cache_async, generate_cache_key,
-    invalidate_mantenimientos_cache, delete_from_cache
+    get_from_cache_async, set_to_cache_async, get_or_set_cache_async, generate_cache_key_async,
+    invalidate_mantenimientos_cache_async, delete_from_cache, CachedJSON
 )
 
 router = APIRouter(prefix="/mantenimientos", tags=["mantenimientos"])
@@ -102,42 +102,17 @@ def mantenimiento_proximo_vencer(fecha_caducidad: Optional[datetime], dias_alert
     # Retorna True si está entre hoy y los días de alerta (0 a dias_alerta días)
     return resultado
 
-@router.get("/", response_model=List[MantenimientoResponse])
-async def listar_mantenimientos(
-    vehiculo_id: Optional[int] = Query(None),
-    tipo: Optional[TipoMantenimiento] = Query(None),
-    estado: Optional[EstadoMantenimiento] = Query(None),
-    proximos_vencer: Optional[bool] = Query(None, description="Filtrar solo mantenimientos próximos a vencer (30 días)"),
-    vencidos: Optional[bool] = Query(None, description="Filtrar solo mantenimientos vencidos"),
-    skip: int = Query(0, ge=0),
-    limit: int = Query(100, ge=1, le=100),
-    db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
-):
-    """Listar todos los mantenimientos con filtros opcionales"""
-    if current_user.rol not in ["super_admin", "admin_transportes"]:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="No tiene permisos para ver mantenimientos"
-        )
-    
-    # Generar clave de caché
-    cache_key = generate_cache_key(
-        "mantenimientos:list",
-        vehiculo_id=vehiculo_id,
-        tipo=tipo.value if tipo else None,
-        estado=estado.value if estado else None,
-        proximos_vencer=proximos_vencer,
-        vencidos=vencidos,
-        skip=skip,
-        limit=limit
-    )
-    
-    # Intentar obtener de caché
-    cached_result = await get_from_cache_async(cache_key)
-    if cached_result is not None:
-        return cached_result
-    
+def _listar_mantenimientos(
+    db: Session,
+    vehiculo_id: Optional[int],
+    tipo: Optional[TipoMantenimiento],
+    estado: Optional[EstadoMantenimiento],
+    proximos_vencer: Optional[bool],
+    vencidos: Optional[bool],
+    skip: int,
+    limit: int,
+) -> List[dict]:
+    """Página de mantenimientos con su vehículo, ya serializada (marca como vencidos los caducados)."""
     query = db.query(Mantenimiento).options(joinedload(Mantenimiento.vehiculo))
     
     if vehiculo_id:
@@ -209,24 +184,63 @@ async def listar_mantenimientos(
             }
         else:
             mantenimiento_dict["vehiculo"] = None
-        resultados.append(MantenimientoResponse(**mantenimiento_dict))
+        resultados.append(MantenimientoResponse(**mantenimiento_dict).model_dump())
     
-    # Convertir a dict para caché
-    result_dicts = [r.model_dump() if hasattr(r, 'model_dump') else r for r in resultados]
+    return resultados
+
+
+@router.get("/", response_model=List[MantenimientoResponse])
+async def listar_mantenimientos(
+    request: Request,
+    vehiculo_id: Optional[int] = Query(None),
+    tipo: Optional[TipoMantenimiento] = Query(None),
+    estado: Optional[EstadoMantenimiento] = Query(None),
+    proximos_vencer: Optional[bool] = Query(None, description="Filtrar solo mantenimientos próximos a vencer (30 días)"),
+    vencidos: Optional[bool] = Query(None, description="Filtrar solo mantenimientos vencidos"),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=100),
+    current_user: UsuarioActual = Depends(get_current_user)
+):
+    """Listar todos los mantenimientos con filtros opcionales"""
+    if current_user.rol not in ["super_admin", "admin_transportes"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="No tiene permisos para ver mantenimientos"
+        )
     
-    # Almacenar en caché (5 minutos)
-    await set_to_cache_async(cache_key, result_dicts, expire=300)
+    # Generar clave de caché
+    cache_key = await generate_cache_key_async(
+        "mantenimientos:list",
+        vehiculo_id=vehiculo_id,
+        tipo=tipo.value if tipo else None,
+        estado=estado.value if estado else None,
+        proximos_vencer=proximos_vencer,
+        vencidos=vencidos,
+        skip=skip,
+        limit=limit
+    )
     
-    return resultados
+    async def calcular():
+        # Sesión propia: el cálculo puede terminar después de la petición (refresco en segundo plano)
+        resultados = await run_sync_in_session(
+            _listar_mantenimientos, vehiculo_id, tipo, estado, proximos_vencer, vencidos, skip, limit
+        )
+        # Cuerpo JSON final: un acierto de caché se devuelve sin validar ni serializar
+        return CachedJSON.from_value(List[MantenimientoResponse], resultados)
+    
+    # Caché fresca 5 minutos; después, y durante 5 minutos más, se sirve el valor
+    # anterior mientras se recalcula en segundo plano (stale-while-revalidate)
+    respuesta = await get_or_set_cache_async(cache_key, calcular, expire=300, stale_while_revalidate=300)
+    return respuesta.to_response(request)
 
 @router.get("/alertas", response_model=List[MantenimientoResponse])
 async def obtener_alertas_mantenimientos(
     dias_alerta: int = Query(30, ge=1, le=365, description="Días de anticipación para alertar"),
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     # Generar clave de caché
-    cache_key = generate_cache_key("mantenimientos:alertas", dias_alerta=dias_alerta)
+    cache_key = await generate_cache_key_async("mantenimientos:alertas", dias_alerta=dias_alerta)
     
     # Intentar obtener de caché
     cached_result = await get_from_cache_async(cache_key)
@@ -378,7 +392,7 @@ async def obtener_alertas_mantenimientos(
 async def obtener_mantenimiento(
     mantenimiento_id: int,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Obtener un mantenimiento por su ID"""
     if current_user.rol not in ["super_admin", "admin_transportes"]:
@@ -388,7 +402,7 @@ async def obtener_mantenimiento(
         )
     
     # Generar clave de caché
-    cache_key = generate_cache_key("mantenimientos:item", id=mantenimiento_id)
+    cache_key = await generate_cache_key_async("mantenimientos:item", id=mantenimiento_id)
     
     # Intentar obtener de caché
     cached_result = await get_from_cache_async(cache_key)
@@ -433,7 +447,7 @@ async def obtener_mantenimiento(
 async def crear_mantenimiento(
     mantenimiento_data: MantenimientoCreate,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Crear un nuevo mantenimiento"""
     try:
@@ -461,7 +475,7 @@ async def crear_mantenimiento(
         db.refresh(nuevo_mantenimiento)
         
         # Invalidar caché de mantenimientos
-        invalidate_mantenimientos_cache()
+        await invalidate_mantenimientos_cache_async()
         
         # Cargar explícitamente el vehículo para evitar problemas con la relación
         # Usar el vehículo que ya tenemos en memoria en lugar de hacer otra consulta
@@ -518,7 +532,7 @@ async def actualizar_mantenimiento(
     mantenimiento_id: int,
     mantenimiento_data: MantenimientoUpdate,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Actualizar un mantenimiento existente"""
     if current_user.rol not in ["super_admin", "admin_transportes"]:
@@ -550,7 +564,7 @@ async def actualizar_mantenimiento(
     db.refresh(mantenimiento)
     
     # Invalidar caché de mantenimientos
-    invalidate_mantenimientos_cache()
+    await invalidate_mantenimientos_cache_async()
     
     # Si el estado cambió, actualizar el estado del vehículo
     # Esto asegura que el vehículo cambie correctamente cuando:
@@ -590,7 +604,7 @@ async def actualizar_mantenimiento(
 async def eliminar_mantenimiento(
     mantenimiento_id: int,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Eliminar un mantenimiento"""
     if current_user.rol not in ["super_admin", "admin_transportes"]:
@@ -613,7 +627,7 @@ async def eliminar_mantenimiento(
     db.commit()
     
     # Invalidar caché de mantenimientos
-    invalidate_mantenimientos_cache()
+    await invalidate_mantenimientos_cache_async()
     
     # Si el mantenimiento eliminado estaba en curso, actualizar el estado del vehículo
     if estado_mantenimiento == EstadoMantenimiento.EN_CURSO:
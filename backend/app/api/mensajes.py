@@ -9,14 +9,15 @@ from app.models.proveedor import Proveedor
 from app.models.propietario import Propietario
 from app.schemas.mensaje import MensajeCreate, MensajeResponse
 from app.api.dependencies import get_current_user
+from app.core.user_cache import UsuarioActual
 from app.core.cache import (
-    get_from_cache_async, set_to_cache_async, generate_cache_key,
-    invalidate_mensajes_cache, delete_from_cache
+    get_from_cache_async, set_to_cache_async, generate_cache_key_async,
+    invalidate_mensajes_cache_async, delete_from_cache_async
 )
 
 router = APIRouter(prefix="/mensajes", tags=["mensajes"])
 
-def verificar_acceso_incidencia(db: Session, incidencia_id: int, usuario: Usuario) -> Incidencia:
+def verificar_acceso_incidencia(db: Session, incidencia_id: int, usuario: UsuarioActual) -> Incidencia:
     """Verifica que el usuario tenga acceso a la incidencia"""
     incidencia = db.query(Incidencia).filter(Incidencia.id == incidencia_id).first()
     if not incidencia:
@@ -59,7 +60,7 @@ def mensaje_to_response(mensaje: Mensaje, db: Session) -> dict:
 async def listar_mensajes(
     incidencia_id: int,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Lista todos los mensajes de una incidencia"""
     verificar_acceso_incidencia(db, incidencia_id, current_user)
@@ -75,7 +76,7 @@ async def crear_mensaje(
     incidencia_id: int,
     mensaje_data: MensajeCreate,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Crea un nuevo mensaje en una incidencia"""
     verificar_acceso_incidencia(db, incidencia_id, current_user)
@@ -90,8 +91,8 @@ async def crear_mensaje(
     db.refresh(nuevo_mensaje)
     
     # Invalidar caché de mensajes de esta incidencia
-    invalidate_mensajes_cache()
-    delete_from_cache(generate_cache_key("mensajes:incidencia", incidencia_id=incidencia_id))
+    await invalidate_mensajes_cache_async()
+    await delete_from_cache_async(await generate_cache_key_async("mensajes:incidencia", incidencia_id=incidencia_id))
     
     return mensaje_to_response(nuevo_mensaje, db)
 
@@ -99,7 +100,7 @@ async def crear_mensaje(
 async def eliminar_mensaje(
     mensaje_id: int,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Elimina un mensaje (solo el autor y si es el último mensaje)"""
     mensaje = db.query(Mensaje).filter(Mensaje.id == mensaje_id).first()
@@ -123,8 +124,8 @@ async def eliminar_mensaje(
     db.commit()
     
     # Invalidar caché de mensajes de esta incidencia
-    invalidate_mensajes_cache()
-    delete_from_cache(generate_cache_key("mensajes:incidencia", incidencia_id=incidencia_id))
+    await invalidate_mensajes_cache_async()
+    await delete_from_cache_async(await generate_cache_key_async("mensajes:incidencia", incidencia_id=incidencia_id))
     
     return None
 
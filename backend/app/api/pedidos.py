@@ -1,27 +1,30 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
 from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
-from app.database import get_db
+from app.database import get_db, get_async_db
 from app.models.pedido import Pedido, EstadoPedido
 from app.models.ruta import RutaParada, Ruta, EstadoRuta
-from app.models.usuario import Usuario
 from app.schemas.pedido import PedidoCreate, PedidoUpdate, PedidoResponse
 from app.api.dependencies import get_current_user
+from app.core.user_cache import UsuarioActual
 from app.core.cache import (
-    get_from_cache_async, set_to_cache_async, generate_cache_key,
-    invalidate_pedidos_cache, delete_from_cache
+    get_from_cache_async, set_to_cache_async, get_or_set_cache_async, generate_cache_key_async,
+    invalidate_pedidos_cache_async, delete_from_cache, CachedJSON
 )
 
 router = APIRouter(prefix="/pedidos", tags=["pedidos"])
 
 @router.get("/", response_model=List[PedidoResponse])
 async def listar_pedidos(
+    request: Request,
     estado: Optional[EstadoPedido] = Query(None),
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=100),
     no_cache: bool = Query(False, description="Forzar recarga sin caché"),
-    db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Listar todos los pedidos con filtros opcionales"""
     # Verificar permisos
@@ -32,37 +35,37 @@ async def listar_pedidos(
         )
     
     # Generar clave de caché
-    cache_key = generate_cache_key(
+    cache_key = await generate_cache_key_async(
         "pedidos:list",
         estado=estado.value if estado else None,
         skip=skip,
         limit=limit
     )
     
-    # Intentar obtener de caché solo si no se fuerza la recarga
-    if not no_cache:
-        cached_result = await get_from_cache_async(cache_key)
-        if cached_result is not None:
-            return cached_result
-    
-    query = db.query(Pedido)
-    
-    if estado:
-        query = query.filter(Pedido.estado == estado)
-    
-    pedidos = query.order_by(Pedido.creado_en.desc()).offset(skip).limit(limit).all()
-    result = [PedidoResponse.model_validate(ped).model_dump() for ped in pedidos]
-    
-    # Almacenar en caché (5 minutos) - versión async con hilos
-    await set_to_cache_async(cache_key, result, expire=300)
-    
-    return result
+    async def calcular():
+        query = select(Pedido)
+        
+        if estado:
+            query = query.where(Pedido.estado == estado)
+        
+        pedidos = (await db.execute(query.order_by(Pedido.creado_en.desc()).offset(skip).limit(limit))).scalars().all()
+        # Cuerpo JSON final: un acierto de caché se devuelve sin validar ni serializar
+        return CachedJSON.from_value(List[PedidoResponse], [PedidoResponse.model_validate(ped) for ped in pedidos])
+    
+    # Forzar la recarga: consultar y refrescar la caché (5 minutos)
+    if no_cache:
+        result = await calcular()
+        await set_to_cache_async(cache_key, result, expire=300)
+        return result.to_response(request)
+    
+    # Caché de 5 minutos; un solo cálculo por clave ante fallos concurrentes
+    return (await get_or_set_cache_async(cache_key, calcular, expire=300)).to_response(request)
 
 @router.get("/{pedido_id}", response_model=PedidoResponse)
 async def obtener_pedido(
     pedido_id: int,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Obtener un pedido por ID"""
     # Verificar permisos
@@ -73,7 +76,7 @@ async def obtener_pedido(
         )
     
     # Generar clave de caché
-    cache_key = generate_cache_key("pedidos:item", id=pedido_id)
+    cache_key = await generate_cache_key_async("pedidos:item", id=pedido_id)
     
     # Intentar obtener de caché (versión async con hilos - no bloquea el event loop)
     cached_result = await get_from_cache_async(cache_key)
@@ -98,7 +101,7 @@ async def obtener_pedido(
 async def crear_pedido(
     pedido_data: PedidoCreate,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Crear un nuevo pedido"""
     # Verificar permisos
@@ -114,7 +117,7 @@ async def crear_pedido(
     db.refresh(nuevo_pedido)
     
     # Invalidar caché de pedidos
-    invalidate_pedidos_cache()
+    await invalidate_pedidos_cache_async()
     
     return PedidoResponse.model_validate(nuevo_pedido)
 
@@ -123,7 +126,7 @@ async def actualizar_pedido(
     pedido_id: int,
     pedido_data: PedidoUpdate,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Actualizar un pedido existente"""
     # Verificar permisos
@@ -149,7 +152,7 @@ async def actualizar_pedido(
     db.refresh(pedido)
     
     # Invalidar caché de pedidos
-    invalidate_pedidos_cache()
+    await invalidate_pedidos_cache_async()
     
     return PedidoResponse.model_validate(pedido)
 
@@ -157,7 +160,7 @@ async def actualizar_pedido(
 async def eliminar_pedido(
     pedido_id: int,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Eliminar un pedido"""
     # Verificar permisos
@@ -190,7 +193,7 @@ async def eliminar_pedido(
     db.commit()
     
     # Invalidar caché de pedidos
-    invalidate_pedidos_cache()
+    await invalidate_pedidos_cache_async()
     
     return None
 
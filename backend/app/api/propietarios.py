@@ -8,9 +8,11 @@ from app.models.usuario import Usuario
 from app.schemas.propietario import PropietarioCreate, PropietarioUpdate, PropietarioResponse
 from app.api.dependencies import get_current_user
 from app.core.security import get_password_hash
+from app.core.user_cache import UsuarioActual, invalidar_usuario_cache
 from app.core.cache import (
-    get_from_cache_async, set_to_cache_async, generate_cache_key,
-    invalidate_propietarios_cache, invalidate_inmuebles_cache, invalidate_usuarios_cache, delete_from_cache
+    get_from_cache_async, set_to_cache_async, generate_cache_key_async,
+    invalidate_propietarios_cache_async, invalidate_inmuebles_cache_async,
+    invalidate_usuarios_cache_async, delete_from_cache
 )
 
 router = APIRouter(prefix="/propietarios", tags=["propietarios"])
@@ -35,10 +37,10 @@ async def listar_propietarios(
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=100),
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     # Generar clave de caché
-    cache_key = generate_cache_key("propietarios:list", skip=skip, limit=limit)
+    cache_key = await generate_cache_key_async("propietarios:list", skip=skip, limit=limit)
     
     # Intentar obtener de caché (versión async con hilos - no bloquea el event loop)
     cached_result = await get_from_cache_async(cache_key)
@@ -59,10 +61,10 @@ async def listar_propietarios(
 async def obtener_propietario(
     propietario_id: int,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     # Generar clave de caché
-    cache_key = generate_cache_key("propietarios:item", id=propietario_id)
+    cache_key = await generate_cache_key_async("propietarios:item", id=propietario_id)
     
     # Intentar obtener de caché (versión async con hilos - no bloquea el event loop)
     cached_result = await get_from_cache_async(cache_key)
@@ -90,7 +92,7 @@ async def obtener_propietario(
 async def crear_propietario(
     propietario_data: PropietarioCreate,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     if current_user.rol not in ["super_admin", "admin_fincas"]:
         raise HTTPException(
@@ -144,7 +146,7 @@ async def crear_propietario(
         db.add(nuevo_usuario)
         db.flush()  # Para obtener el ID del usuario
         nuevo_propietario.usuario_id = nuevo_usuario.id
-        invalidate_usuarios_cache()
+        await invalidate_usuarios_cache_async()
     
     # Asociar inmuebles si se proporcionan
     if propietario_data.inmueble_ids:
@@ -158,9 +160,9 @@ async def crear_propietario(
     db.refresh(nuevo_propietario)
     
     # Invalidar caché de propietarios e inmuebles (si se asignaron inmuebles)
-    invalidate_propietarios_cache()
+    await invalidate_propietarios_cache_async()
     if propietario_data.inmueble_ids:
-        invalidate_inmuebles_cache()
+        await invalidate_inmuebles_cache_async()
     
     return PropietarioResponse.model_validate(propietario_to_response(nuevo_propietario))
 
@@ -169,7 +171,7 @@ async def actualizar_propietario(
     propietario_id: int,
     propietario_data: PropietarioUpdate,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     if current_user.rol not in ["super_admin", "admin_fincas"]:
         raise HTTPException(
@@ -199,14 +201,17 @@ async def actualizar_propietario(
                 detail="Ya existe un propietario con ese email"
             )
     
+    # Usuarios cuyo acceso cambia: se sacan de la caché de autenticación tras el commit
+    emails_usuario_cache = []
     # Quitar acceso: eliminar usuario asociado
     if propietario_data.quitar_acceso and propietario.usuario_id:
         usuario = db.query(Usuario).filter(Usuario.id == propietario.usuario_id).first()
         if usuario:
+            emails_usuario_cache.append(usuario.email)
             db.delete(usuario)
             db.flush()
         propietario.usuario_id = None
-        invalidate_usuarios_cache()
+        await invalidate_usuarios_cache_async()
     
     # Crear usuario: si no tiene y se solicita
     if propietario_data.crear_usuario and not propietario.usuario_id:
@@ -237,7 +242,7 @@ async def actualizar_propietario(
         db.add(nuevo_usuario)
         db.flush()
         propietario.usuario_id = nuevo_usuario.id
-        invalidate_usuarios_cache()
+        await invalidate_usuarios_cache_async()
     
     update_data = propietario_data.model_dump(
         exclude_unset=True,
@@ -257,8 +262,9 @@ async def actualizar_propietario(
     db.refresh(propietario)
     
     # Invalidar caché de propietarios e inmuebles (porque los inmuebles ahora tienen propietarios actualizados)
-    invalidate_propietarios_cache()
-    invalidate_inmuebles_cache()
+    await invalidar_usuario_cache(*emails_usuario_cache)
+    await invalidate_propietarios_cache_async()
+    await invalidate_inmuebles_cache_async()
     
     return PropietarioResponse.model_validate(propietario_to_response(propietario))
 
@@ -266,7 +272,7 @@ async def actualizar_propietario(
 async def eliminar_propietario(
     propietario_id: int,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     if current_user.rol not in ["super_admin", "admin_fincas"]:
         raise HTTPException(
@@ -283,12 +289,14 @@ async def eliminar_propietario(
     
     # Guardar el ID del usuario antes de eliminar el propietario
     usuario_id = propietario.usuario_id
+    email_usuario_eliminado = None
     
     # Si el propietario tenía un usuario asociado, eliminarlo primero
     # (antes de eliminar el propietario para evitar problemas de foreign key)
     if usuario_id:
         usuario = db.query(Usuario).filter(Usuario.id == usuario_id).first()
         if usuario:
+            email_usuario_eliminado = usuario.email
             db.delete(usuario)
             db.flush()  # Hacer flush para aplicar la eliminación del usuario antes de eliminar el propietario
     
@@ -297,12 +305,13 @@ async def eliminar_propietario(
     # pero los inmuebles NO se eliminarán.
     db.delete(propietario)
     db.commit()
+    await invalidar_usuario_cache(email_usuario_eliminado)
     
     # Invalidar caché de propietarios, inmuebles y usuarios
-    invalidate_propietarios_cache()
-    invalidate_inmuebles_cache()
+    await invalidate_propietarios_cache_async()
+    await invalidate_inmuebles_cache_async()
     if usuario_id:
-        invalidate_usuarios_cache()
+        await invalidate_usuarios_cache_async()
     
     return None
 
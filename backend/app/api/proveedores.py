@@ -7,9 +7,10 @@ from app.models.usuario import Usuario
 from app.schemas.proveedor import ProveedorCreate, ProveedorUpdate, ProveedorResponse
 from app.api.dependencies import get_current_user
 from app.core.security import get_password_hash
+from app.core.user_cache import UsuarioActual, invalidar_usuario_cache
 from app.core.cache import (
-    get_from_cache_async, set_to_cache_async, generate_cache_key,
-    invalidate_proveedores_cache, invalidate_usuarios_cache, delete_from_cache
+    get_from_cache_async, set_to_cache_async, generate_cache_key_async,
+    invalidate_proveedores_cache_async, invalidate_usuarios_cache_async, delete_from_cache
 )
 
 router = APIRouter(prefix="/proveedores", tags=["proveedores"])
@@ -20,7 +21,7 @@ def proveedor_to_response(proveedor: Proveedor) -> dict:
     d["tiene_acceso"] = proveedor.usuario_id is not None
     return d
 
-def verificar_admin_fincas(current_user: Usuario):
+def verificar_admin_fincas(current_user: UsuarioActual):
     if current_user.rol not in ["super_admin", "admin_fincas"]:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -34,10 +35,10 @@ async def listar_proveedores(
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=100),
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     # Generar clave de caché
-    cache_key = generate_cache_key(
+    cache_key = await generate_cache_key_async(
         "proveedores:list",
         activo=activo,
         especialidad=especialidad,
@@ -69,10 +70,10 @@ async def listar_proveedores(
 async def obtener_proveedor(
     proveedor_id: int,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     # Generar clave de caché
-    cache_key = generate_cache_key("proveedores:item", id=proveedor_id)
+    cache_key = await generate_cache_key_async("proveedores:item", id=proveedor_id)
     
     # Intentar obtener de caché (versión async con hilos - no bloquea el event loop)
     cached_result = await get_from_cache_async(cache_key)
@@ -94,7 +95,7 @@ async def obtener_proveedor(
 async def crear_proveedor(
     proveedor_data: ProveedorCreate,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     verificar_admin_fincas(current_user)
     
@@ -124,7 +125,7 @@ async def crear_proveedor(
         db.add(nuevo_usuario)
         db.flush()  # Para obtener el ID
         usuario_id = nuevo_usuario.id
-        invalidate_usuarios_cache()
+        await invalidate_usuarios_cache_async()
     
     # Crear proveedor (excluyendo password del dump)
     proveedor_dict = proveedor_data.model_dump(exclude={'password', 'usuario_id'})
@@ -134,7 +135,7 @@ async def crear_proveedor(
     db.refresh(nuevo_proveedor)
     
     # Invalidar caché de proveedores
-    invalidate_proveedores_cache()
+    await invalidate_proveedores_cache_async()
     
     return proveedor_to_response(nuevo_proveedor)
 
@@ -143,7 +144,7 @@ async def actualizar_proveedor(
     proveedor_id: int,
     proveedor_data: ProveedorUpdate,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     verificar_admin_fincas(current_user)
     
@@ -157,14 +158,17 @@ async def actualizar_proveedor(
         if existente:
             raise HTTPException(status_code=400, detail="Ya existe un proveedor con ese email")
     
+    # Usuarios cuyo acceso cambia: se sacan de la caché de autenticación tras el commit
+    emails_usuario_cache = []
     # Quitar acceso: eliminar usuario asociado
     if proveedor_data.quitar_acceso and proveedor.usuario_id:
         usuario = db.query(Usuario).filter(Usuario.id == proveedor.usuario_id).first()
         if usuario:
+            emails_usuario_cache.append(usuario.email)
             db.delete(usuario)
             db.flush()
         proveedor.usuario_id = None
-        invalidate_usuarios_cache()
+        await invalidate_usuarios_cache_async()
     
     # Crear usuario: si no tiene y se solicita
     if proveedor_data.crear_usuario and not proveedor.usuario_id:
@@ -195,7 +199,7 @@ async def actualizar_proveedor(
         db.add(nuevo_usuario)
         db.flush()
         proveedor.usuario_id = nuevo_usuario.id
-        invalidate_usuarios_cache()
+        await invalidate_usuarios_cache_async()
     
     update_data = proveedor_data.model_dump(
         exclude_unset=True,
@@ -208,7 +212,8 @@ async def actualizar_proveedor(
     db.refresh(proveedor)
     
     # Invalidar caché de proveedores
-    invalidate_proveedores_cache()
+    await invalidar_usuario_cache(*emails_usuario_cache)
+    await invalidate_proveedores_cache_async()
     
     return proveedor_to_response(proveedor)
 
@@ -216,7 +221,7 @@ async def actualizar_proveedor(
 async def eliminar_proveedor(
     proveedor_id: int,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     verificar_admin_fincas(current_user)
     
@@ -226,6 +231,7 @@ async def eliminar_proveedor(
     
     # Guardar el usuario_id antes de eliminar el proveedor
     usuario_id = proveedor.usuario_id
+    email_usuario_eliminado = None
     
     # Eliminar el proveedor primero
     db.delete(proveedor)
@@ -235,13 +241,15 @@ async def eliminar_proveedor(
     if usuario_id:
         usuario = db.query(Usuario).filter(Usuario.id == usuario_id).first()
         if usuario:
+            email_usuario_eliminado = usuario.email
             db.delete(usuario)
-            invalidate_usuarios_cache()
+            await invalidate_usuarios_cache_async()
     
     db.commit()
     
     # Invalidar caché de proveedores
-    invalidate_proveedores_cache()
+    await invalidar_usuario_cache(email_usuario_eliminado)
+    await invalidate_proveedores_cache_async()
     
     return None
 
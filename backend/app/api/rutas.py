@@ -1,34 +1,45 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, UploadFile, File, Form
 from typing import Annotated
-from fastapi.responses import FileResponse, JSONResponse
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_, func, case
+from fastapi.responses import JSONResponse
+from sqlalchemy.orm import Session, joinedload, selectinload, contains_eager
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, case, exists, literal_column, or_, and_
+from sqlalchemy.exc import IntegrityError
 from typing import List, Optional
 from datetime import date, datetime, timedelta
 from datetime import timezone
 import os
-import uuid
+import base64
 import logging
-from app.database import get_db
+from app.database import get_db, get_async_db, run_sync_in_session
 from app.models.ruta import Ruta, RutaParada, EstadoRuta, EstadoParada, TipoOperacion
 from app.models.vehiculo import Vehiculo, EstadoVehiculo
 from app.models.conductor import Conductor
+from app.models.mantenimiento import Mantenimiento, EstadoMantenimiento
 from app.models.pedido import Pedido, EstadoPedido
 from app.models.usuario import Usuario
 from app.models.incidencia_ruta import IncidenciaRuta, IncidenciaRutaFoto, TipoIncidenciaRuta
-from app.schemas.ruta import RutaCreate, RutaUpdate, RutaResponse, RutaParadaCreate, RutaParadaResponse, RutaParadaUpdate
+from app.models.ruta_eliminacion import RutaEliminacion
+from app.schemas.ruta import (
+    RutaCreate, RutaUpdate, RutaResponse, RutaParadaCreate, RutaParadaResponse, RutaParadaUpdate,
+    DisponibilidadResponse, CambiosRutasResponse, EliminacionesRutas
+)
 from app.schemas.incidencia_ruta import IncidenciaRutaCreate, IncidenciaRutaResponse
 from app.api.dependencies import get_current_user
+from app.core.user_cache import UsuarioActual
 from app.core.security import decode_access_token
+from app.core.config import settings
+from app.core.storage import store_upload, release_file, file_exists, file_name, file_response
+from app.core.thumbnails import TAMANO_ORIGINAL, TAMANOS, schedule_derivatives, derivative_response
 from app.core.cache import (
-    get_from_cache_async, set_to_cache_async, generate_cache_key,
-    invalidate_rutas_cache, invalidate_pedidos_cache, invalidate_cache_pattern, delete_from_cache
+    get_from_cache_async, set_to_cache_async, get_or_set_cache_async, generate_cache_key_async,
+    invalidate_rutas_cache_async, invalidate_pedidos_cache_async, delete_from_cache,
+    get_cache_generation_async, CachedJSON
 )
 
 router = APIRouter(prefix="/rutas", tags=["rutas"])
 
-# Directorio para almacenar fotos de incidencias de ruta
-UPLOAD_DIR_INCIDENCIAS_RUTA = "/app/uploads/incidencias_ruta"
+# Fotos de incidencias de ruta (almacén por contenido, app.core.storage)
 MAX_FILE_SIZE_INCIDENCIA_RUTA = 10 * 1024 * 1024  # 10MB
 
 def formatear_fecha(fecha) -> Optional[str]:
@@ -93,55 +104,180 @@ def datetime_to_iso_utc(dt) -> Optional[str]:
     return None
 
 
-def build_paradas_lista(ruta, db: Session) -> List[dict]:
+def _parada_a_dict(p: RutaParada) -> dict:
+    """Parada con su pedido y fechas en ISO UTC (forma de RutaParadaResponse)."""
+    pedido = p.pedido
+    return {
+        "id": p.id,
+        "ruta_id": p.ruta_id,
+        "pedido_id": p.pedido_id,
+        "orden": p.orden,
+        "direccion": p.direccion or "",
+        "tipo_operacion": p.tipo_operacion.value,
+        "ventana_horaria": p.ventana_horaria,
+        "fecha_hora_llegada": datetime_to_iso_utc(p.fecha_hora_llegada),
+        "fecha_hora_completada": datetime_to_iso_utc(getattr(p, "fecha_hora_completada", None)) if getattr(p, "fecha_hora_completada", None) else None,
+        "estado": p.estado.value,
+        "ruta_foto": getattr(p, "ruta_foto", None),
+        "ruta_firma": getattr(p, "ruta_firma", None),
+        "creado_en": formatear_datetime(p.creado_en) if p.creado_en else None,
+        "pedido": {"id": pedido.id, "cliente": pedido.cliente, "origen": pedido.origen, "destino": pedido.destino} if pedido else None,
+    }
+
+
+def build_paradas_lista(ruta, db: Optional[Session] = None) -> List[dict]:
     """Construye la lista de paradas: una entrada por RutaParada (sin agrupar), con fechas en ISO UTC."""
-    paradas_lista = []
-    for p in ruta.paradas:
-        pedido = db.query(Pedido).filter(Pedido.id == p.pedido_id).first()
-        paradas_lista.append({
-            "id": p.id,
-            "ruta_id": p.ruta_id,
-            "pedido_id": p.pedido_id,
-            "orden": p.orden,
-            "direccion": p.direccion or "",
-            "tipo_operacion": p.tipo_operacion.value,
-            "ventana_horaria": p.ventana_horaria,
-            "fecha_hora_llegada": datetime_to_iso_utc(p.fecha_hora_llegada),
-            "fecha_hora_completada": datetime_to_iso_utc(getattr(p, "fecha_hora_completada", None)) if getattr(p, "fecha_hora_completada", None) else None,
-            "estado": p.estado.value,
-            "ruta_foto": getattr(p, "ruta_foto", None),
-            "ruta_firma": getattr(p, "ruta_firma", None),
-            "creado_en": formatear_datetime(p.creado_en) if p.creado_en else None,
-            "pedido": {"id": pedido.id, "cliente": pedido.cliente, "origen": pedido.origen, "destino": pedido.destino} if pedido else None,
-        })
-    return paradas_lista
-
-
-def _incidencias_ruta_basic(db: Session, ruta_id: int) -> dict:
-    """Devuelve {'incidencias_count': int, 'tiene_incidencias': bool}."""
-    count = db.query(IncidenciaRuta).filter(IncidenciaRuta.ruta_id == ruta_id).count()
-    return {"incidencias_count": count, "tiene_incidencias": count > 0}
-
-
-def _incidencias_ruta_full(db: Session, ruta_id: int) -> List[dict]:
-    incidencias = db.query(IncidenciaRuta).filter(IncidenciaRuta.ruta_id == ruta_id).order_by(IncidenciaRuta.creado_en.desc()).all()
-    result: List[dict] = []
-    for inc in incidencias:
-        fotos = [
-            {"id": f.id, "tipo_archivo": f.tipo_archivo}
-            for f in (inc.fotos or [])
-        ]
-        result.append({
-            "id": inc.id,
-            "ruta_id": inc.ruta_id,
-            "ruta_parada_id": inc.ruta_parada_id,
-            "creador_usuario_id": inc.creador_usuario_id,
-            "tipo": inc.tipo.value if inc.tipo else None,
-            "descripcion": inc.descripcion,
-            "creado_en": inc.creado_en,
-            "fotos": fotos
-        })
-    return result
+    # Pedidos ya cargados si la ruta viene de _opciones_ruta_completa (si no, carga perezosa)
+    return [_parada_a_dict(p) for p in ruta.paradas]
+
+
+def _incidencia_a_dict(inc: IncidenciaRuta) -> dict:
+    """Incidencia de ruta con sus fotos (forma de IncidenciaRutaResponse)."""
+    return {
+        "id": inc.id,
+        "ruta_id": inc.ruta_id,
+        "ruta_parada_id": inc.ruta_parada_id,
+        "creador_usuario_id": inc.creador_usuario_id,
+        "tipo": inc.tipo.value if inc.tipo else None,
+        "descripcion": inc.descripcion,
+        "creado_en": inc.creado_en,
+        "fotos": [{"id": f.id, "tipo_archivo": f.tipo_archivo} for f in inc.fotos]
+    }
+
+
+def _opciones_ruta_completa() -> list:
+    """
+    Opciones de carga de todo lo que serializa _serializar_ruta, para una página de
+    rutas en un número fijo de consultas: rutas con conductor y vehículo (JOIN),
+    paradas, sus pedidos, incidencias y sus fotos (una consulta IN por relación).
+    """
+    return [
+        joinedload(Ruta.conductor),
+        joinedload(Ruta.vehiculo),
+        selectinload(Ruta.paradas).selectinload(RutaParada.pedido),
+        selectinload(Ruta.incidencias_ruta).selectinload(IncidenciaRuta.fotos),
+    ]
+
+
+def _serializar_ruta(ruta: Ruta) -> RutaResponse:
+    """
+    RutaResponse completa (paradas, conductor, vehículo e incidencias) a partir de las
+    relaciones ya cargadas con _opciones_ruta_completa: no lanza consultas.
+    """
+    incidencias = sorted(
+        ruta.incidencias_ruta,
+        key=lambda inc: (inc.creado_en is not None, inc.creado_en),
+        reverse=True
+    )
+    return RutaResponse(
+        id=ruta.id,
+        fecha=formatear_fecha(ruta.fecha),
+        fecha_inicio=formatear_datetime(ruta.fecha_inicio) if ruta.fecha_inicio else None,
+        fecha_fin=formatear_datetime(ruta.fecha_fin) if ruta.fecha_fin else None,
+        conductor_id=ruta.conductor_id,
+        vehiculo_id=ruta.vehiculo_id,
+        observaciones=ruta.observaciones,
+        estado=ruta.estado.value,
+        creado_en=formatear_datetime(ruta.creado_en) if ruta.creado_en else None,
+        paradas=build_paradas_lista(ruta),
+        conductor={
+            "id": ruta.conductor.id,
+            "nombre": ruta.conductor.nombre,
+            "apellidos": ruta.conductor.apellidos
+        } if ruta.conductor else None,
+        vehiculo={
+            "id": ruta.vehiculo.id,
+            "nombre": ruta.vehiculo.nombre,
+            "matricula": ruta.vehiculo.matricula
+        } if ruta.vehiculo else None,
+        incidencias=[_incidencia_a_dict(inc) for inc in incidencias],
+        incidencias_count=len(incidencias),
+        tiene_incidencias=bool(incidencias)
+    )
+
+
+# Periodo de una ruta como rango cerrado [fecha_inicio, fecha_fin]: dos rutas se solapan
+# también si una empieza justo cuando termina la otra. La expresión (con '[]' literal)
+# debe coincidir con la de los índices GiST / restricciones de exclusión de
+# scripts/create_performance_indexes.sql para que PostgreSQL los use.
+_LIMITES_PERIODO = literal_column("'[]'")
+
+# Restricciones de exclusión (create_performance_indexes.sql) -> recurso en el mensaje de error.
+# Solo cubren rutas planificadas: las horas reales de inicio y fin (iniciar_ruta /
+# finalizar_ruta) pueden solaparse con la siguiente ruta sin impedir registrarlas.
+_RESTRICCIONES_SOLAPE = {
+    "excl_rutas_vehiculo_periodo": "El vehículo",
+    "excl_rutas_conductor_periodo": "El conductor",
+}
+
+
+def _periodo(fecha_inicio, fecha_fin):
+    return func.tstzrange(fecha_inicio, fecha_fin, _LIMITES_PERIODO)
+
+
+def _condiciones_solape(db: Session, fecha_inicio: datetime, fecha_fin: datetime) -> list:
+    """
+    Condiciones sobre Ruta de las rutas no canceladas cuyo periodo se solapa con
+    [fecha_inicio, fecha_fin].
+    
+    En PostgreSQL es un solape de rangos (tstzrange &&) que resuelve el índice GiST
+    (recurso, periodo) en O(log n) aunque crezca el histórico de rutas; en otras bases
+    de datos, la comparación equivalente de extremos.
+    """
+    condiciones = [
+        Ruta.estado != EstadoRuta.CANCELADA,
+        Ruta.fecha_inicio.isnot(None),
+        Ruta.fecha_fin.isnot(None),
+    ]
+    if db.get_bind().dialect.name == "postgresql":
+        condiciones.append(_periodo(Ruta.fecha_inicio, Ruta.fecha_fin).op("&&")(_periodo(fecha_inicio, fecha_fin)))
+    else:
+        condiciones.extend([Ruta.fecha_inicio <= fecha_fin, Ruta.fecha_fin >= fecha_inicio])
+    return condiciones
+
+
+def _ruta_solapada(
+    db: Session,
+    columna,
+    recurso_id: int,
+    fecha_inicio: datetime,
+    fecha_fin: datetime,
+    ruta_id_excluir: Optional[int] = None,
+) -> Optional[Ruta]:
+    """
+    Primera ruta no cancelada del recurso (columna Ruta.vehiculo_id o Ruta.conductor_id)
+    cuyo periodo se solapa con [fecha_inicio, fecha_fin].
+    """
+    query = db.query(Ruta).filter(columna == recurso_id, *_condiciones_solape(db, fecha_inicio, fecha_fin))
+    if ruta_id_excluir:
+        query = query.filter(Ruta.id != ruta_id_excluir)
+    return query.first()
+
+
+def _liberar_archivos_parada(db: Session, parada: RutaParada) -> None:
+    """Quita las referencias de la foto y la firma de una parada que se va a borrar (app.core.storage)."""
+    release_file(db, parada.ruta_foto)
+    release_file(db, parada.ruta_firma)
+
+
+def _guardar_ruta(db: Session) -> None:
+    """
+    flush de la ruta creada o modificada. Si dos peticiones concurrentes pasan la
+    validación de disponibilidad, la restricción de exclusión rechaza la segunda:
+    se responde 400 como en validar_vehiculo / validar_conductor.
+    """
+    try:
+        db.flush()
+    except IntegrityError as e:
+        restriccion = getattr(getattr(e.orig, "diag", None), "constraint_name", None)
+        if restriccion not in _RESTRICCIONES_SOLAPE:
+            raise
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"{_RESTRICCIONES_SOLAPE[restriccion]} ya tiene otra ruta asignada que se solapa con el rango seleccionado"
+        )
+
 
 def validar_vehiculo(vehiculo_id: int, fecha_inicio: datetime, fecha_fin: datetime, db: Session, ruta_id_excluir: Optional[int] = None) -> Vehiculo:
     """Valida que el vehículo esté disponible, activo y no tenga otra ruta en el rango de fechas"""
@@ -161,28 +297,7 @@ def validar_vehiculo(vehiculo_id: int, fecha_inicio: datetime, fecha_fin: dateti
         )
     
     # Validar que el vehículo no tenga otra ruta que se solape con el rango de fechas
-    # Un rango se solapa con otro si:
-    # - La nueva ruta empieza antes de que termine la existente Y termina después de que empiece la existente
-    query = db.query(Ruta).filter(
-        Ruta.vehiculo_id == vehiculo_id,
-        Ruta.estado != EstadoRuta.CANCELADA,
-        Ruta.fecha_inicio.isnot(None),
-        Ruta.fecha_fin.isnot(None),
-        or_(
-            # Caso 1: La nueva ruta empieza dentro del rango de la existente
-            and_(Ruta.fecha_inicio <= fecha_inicio, Ruta.fecha_fin >= fecha_inicio),
-            # Caso 2: La nueva ruta termina dentro del rango de la existente
-            and_(Ruta.fecha_inicio <= fecha_fin, Ruta.fecha_fin >= fecha_fin),
-            # Caso 3: La nueva ruta contiene completamente a la existente
-            and_(Ruta.fecha_inicio >= fecha_inicio, Ruta.fecha_fin <= fecha_fin),
-            # Caso 4: La existente contiene completamente a la nueva
-            and_(Ruta.fecha_inicio <= fecha_inicio, Ruta.fecha_fin >= fecha_fin)
-        )
-    )
-    if ruta_id_excluir:
-        query = query.filter(Ruta.id != ruta_id_excluir)
-    
-    ruta_existente = query.first()
+    ruta_existente = _ruta_solapada(db, Ruta.vehiculo_id, vehiculo_id, fecha_inicio, fecha_fin, ruta_id_excluir)
     if ruta_existente:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -218,28 +333,7 @@ def validar_conductor(conductor_id: int, fecha_inicio: datetime, fecha_fin: date
         )
     
     # Validar que el conductor no tenga otra ruta que se solape con el rango de fechas
-    # Un rango se solapa con otro si:
-    # - La nueva ruta empieza antes de que termine la existente Y termina después de que empiece la existente
-    query = db.query(Ruta).filter(
-        Ruta.conductor_id == conductor_id,
-        Ruta.estado != EstadoRuta.CANCELADA,
-        Ruta.fecha_inicio.isnot(None),
-        Ruta.fecha_fin.isnot(None),
-        or_(
-            # Caso 1: La nueva ruta empieza dentro del rango de la existente
-            and_(Ruta.fecha_inicio <= fecha_inicio, Ruta.fecha_fin >= fecha_inicio),
-            # Caso 2: La nueva ruta termina dentro del rango de la existente
-            and_(Ruta.fecha_inicio <= fecha_fin, Ruta.fecha_fin >= fecha_fin),
-            # Caso 3: La nueva ruta contiene completamente a la existente
-            and_(Ruta.fecha_inicio >= fecha_inicio, Ruta.fecha_fin <= fecha_fin),
-            # Caso 4: La existente contiene completamente a la nueva
-            and_(Ruta.fecha_inicio <= fecha_inicio, Ruta.fecha_fin >= fecha_fin)
-        )
-    )
-    if ruta_id_excluir:
-        query = query.filter(Ruta.id != ruta_id_excluir)
-    
-    ruta_existente = query.first()
+    ruta_existente = _ruta_solapada(db, Ruta.conductor_id, conductor_id, fecha_inicio, fecha_fin, ruta_id_excluir)
     if ruta_existente:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -528,8 +622,39 @@ def validar_pedidos(pedidos_ids: List[int], db: Session, ruta_id_excluir: Option
                 detail=f"El pedido {pedido.id} ya está asignado a otra ruta activa"
             )
 
+def _listar_rutas(
+    db: Session,
+    fecha: Optional[date],
+    estado: Optional[EstadoRuta],
+    conductor_id: Optional[int],
+    vehiculo_id: Optional[int],
+    skip: int,
+    limit: int,
+) -> List[RutaResponse]:
+    """
+    Página de rutas con paradas, conductor, vehículo e incidencias ya serializadas
+    (número fijo de consultas, independiente del tamaño de la página).
+    """
+    query = db.query(Ruta)
+    
+    if fecha:
+        query = query.filter(Ruta.fecha == fecha)
+    if estado:
+        query = query.filter(Ruta.estado == estado)
+    if conductor_id:
+        query = query.filter(Ruta.conductor_id == conductor_id)
+    if vehiculo_id:
+        query = query.filter(Ruta.vehiculo_id == vehiculo_id)
+    
+    rutas = query.options(*_opciones_ruta_completa()).order_by(
+        Ruta.fecha.desc(), Ruta.creado_en.desc()
+    ).offset(skip).limit(limit).all()
+    
+    return [_serializar_ruta(ruta) for ruta in rutas]
+
 @router.get("/", response_model=List[RutaResponse])
 async def listar_rutas(
+    request: Request,
     fecha: Optional[date] = Query(None),
     estado: Optional[EstadoRuta] = Query(None),
     conductor_id: Optional[int] = Query(None),
@@ -537,8 +662,7 @@ async def listar_rutas(
     solo_con_incidencias: Optional[bool] = Query(None, description="Filtrar solo rutas con incidencias"),
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=100),
-    db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Listar todas las rutas con filtros opcionales"""
     if current_user.rol not in ["super_admin", "admin_transportes"]:
@@ -548,7 +672,7 @@ async def listar_rutas(
         )
     
     # Generar clave de caché
-    cache_key = generate_cache_key(
+    cache_key = await generate_cache_key_async(
         "rutas:list",
         fecha=str(fecha) if fecha else None,
         estado=estado.value if estado else None,
@@ -558,135 +682,52 @@ async def listar_rutas(
         limit=limit
     )
     
-    # Intentar obtener de caché
-    cached_result = await get_from_cache_async(cache_key)
-    if cached_result is not None:
-        return cached_result
-    
-    query = db.query(Ruta)
-    
-    if fecha:
-        query = query.filter(Ruta.fecha == fecha)
-    if estado:
-        query = query.filter(Ruta.estado == estado)
-    if conductor_id:
-        query = query.filter(Ruta.conductor_id == conductor_id)
-    if vehiculo_id:
-        query = query.filter(Ruta.vehiculo_id == vehiculo_id)
-    
-    rutas = query.order_by(Ruta.fecha.desc(), Ruta.creado_en.desc()).offset(skip).limit(limit).all()
-    
-    resultados = []
-    for ruta in rutas:
-        paradas_lista = build_paradas_lista(ruta, db)
-        incidencias_info = _incidencias_ruta_basic(db, ruta.id)
-        incidencias_full = _incidencias_ruta_full(db, ruta.id)
-        ruta_dict = {
-            "id": ruta.id,
-            "fecha": formatear_fecha(ruta.fecha),
-            "fecha_inicio": formatear_datetime(ruta.fecha_inicio) if ruta.fecha_inicio else None,
-            "fecha_fin": formatear_datetime(ruta.fecha_fin) if ruta.fecha_fin else None,
-            "conductor_id": ruta.conductor_id,
-            "vehiculo_id": ruta.vehiculo_id,
-            "observaciones": ruta.observaciones,
-            "estado": ruta.estado.value,
-            "creado_en": formatear_datetime(ruta.creado_en) if ruta.creado_en else None,
-            "paradas": paradas_lista,
-            "conductor": {
-                "id": ruta.conductor.id,
-                "nombre": ruta.conductor.nombre,
-                "apellidos": ruta.conductor.apellidos
-            } if ruta.conductor else None,
-            "vehiculo": {
-                "id": ruta.vehiculo.id,
-                "nombre": ruta.vehiculo.nombre,
-                "matricula": ruta.vehiculo.matricula
-            } if ruta.vehiculo else None,
-            "incidencias": incidencias_full,
-            "incidencias_count": incidencias_info["incidencias_count"],
-            "tiene_incidencias": incidencias_info["tiene_incidencias"]
-        }
-        resultados.append(RutaResponse(**ruta_dict))
-    
-    # Convertir a dict para caché
-    result_dicts = [r.model_dump() if hasattr(r, 'model_dump') else r for r in resultados]
-    
-    # Almacenar en caché (5 minutos)
-    await set_to_cache_async(cache_key, result_dicts, expire=300)
-    
-    return resultados
+    async def calcular():
+        # La consulta y la serialización se ejecutan sobre la conexión asyncpg (run_sync),
+        # en una sesión propia porque el refresco en segundo plano sigue tras la respuesta
+        resultados = await run_sync_in_session(_listar_rutas, fecha, estado, conductor_id, vehiculo_id, skip, limit)
+        # Cuerpo JSON final: un acierto de caché se devuelve sin validar ni serializar
+        return CachedJSON.from_value(List[RutaResponse], resultados)
+    
+    # Caché fresca 5 minutos; después, y durante 5 minutos más, se sirve el valor
+    # anterior mientras se recalcula en segundo plano (stale-while-revalidate)
+    respuesta = await get_or_set_cache_async(cache_key, calcular, expire=300, stale_while_revalidate=300)
+    return respuesta.to_response(request)
 
-@router.get("/mis-rutas", response_model=List[RutaResponse])
-async def obtener_mis_rutas(
-    db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
-):
-    """Obtener las rutas asignadas al conductor autenticado"""
-    if current_user.rol != "conductor":
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Solo los conductores pueden acceder a sus rutas"
-        )
-    
+def _orden_mis_rutas(ruta: Ruta):
+    """Orden de las rutas del conductor: primero EN_CURSO, luego PLANIFICADA, luego COMPLETADA."""
+    estado_orden = {
+        EstadoRuta.EN_CURSO: 1,
+        EstadoRuta.PLANIFICADA: 2,
+        EstadoRuta.COMPLETADA: 3
+    }
+    return (estado_orden.get(ruta.estado, 4), ruta.fecha or date.min)
+
+
+def _mis_rutas(db: Session, usuario_id: int) -> List[RutaResponse]:
+    """Rutas no canceladas del conductor asociado al usuario, ya serializadas."""
     # Obtener el conductor asociado al usuario
-    conductor = db.query(Conductor).filter(Conductor.usuario_id == current_user.id).first()
+    conductor = db.query(Conductor).filter(Conductor.usuario_id == usuario_id).first()
     if not conductor:
         return []
     
     # Obtener todas las rutas del conductor
-    rutas = db.query(Ruta).filter(
+    rutas = db.query(Ruta).options(*_opciones_ruta_completa()).filter(
         Ruta.conductor_id == conductor.id,
         Ruta.estado != EstadoRuta.CANCELADA
     ).all()
     
-    # Ordenar manualmente: primero EN_CURSO, luego PLANIFICADA, luego COMPLETADA
-    def ordenar_rutas(ruta):
-        estado_orden = {
-            EstadoRuta.EN_CURSO: 1,
-            EstadoRuta.PLANIFICADA: 2,
-            EstadoRuta.COMPLETADA: 3
-        }
-        return (estado_orden.get(ruta.estado, 4), ruta.fecha or date.min)
-    
-    rutas = sorted(rutas, key=ordenar_rutas)
+    rutas = sorted(rutas, key=_orden_mis_rutas)
     
     resultados = []
     for ruta in rutas:
         try:
-            paradas_lista = build_paradas_lista(ruta, db)
             # Verificar que conductor_id y vehiculo_id existan
             if not ruta.conductor_id or not ruta.vehiculo_id:
                 logging.warning(f"Ruta {ruta.id} tiene conductor_id o vehiculo_id None, saltando")
                 continue
             
-            incidencias_info = _incidencias_ruta_basic(db, ruta.id)
-            incidencias_full = _incidencias_ruta_full(db, ruta.id)
-            ruta_dict = {
-                "id": ruta.id,
-                "fecha": formatear_fecha(ruta.fecha),
-                "fecha_inicio": formatear_datetime(ruta.fecha_inicio) if ruta.fecha_inicio else None,
-                "fecha_fin": formatear_datetime(ruta.fecha_fin) if ruta.fecha_fin else None,
-                "conductor_id": ruta.conductor_id,
-                "vehiculo_id": ruta.vehiculo_id,
-                "observaciones": ruta.observaciones,
-                "estado": ruta.estado.value,
-                "creado_en": formatear_datetime(ruta.creado_en) if ruta.creado_en else None,
-                "paradas": paradas_lista,
-                "conductor": {
-                    "id": ruta.conductor.id,
-                    "nombre": ruta.conductor.nombre,
-                    "apellidos": ruta.conductor.apellidos
-                } if ruta.conductor else None,
-                "vehiculo": {
-                    "id": ruta.vehiculo.id,
-                    "nombre": ruta.vehiculo.nombre,
-                    "matricula": ruta.vehiculo.matricula
-                } if ruta.vehiculo else None,
-                "incidencias": incidencias_full,
-                "incidencias_count": incidencias_info["incidencias_count"],
-                "tiene_incidencias": incidencias_info["tiene_incidencias"]
-            }
-            resultados.append(RutaResponse(**ruta_dict))
+            resultados.append(_serializar_ruta(ruta))
         except Exception as e:
             # Log del error pero continuar con las demás rutas
             logging.error(f"Error procesando ruta {ruta.id}: {str(e)}")
@@ -694,11 +735,257 @@ async def obtener_mis_rutas(
     
     return resultados
 
+
+@router.get("/mis-rutas", response_model=List[RutaResponse])
+async def obtener_mis_rutas(
+    request: Request,
+    current_user: UsuarioActual = Depends(get_current_user)
+):
+    """
+    Obtener las rutas asignadas al conductor autenticado.
+    
+    La respuesta lleva ETag: si el cliente envía If-None-Match con el mismo valor y
+    sus rutas no han cambiado, se responde 304 sin cuerpo y sin consultar la base de datos.
+    """
+    if current_user.rol != "conductor":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Solo los conductores pueden acceder a sus rutas"
+        )
+    
+    # La respuesta incluye datos de pedidos, conductores y vehículos: la clave lleva
+    # también sus generaciones para que cualquier cambio en ellos la invalide
+    cache_key = await generate_cache_key_async(
+        "rutas:mis_rutas",
+        usuario_id=current_user.id,
+        pedidos=await get_cache_generation_async("pedidos"),
+        conductores=await get_cache_generation_async("conductores"),
+        vehiculos=await get_cache_generation_async("vehiculos")
+    )
+    
+    async def calcular():
+        resultados = await run_sync_in_session(_mis_rutas, current_user.id)
+        return CachedJSON.from_value(List[RutaResponse], resultados)
+    
+    respuesta = await get_or_set_cache_async(cache_key, calcular, expire=300)
+    return respuesta.to_response(request)
+
+def _codificar_cursor_sync(instante: datetime) -> str:
+    """Cursor opaco de sincronización: instante (reloj de la base de datos) de la lectura."""
+    return base64.urlsafe_b64encode(instante.isoformat().encode("utf-8")).decode("ascii")
+
+
+def _decodificar_cursor_sync(cursor: str) -> datetime:
+    try:
+        return datetime.fromisoformat(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8"))
+    except (ValueError, UnicodeError):
+        raise HTTPException(status_code=400, detail="Cursor no válido")
+
+
+def _modificado(modelo):
+    """
+    Instante de la última modificación de una fila: actualizado_en solo se rellena al
+    modificarla (onupdate), así que para las que no han cambiado es creado_en.
+    Debe coincidir con los índices de create_performance_indexes.sql.
+    """
+    return func.coalesce(modelo.actualizado_en, modelo.creado_en)
+
+
+def _cambios_mis_rutas(db: Session, usuario_id: int, desde: Optional[datetime]) -> CambiosRutasResponse:
+    """
+    Cambios en las rutas del conductor posteriores a desde: rutas nuevas o modificadas
+    (completas), paradas e incidencias nuevas o modificadas del resto de rutas y
+    marcas de borrado. Sin desde, o si es anterior a la retención de las marcas de
+    borrado, devuelve la lista completa (la misma que /rutas/mis-rutas).
+    """
+    # Reloj de la base de datos, el mismo que fija actualizado_en/creado_en
+    ahora = db.query(func.now()).scalar()
+    cursor = _codificar_cursor_sync(ahora)
+    
+    conductor = db.query(Conductor).filter(Conductor.usuario_id == usuario_id).first()
+    if not conductor:
+        return CambiosRutasResponse(cursor=cursor, completo=True)
+    if desde is None or desde < ahora - timedelta(days=settings.SYNC_TOMBSTONE_RETENTION_DAYS):
+        return CambiosRutasResponse(cursor=cursor, completo=True, rutas=_mis_rutas(db, usuario_id))
+    
+    # Margen hacia atrás: una transacción que empezó antes de la lectura anterior pudo
+    # confirmarse después con una marca de tiempo anterior al cursor. El cliente
+    # sustituye por id, así que recibir dos veces un cambio no tiene efecto
+    desde = desde - timedelta(seconds=settings.SYNC_CURSOR_OVERLAP_SECONDS)
+    
+    rutas_modificadas = db.query(Ruta).options(*_opciones_ruta_completa()).filter(
+        Ruta.conductor_id == conductor.id,
+        _modificado(Ruta) > desde
+    ).all()
+    # Las canceladas (y las que no tienen vehículo) no aparecen en /rutas/mis-rutas
+    rutas = sorted(
+        (r for r in rutas_modificadas if r.estado != EstadoRuta.CANCELADA and r.vehiculo_id),
+        key=_orden_mis_rutas
+    )
+    ids_rutas = {r.id for r in rutas}
+    ids_ocultas = {r.id for r in rutas_modificadas} - ids_rutas
+    
+    # Paradas modificadas (o cuyo pedido ha cambiado) e incidencias nuevas de las
+    # demás rutas del conductor; las de rutas ya incluidas van dentro de la ruta
+    paradas = db.query(RutaParada).join(Ruta, RutaParada.ruta_id == Ruta.id).join(
+        Pedido, RutaParada.pedido_id == Pedido.id
+    ).options(contains_eager(RutaParada.pedido)).filter(
+        Ruta.conductor_id == conductor.id,
+        Ruta.estado != EstadoRuta.CANCELADA,
+        or_(_modificado(RutaParada) > desde, _modificado(Pedido) > desde)
+    ).order_by(RutaParada.ruta_id, RutaParada.orden).all()
+    
+    incidencias = db.query(IncidenciaRuta).join(Ruta, IncidenciaRuta.ruta_id == Ruta.id).options(
+        selectinload(IncidenciaRuta.fotos)
+    ).filter(
+        Ruta.conductor_id == conductor.id,
+        Ruta.estado != EstadoRuta.CANCELADA,
+        IncidenciaRuta.creado_en > desde
+    ).order_by(IncidenciaRuta.creado_en.desc()).all()
+    
+    marcas = db.query(RutaEliminacion).filter(
+        RutaEliminacion.eliminado_en > desde,
+        or_(
+            and_(RutaEliminacion.tipo == "ruta", RutaEliminacion.conductor_id == conductor.id),
+            and_(
+                RutaEliminacion.tipo != "ruta",
+                RutaEliminacion.ruta_id.in_(db.query(Ruta.id).filter(Ruta.conductor_id == conductor.id))
+            )
+        )
+    ).all()
+    eliminadas = {"ruta": set(ids_ocultas), "parada": set(), "incidencia": set()}
+    for marca in marcas:
+        eliminadas[marca.tipo].add(marca.registro_id)
+    # Una ruta que volvió al conductor después de perderla se envía completa
+    eliminadas["ruta"] -= ids_rutas
+    
+    return CambiosRutasResponse(
+        cursor=cursor,
+        completo=False,
+        rutas=[_serializar_ruta(r) for r in rutas],
+        paradas=[_parada_a_dict(p) for p in paradas if p.ruta_id not in ids_rutas],
+        incidencias=[_incidencia_a_dict(i) for i in incidencias if i.ruta_id not in ids_rutas],
+        eliminadas=EliminacionesRutas(
+            rutas=sorted(eliminadas["ruta"]),
+            paradas=sorted(eliminadas["parada"]),
+            incidencias=sorted(eliminadas["incidencia"])
+        )
+    )
+
+
+@router.get("/mis-rutas/cambios", response_model=CambiosRutasResponse)
+async def obtener_cambios_mis_rutas(
+    desde: Optional[str] = Query(None, description="Cursor de la sincronización anterior (campo cursor); sin él, lista completa"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: UsuarioActual = Depends(get_current_user)
+):
+    """
+    Sincronización incremental de la app móvil: en lugar de descargar /rutas/mis-rutas
+    completo en cada refresco, el conductor envía el cursor de la respuesta anterior y
+    recibe solo lo que ha cambiado desde entonces.
+    
+    El cliente aplica primero eliminadas y después sustituye por id las rutas, paradas
+    e incidencias recibidas. Si completo es True, rutas sustituye a toda la copia local.
+    """
+    if current_user.rol != "conductor":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Solo los conductores pueden acceder a sus rutas"
+        )
+    instante = _decodificar_cursor_sync(desde) if desde else None
+    return await db.run_sync(_cambios_mis_rutas, current_user.id, instante)
+
+
+def _disponibilidad(
+    db: Session,
+    desde: datetime,
+    hasta: datetime,
+    ruta_id_excluir: Optional[int],
+    hoy: date,
+) -> DisponibilidadResponse:
+    """
+    Vehículos y conductores que crear_ruta aceptaría para [desde, hasta]: los mismos
+    criterios que validar_vehiculo y validar_conductor, resueltos para todos a la vez
+    con una consulta por tipo de recurso (NOT EXISTS sobre las rutas solapadas).
+    """
+    solape = _condiciones_solape(db, desde, hasta)
+    if ruta_id_excluir:
+        solape.append(Ruta.id != ruta_id_excluir)
+    
+    vehiculos = db.query(
+        Vehiculo.id, Vehiculo.nombre, Vehiculo.matricula, Vehiculo.capacidad
+    ).filter(
+        Vehiculo.estado == EstadoVehiculo.ACTIVO,
+        ~exists().where(Ruta.vehiculo_id == Vehiculo.id, *solape),
+        ~exists().where(
+            Mantenimiento.vehiculo_id == Vehiculo.id,
+            Mantenimiento.estado == EstadoMantenimiento.EN_CURSO
+        )
+    ).order_by(Vehiculo.nombre, Vehiculo.id).all()
+    
+    conductores = db.query(
+        Conductor.id, Conductor.nombre, Conductor.apellidos,
+        Conductor.licencia, Conductor.fecha_caducidad_licencia
+    ).filter(
+        Conductor.activo.is_(True),
+        Conductor.fecha_caducidad_licencia >= hoy,
+        ~exists().where(Ruta.conductor_id == Conductor.id, *solape)
+    ).order_by(Conductor.nombre, Conductor.apellidos, Conductor.id).all()
+    
+    return DisponibilidadResponse(
+        desde=desde,
+        hasta=hasta,
+        vehiculos=[v._asdict() for v in vehiculos],
+        conductores=[c._asdict() for c in conductores]
+    )
+
+
+@router.get("/disponibilidad", response_model=DisponibilidadResponse)
+async def obtener_disponibilidad(
+    request: Request,
+    desde: datetime = Query(..., description="Inicio de la ruta (fecha y hora de salida)"),
+    hasta: datetime = Query(..., description="Fin de la ruta (fecha y hora de llegada)"),
+    ruta_id: Optional[int] = Query(None, description="Ruta en edición: sus propios recursos cuentan como libres"),
+    current_user: UsuarioActual = Depends(get_current_user)
+):
+    """
+    Vehículos (activos, sin mantenimiento en curso) y conductores (activos, con licencia
+    vigente) sin otra ruta que se solape con [desde, hasta], para los desplegables del
+    planificador de rutas.
+    """
+    if current_user.rol not in ["super_admin", "admin_transportes"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="No tiene permisos para planificar rutas"
+        )
+    validar_fechas_ruta(desde, hasta)
+    
+    # La disponibilidad depende de las rutas (namespace de la clave), de los vehículos,
+    # conductores y mantenimientos (sus generaciones) y de la fecha de hoy (licencias)
+    hoy = date.today()
+    cache_key = await generate_cache_key_async(
+        "rutas:disponibilidad",
+        desde=desde.isoformat(),
+        hasta=hasta.isoformat(),
+        ruta_id=ruta_id,
+        hoy=hoy.isoformat(),
+        vehiculos=await get_cache_generation_async("vehiculos"),
+        conductores=await get_cache_generation_async("conductores"),
+        mantenimientos=await get_cache_generation_async("mantenimientos")
+    )
+    
+    async def calcular():
+        resultado = await run_sync_in_session(_disponibilidad, desde, hasta, ruta_id, hoy)
+        return CachedJSON.from_value(DisponibilidadResponse, resultado)
+    
+    respuesta = await get_or_set_cache_async(cache_key, calcular, expire=300)
+    return respuesta.to_response(request)
+
 @router.get("/{ruta_id}", response_model=RutaResponse)
 async def obtener_ruta(
     ruta_id: int,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Obtener una ruta por ID"""
     ruta = db.query(Ruta).filter(Ruta.id == ruta_id).first()
@@ -724,50 +1011,21 @@ async def obtener_ruta(
         )
     
     # Generar clave de caché
-    cache_key = generate_cache_key("rutas:item", id=ruta_id)
+    cache_key = await generate_cache_key_async("rutas:item", id=ruta_id)
     
     # Intentar obtener de caché
     cached_result = await get_from_cache_async(cache_key)
     if cached_result is not None:
         return cached_result
     
-    ruta = db.query(Ruta).filter(Ruta.id == ruta_id).first()
+    ruta = db.query(Ruta).options(*_opciones_ruta_completa()).filter(Ruta.id == ruta_id).first()
     if not ruta:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Ruta no encontrada"
         )
     
-    paradas_lista = build_paradas_lista(ruta, db)
-    incidencias_info = _incidencias_ruta_basic(db, ruta.id)
-    incidencias_full = _incidencias_ruta_full(db, ruta.id)
-    ruta_dict = {
-        "id": ruta.id,
-        "fecha": formatear_fecha(ruta.fecha),
-        "fecha_inicio": formatear_datetime(ruta.fecha_inicio) if ruta.fecha_inicio else None,
-        "fecha_fin": formatear_datetime(ruta.fecha_fin) if ruta.fecha_fin else None,
-        "conductor_id": ruta.conductor_id,
-        "vehiculo_id": ruta.vehiculo_id,
-        "observaciones": ruta.observaciones,
-        "estado": ruta.estado.value,
-        "creado_en": formatear_datetime(ruta.creado_en) if ruta.creado_en else None,
-        "paradas": paradas_lista,
-        "conductor": {
-            "id": ruta.conductor.id,
-            "nombre": ruta.conductor.nombre,
-            "apellidos": ruta.conductor.apellidos
-        } if ruta.conductor else None,
-        "vehiculo": {
-            "id": ruta.vehiculo.id,
-            "nombre": ruta.vehiculo.nombre,
-            "matricula": ruta.vehiculo.matricula
-        } if ruta.vehiculo else None,
-        "incidencias": incidencias_full,
-        "incidencias_count": incidencias_info["incidencias_count"],
-        "tiene_incidencias": incidencias_info["tiene_incidencias"]
-    }
-    
-    result = RutaResponse(**ruta_dict)
+    result = _serializar_ruta(ruta)
     
     # Almacenar en caché (5 minutos)
     await set_to_cache_async(cache_key, result.model_dump(), expire=300)
@@ -810,7 +1068,7 @@ def crear_paradas_automaticas(pedidos_ids: List[int], db: Session) -> List[dict]
 async def crear_ruta(
     ruta_data: RutaCreate,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Crear una nueva ruta con validaciones. Crea automáticamente paradas de carga y descarga para cada pedido."""
     if current_user.rol not in ["super_admin", "admin_transportes"]:
@@ -893,7 +1151,7 @@ async def crear_ruta(
         estado=EstadoRuta.PLANIFICADA
     )
     db.add(nueva_ruta)
-    db.flush()  # Para obtener el ID de la ruta
+    _guardar_ruta(db)  # Para obtener el ID de la ruta
     
     # Si se proporcionan paradas_con_fechas, crear paradas según el orden especificado
     if ruta_data.paradas_con_fechas:
@@ -994,9 +1252,9 @@ async def crear_ruta(
     db.refresh(nueva_ruta)
     
     # Invalidar caché de rutas y pedidos (porque se actualizaron estados de pedidos)
-    # Usar invalidación síncrona para asegurar que se complete antes de la respuesta
-    invalidate_rutas_cache()
-    invalidate_cache_pattern("pedidos:*")  # Invalidación síncrona para asegurar consistencia
+    # Se espera a la invalidación (un INCR por namespace, sin bloquear el event loop) antes de responder
+    await invalidate_rutas_cache_async()
+    await invalidate_pedidos_cache_async()
     
     # Respuesta mínima para evitar timeout en conexiones lentas (p. ej. Render); el frontend recarga el listado
     return JSONResponse(status_code=201, content={"id": nueva_ruta.id, "creado": True})
@@ -1006,7 +1264,7 @@ async def actualizar_ruta(
     ruta_id: int,
     ruta_data: RutaUpdate,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Actualizar una ruta existente"""
     if current_user.rol not in ["super_admin", "admin_transportes"]:
@@ -1026,8 +1284,8 @@ async def actualizar_ruta(
     fecha_inicio_validar = ruta_data.fecha_inicio if ruta_data.fecha_inicio else ruta.fecha_inicio
     fecha_fin_validar = ruta_data.fecha_fin if ruta_data.fecha_fin else ruta.fecha_fin
     
-    # Validar fechas de ruta si se están actualizando
-    if ruta_data.fecha_inicio and ruta_data.fecha_fin:
+    # Validar fechas de ruta si se actualiza alguna (la otra es la actual)
+    if (ruta_data.fecha_inicio or ruta_data.fecha_fin) and fecha_inicio_validar and fecha_fin_validar:
         validar_fechas_ruta(fecha_inicio_validar, fecha_fin_validar)
     
     # Validar paradas ordenadas si se proporcionan (tiene prioridad sobre pedidos_con_fechas)
@@ -1124,6 +1382,7 @@ async def actualizar_ruta(
                 RutaParada.pedido_id == pedido_id
             ).all()
             for parada in paradas_a_eliminar:
+                _liberar_archivos_parada(db, parada)
                 db.delete(parada)
         
         # Crear paradas para pedidos nuevos
@@ -1310,12 +1569,12 @@ async def actualizar_ruta(
         ruta.fecha = ruta_data.fecha_inicio.date()
     
     # Asegurar que todas las actualizaciones se procesen antes del commit
-    db.flush()
+    _guardar_ruta(db)
     db.commit()
     db.refresh(ruta)
     
     # Invalidar caché de rutas
-    invalidate_rutas_cache()
+    await invalidate_rutas_cache_async()
     
     # Respuesta mínima para evitar timeout en conexiones lentas; el frontend recarga el listado
     return JSONResponse(status_code=200, content={"id": ruta.id, "actualizado": True})
@@ -1326,7 +1585,7 @@ async def actualizar_parada(
     parada_id: int,
     parada_data: RutaParadaUpdate,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Actualizar una parada de una ruta"""
     if current_user.rol not in ["super_admin", "admin_transportes"]:
@@ -1358,6 +1617,9 @@ async def actualizar_parada(
     db.commit()
     db.refresh(parada)
     
+    # Invalidar caché (listados de rutas y mis-rutas incluyen las paradas)
+    await invalidate_rutas_cache_async()
+    
     return RutaParadaResponse(
         id=parada.id,
         ruta_id=parada.ruta_id,
@@ -1375,7 +1637,7 @@ async def actualizar_parada(
 async def eliminar_ruta(
     ruta_id: int,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Eliminar una ruta"""
     if current_user.rol not in ["super_admin", "admin_transportes"]:
@@ -1406,13 +1668,16 @@ async def eliminar_ruta(
             # Restaurar a PENDIENTE siempre, independientemente del estado actual
             pedido.estado = EstadoPedido.PENDIENTE
     
+    # Las paradas se borran en cascada: quitar sus referencias a fotos y firmas
+    for parada in ruta.paradas:
+        _liberar_archivos_parada(db, parada)
     db.delete(ruta)
     db.commit()
     
     # Invalidar caché de rutas y pedidos (porque se actualizaron estados de pedidos)
-    # Usar invalidación síncrona para asegurar que se complete antes de la respuesta
-    invalidate_rutas_cache()
-    invalidate_cache_pattern("pedidos:*")  # Invalidación síncrona para asegurar consistencia
+    # Se espera a la invalidación (un INCR por namespace, sin bloquear el event loop) antes de responder
+    await invalidate_rutas_cache_async()
+    await invalidate_pedidos_cache_async()
     
     return None
 
@@ -1420,7 +1685,7 @@ async def eliminar_ruta(
 async def iniciar_ruta(
     ruta_id: int,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Iniciar una ruta (cambiar estado a EN_CURSO)"""
     if current_user.rol != "conductor":
@@ -1462,11 +1727,12 @@ async def iniciar_ruta(
     # Cambiar estado a EN_CURSO y registrar fecha de inicio
     ruta.estado = EstadoRuta.EN_CURSO
     ruta.fecha_inicio = datetime.now(timezone.utc)
+    _guardar_ruta(db)
     db.commit()
     db.refresh(ruta)
     
     # Invalidar caché
-    invalidate_rutas_cache()
+    await invalidate_rutas_cache_async()
     
     paradas_lista = build_paradas_lista(ruta, db)
     ruta_dict = {
@@ -1498,7 +1764,7 @@ async def iniciar_ruta(
 async def finalizar_ruta(
     ruta_id: int,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Finalizar una ruta (cambiar estado a COMPLETADA)"""
     if current_user.rol != "conductor":
@@ -1556,12 +1822,13 @@ async def finalizar_ruta(
         if pedido and pedido.estado == EstadoPedido.EN_RUTA:
             pedido.estado = EstadoPedido.ENTREGADO
     
+    _guardar_ruta(db)
     db.commit()
     db.refresh(ruta)
     
     # Invalidar caché de rutas y de pedidos para que el listado refleje ENTREGADO
-    invalidate_rutas_cache()
-    invalidate_cache_pattern("pedidos:*")
+    await invalidate_rutas_cache_async()
+    await invalidate_pedidos_cache_async()
     
     paradas_lista = build_paradas_lista(ruta, db)
     ruta_dict = {
@@ -1590,10 +1857,18 @@ async def finalizar_ruta(
     return RutaResponse(**ruta_dict)
 
 
-# Directorio para almacenar fotos y firmas de paradas
-UPLOAD_DIR_PARADAS = "/app/uploads/paradas"
+# Fotos y firmas de paradas (se guardan en el almacén por contenido, app.core.storage)
 ALLOWED_IMAGE_TYPES = {'image/jpeg', 'image/png', 'image/webp'}
 MAX_FILE_SIZE_PARADAS = 10 * 1024 * 1024  # 10MB
+DESCRIPCION_TAMANO_FOTO = "thumb: miniatura, medium: previsualización (WebP reducido), original: archivo subido"
+
+
+def _validar_tamano_foto(size: str) -> None:
+    if size != TAMANO_ORIGINAL and size not in TAMANOS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Tamaño de foto no válido. Valores permitidos: thumb, medium, original"
+        )
 
 @router.put("/{ruta_id}/paradas/{parada_id}/completar", response_model=RutaParadaResponse)
 async def completar_parada(
@@ -1603,7 +1878,7 @@ async def completar_parada(
     foto: Optional[UploadFile] = File(None),
     firma: Optional[UploadFile] = File(None),
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Marcar una parada como completada (ENTREGADO) con foto y firma opcionales"""
     if current_user.rol != "conductor":
@@ -1654,9 +1929,6 @@ async def completar_parada(
             detail="Parada no encontrada"
         )
     
-    # Crear directorio si no existe
-    os.makedirs(UPLOAD_DIR_PARADAS, exist_ok=True)
-    
     # Procesar foto si se proporciona
     ruta_foto = None
     if foto:
@@ -1666,21 +1938,12 @@ async def completar_parada(
                 detail="Tipo de archivo de foto no permitido. Solo se permiten imágenes JPEG, PNG o WebP"
             )
         
-        contenido = await foto.read()
-        if len(contenido) > MAX_FILE_SIZE_PARADAS:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="El archivo de foto excede el tamaño máximo de 10MB"
-            )
-        
         extension = os.path.splitext(foto.filename)[1] if foto.filename else ".jpg"
-        nombre_unico = f"foto_{parada_id}_{uuid.uuid4()}{extension}"
-        ruta_completa = os.path.join(UPLOAD_DIR_PARADAS, nombre_unico)
-        
-        with open(ruta_completa, "wb") as f:
-            f.write(contenido)
-        
-        ruta_foto = ruta_completa
+        guardado = await store_upload(
+            db, foto, extension, MAX_FILE_SIZE_PARADAS,
+            "El archivo de foto excede el tamaño máximo de 10MB"
+        )
+        ruta_foto = guardado.ruta
     
     # Procesar firma si se proporciona
     ruta_firma = None
@@ -1691,28 +1954,22 @@ async def completar_parada(
                 detail="Tipo de archivo de firma no permitido. Solo se permiten imágenes JPEG, PNG o WebP"
             )
         
-        contenido = await firma.read()
-        if len(contenido) > MAX_FILE_SIZE_PARADAS:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="El archivo de firma excede el tamaño máximo de 10MB"
-            )
-        
         extension = os.path.splitext(firma.filename)[1] if firma.filename else ".png"
-        nombre_unico = f"firma_{parada_id}_{uuid.uuid4()}{extension}"
-        ruta_completa = os.path.join(UPLOAD_DIR_PARADAS, nombre_unico)
-        
-        with open(ruta_completa, "wb") as f:
-            f.write(contenido)
-        
-        ruta_firma = ruta_completa
+        guardado = await store_upload(
+            db, firma, extension, MAX_FILE_SIZE_PARADAS,
+            "El archivo de firma excede el tamaño máximo de 10MB"
+        )
+        ruta_firma = guardado.ruta
     
     # Actualizar parada
     parada.estado = EstadoParada.ENTREGADO
     parada.fecha_hora_completada = datetime.now(timezone.utc)
+    # Si la parada ya tenía foto o firma, la nueva la sustituye: se quita la referencia a la anterior
     if ruta_foto:
+        release_file(db, parada.ruta_foto)
         parada.ruta_foto = ruta_foto
     if ruta_firma:
+        release_file(db, parada.ruta_firma)
         parada.ruta_firma = ruta_firma
 
     # Si es una parada de DESCARGA, marcar el pedido asociado como ENTREGADO
@@ -1724,9 +1981,12 @@ async def completar_parada(
     db.commit()
     db.refresh(parada)
     
+    # Miniaturas de la foto en segundo plano
+    schedule_derivatives(ruta_foto)
+    
     # Invalidar caché de rutas y de pedidos
-    invalidate_rutas_cache()
-    invalidate_cache_pattern("pedidos:*")
+    await invalidate_rutas_cache_async()
+    await invalidate_pedidos_cache_async()
     
     # Obtener pedido para la respuesta
     pedido = db.query(Pedido).filter(Pedido.id == parada.pedido_id).first()
@@ -1757,9 +2017,11 @@ async def completar_parada(
 async def obtener_foto_parada(
     parada_id: int,
     token: Optional[str] = Query(None),
+    size: str = Query(TAMANO_ORIGINAL, description=DESCRIPCION_TAMANO_FOTO),
     db: Session = Depends(get_db)
 ):
-    """Obtiene la foto de una parada"""
+    """Obtiene la foto de una parada (o su miniatura / previsualización con size)"""
+    _validar_tamano_foto(size)
     if not token:
         raise HTTPException(status_code=401, detail="Not authenticated")
     try:
@@ -1793,9 +2055,15 @@ async def obtener_foto_parada(
         raise HTTPException(status_code=404, detail="Foto no encontrada")
     
     # Verificar que el archivo existe
-    if not os.path.exists(parada.ruta_foto):
+    if not file_exists(parada.ruta_foto):
         raise HTTPException(status_code=404, detail="Archivo no encontrado en el servidor")
     
+    # Miniatura o previsualización; si la imagen no se puede procesar, se sirve el original
+    if size != TAMANO_ORIGINAL:
+        derivado = await derivative_response(parada.ruta_foto, size)
+        if derivado is not None:
+            return derivado
+    
     # Determinar el tipo de contenido
     media_type = "image/jpeg"
     if parada.ruta_foto.lower().endswith('.png'):
@@ -1803,10 +2071,10 @@ async def obtener_foto_parada(
     elif parada.ruta_foto.lower().endswith('.webp'):
         media_type = "image/webp"
     
-    return FileResponse(
+    return file_response(
         parada.ruta_foto,
         media_type=media_type,
-        headers={"Content-Disposition": f"inline; filename={os.path.basename(parada.ruta_foto)}"}
+        headers={"Content-Disposition": f"inline; filename={file_name(parada.ruta_foto)}"}
     )
 
 @router.get("/incidencias/{incidencia_ruta_id}/fotos/{foto_id}")
@@ -1814,9 +2082,11 @@ async def obtener_foto_incidencia_ruta(
     incidencia_ruta_id: int,
     foto_id: int,
     token: Optional[str] = Query(None),
+    size: str = Query(TAMANO_ORIGINAL, description=DESCRIPCION_TAMANO_FOTO),
     db: Session = Depends(get_db)
 ):
-    """Obtiene una foto de una incidencia de ruta"""
+    """Obtiene una foto de una incidencia de ruta (o su miniatura / previsualización con size)"""
+    _validar_tamano_foto(size)
     if not token:
         raise HTTPException(status_code=401, detail="Not authenticated")
     try:
@@ -1855,9 +2125,15 @@ async def obtener_foto_incidencia_ruta(
         raise HTTPException(status_code=404, detail="Foto no encontrada")
     
     # Verificar que el archivo existe
-    if not os.path.exists(foto.ruta_archivo):
+    if not file_exists(foto.ruta_archivo):
         raise HTTPException(status_code=404, detail="Archivo no encontrado en el servidor")
     
+    # Miniatura o previsualización; si la imagen no se puede procesar, se sirve el original
+    if size != TAMANO_ORIGINAL:
+        derivado = await derivative_response(foto.ruta_archivo, size)
+        if derivado is not None:
+            return derivado
+    
     # Determinar el tipo de contenido
     media_type = foto.tipo_archivo or "image/jpeg"
     if foto.ruta_archivo.lower().endswith('.png'):
@@ -1865,10 +2141,10 @@ async def obtener_foto_incidencia_ruta(
     elif foto.ruta_archivo.lower().endswith('.webp'):
         media_type = "image/webp"
     
-    return FileResponse(
+    return file_response(
         foto.ruta_archivo,
         media_type=media_type,
-        headers={"Content-Disposition": f"inline; filename={os.path.basename(foto.ruta_archivo)}"}
+        headers={"Content-Disposition": f"inline; filename={file_name(foto.ruta_archivo)}"}
     )
 
 @router.get("/paradas/{parada_id}/firma")
@@ -1911,7 +2187,7 @@ async def obtener_firma_parada(
         raise HTTPException(status_code=404, detail="Firma no encontrada")
     
     # Verificar que el archivo existe
-    if not os.path.exists(parada.ruta_firma):
+    if not file_exists(parada.ruta_firma):
         raise HTTPException(status_code=404, detail="Archivo no encontrado en el servidor")
     
     # Determinar el tipo de contenido
@@ -1921,10 +2197,10 @@ async def obtener_firma_parada(
     elif parada.ruta_firma.lower().endswith('.webp'):
         media_type = "image/webp"
     
-    return FileResponse(
+    return file_response(
         parada.ruta_firma,
         media_type=media_type,
-        headers={"Content-Disposition": f"inline; filename={os.path.basename(parada.ruta_firma)}"}
+        headers={"Content-Disposition": f"inline; filename={file_name(parada.ruta_firma)}"}
     )
 
 
@@ -1937,7 +2213,7 @@ async def crear_incidencia_ruta(
     cancelar_ruta: bool = Form(False, description="Si es True, cancela la ruta después de crear la incidencia"),
     fotos: List[UploadFile] = File(default=[]),
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Crear una incidencia de ruta (solo conductores)"""
     if current_user.rol != "conductor":
@@ -2017,7 +2293,6 @@ async def crear_incidencia_ruta(
     
     # Procesar fotos si se proporcionan
     if fotos and len(fotos) > 0:
-        os.makedirs(UPLOAD_DIR_INCIDENCIAS_RUTA, exist_ok=True)
         for foto in fotos:
             if foto.content_type not in ALLOWED_IMAGE_TYPES:
                 raise HTTPException(
@@ -2025,23 +2300,15 @@ async def crear_incidencia_ruta(
                     detail="Tipo de archivo de foto no permitido. Solo se permiten imágenes JPEG, PNG o WebP"
                 )
             
-            contenido = await foto.read()
-            if len(contenido) > MAX_FILE_SIZE_INCIDENCIA_RUTA:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="El archivo de foto excede el tamaño máximo de 10MB"
-                )
-            
             extension = os.path.splitext(foto.filename)[1] if foto.filename else ".jpg"
-            nombre_unico = f"incidencia_{nueva_incidencia.id}_{uuid.uuid4()}{extension}"
-            ruta_completa = os.path.join(UPLOAD_DIR_INCIDENCIAS_RUTA, nombre_unico)
-            
-            with open(ruta_completa, "wb") as f:
-                f.write(contenido)
+            guardado = await store_upload(
+                db, foto, extension, MAX_FILE_SIZE_INCIDENCIA_RUTA,
+                "El archivo de foto excede el tamaño máximo de 10MB"
+            )
             
             foto_incidencia = IncidenciaRutaFoto(
                 incidencia_ruta_id=nueva_incidencia.id,
-                ruta_archivo=ruta_completa,
+                ruta_archivo=guardado.ruta,
                 tipo_archivo=foto.content_type
             )
             db.add(foto_incidencia)
@@ -2059,9 +2326,13 @@ async def crear_incidencia_ruta(
     db.commit()
     db.refresh(nueva_incidencia)
     
+    # Miniaturas de las fotos en segundo plano
+    for f in nueva_incidencia.fotos:
+        schedule_derivatives(f.ruta_archivo)
+    
     # Invalidar caché
-    invalidate_rutas_cache()
-    invalidate_cache_pattern("pedidos:*")
+    await invalidate_rutas_cache_async()
+    await invalidate_pedidos_cache_async()
     
     # Construir respuesta
     fotos_respuesta = [
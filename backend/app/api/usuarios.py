@@ -6,9 +6,10 @@ from app.models.usuario import Usuario
 from app.schemas.usuario import UsuarioCreate, UsuarioUpdate, UsuarioResponse, CambiarPassword
 from app.api.dependencies import get_current_user
 from app.core.security import get_password_hash
+from app.core.user_cache import UsuarioActual, invalidar_usuario_cache
 from app.core.cache import (
-    get_from_cache_async, set_to_cache_async, generate_cache_key,
-    invalidate_usuarios_cache, delete_from_cache
+    get_from_cache_async, set_to_cache_async, generate_cache_key_async,
+    invalidate_usuarios_cache_async, delete_from_cache
 )
 
 router = APIRouter(prefix="/usuarios", tags=["usuarios"])
@@ -20,7 +21,7 @@ ROLES_VALIDOS = {
     "sistema": ["super_admin"]
 }
 
-def verificar_super_admin(usuario: Usuario):
+def verificar_super_admin(usuario: UsuarioActual):
     """Verifica que el usuario sea super_admin"""
     if usuario.rol != "super_admin":
         raise HTTPException(
@@ -34,13 +35,13 @@ async def listar_usuarios(
     limit: int = 100,
     incluir_eliminados: bool = Query(False, description="Incluir cuentas anonimizadas (RGPD)"),
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Lista todos los usuarios (solo super_admin). incluir_eliminados=True muestra cuentas anonimizadas (RGPD)."""
     verificar_super_admin(current_user)
     
     # Generar clave de caché (incluir parámetro para listas distintas)
-    cache_key = generate_cache_key("usuarios:list", skip=skip, limit=limit, incluir_eliminados=incluir_eliminados)
+    cache_key = await generate_cache_key_async("usuarios:list", skip=skip, limit=limit, incluir_eliminados=incluir_eliminados)
     
     # Intentar obtener de caché (versión async con hilos - no bloquea el event loop)
     cached_result = await get_from_cache_async(cache_key)
@@ -77,13 +78,13 @@ async def listar_usuarios(
 async def obtener_usuario(
     usuario_id: int,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Obtiene un usuario por ID (solo super_admin)"""
     verificar_super_admin(current_user)
     
     # Generar clave de caché
-    cache_key = generate_cache_key("usuarios:item", id=usuario_id)
+    cache_key = await generate_cache_key_async("usuarios:item", id=usuario_id)
     
     # Intentar obtener de caché (versión async con hilos - no bloquea el event loop)
     cached_result = await get_from_cache_async(cache_key)
@@ -105,7 +106,7 @@ async def obtener_usuario(
 async def crear_usuario(
     usuario_data: UsuarioCreate,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Crea un nuevo usuario (solo super_admin)"""
     verificar_super_admin(current_user)
@@ -138,7 +139,7 @@ async def crear_usuario(
     db.refresh(nuevo_usuario)
     
     # Invalidar caché de usuarios
-    invalidate_usuarios_cache()
+    await invalidate_usuarios_cache_async()
     
     return nuevo_usuario
 
@@ -147,7 +148,7 @@ async def actualizar_usuario(
     usuario_id: int,
     usuario_data: UsuarioUpdate,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Actualiza un usuario (solo super_admin)"""
     verificar_super_admin(current_user)
@@ -187,6 +188,7 @@ async def actualizar_usuario(
                 detail=f"Rol inválido. Roles válidos: {', '.join(roles_todos)}"
             )
     
+    email_anterior = usuario.email
     update_data = usuario_data.model_dump(exclude_unset=True)
     for field, value in update_data.items():
         setattr(usuario, field, value)
@@ -194,7 +196,9 @@ async def actualizar_usuario(
     db.commit()
     db.refresh(usuario)
     
-    invalidate_usuarios_cache()
+    # Rol, email, nombre o estado pueden haber cambiado: descartar el usuario cacheado
+    await invalidar_usuario_cache(email_anterior, usuario.email)
+    await invalidate_usuarios_cache_async()
     
     return usuario
 
@@ -202,7 +206,7 @@ async def actualizar_usuario(
 async def eliminar_usuario(
     usuario_id: int,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Elimina un usuario (solo super_admin)"""
     verificar_super_admin(current_user)
@@ -228,11 +232,13 @@ async def eliminar_usuario(
     if usuario_id == current_user.id:
         raise HTTPException(status_code=400, detail="No puedes eliminar tu propio usuario")
     
+    email_eliminado = usuario.email
     db.delete(usuario)
     db.commit()
     
     # Invalidar caché de usuarios
-    invalidate_usuarios_cache()
+    await invalidar_usuario_cache(email_eliminado)
+    await invalidate_usuarios_cache_async()
     
     return None
 
@@ -241,7 +247,7 @@ async def cambiar_password_usuario(
     usuario_id: int,
     password_data: CambiarPassword,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Cambia la contraseña de un usuario (solo super_admin)"""
     verificar_super_admin(current_user)
@@ -1,64 +1,77 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, select
 from typing import List, Optional
-from app.database import get_db
+from app.database import get_db, AsyncSessionLocal
 from app.models.vehiculo import Vehiculo, EstadoVehiculo
-from app.models.usuario import Usuario
 from app.models.ruta import Ruta
 from app.models.mantenimiento import Mantenimiento
 from app.schemas.vehiculo import VehiculoCreate, VehiculoUpdate, VehiculoResponse
 from app.api.dependencies import get_current_user
+from app.core.user_cache import UsuarioActual
 from app.core.cache import (
-    get_from_cache_async, set_to_cache_async, generate_cache_key,
-    invalidate_vehiculos_cache, delete_from_cache
+    get_from_cache_async, set_to_cache_async, get_or_set_cache_async, generate_cache_key_async,
+    invalidate_vehiculos_cache_async, CachedJSON
 )
 
 router = APIRouter(prefix="/vehiculos", tags=["vehículos"])
 
 @router.get("/", response_model=List[VehiculoResponse])
 async def listar_vehiculos(
+    request: Request,
     estado: Optional[EstadoVehiculo] = Query(None),
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=100),
-    db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     # Generar clave de caché
-    cache_key = generate_cache_key(
+    cache_key = await generate_cache_key_async(
         "vehiculos:list",
         estado=estado.value if estado else None,
         skip=skip,
         limit=limit
     )
     
-    # Intentar obtener de caché
-    cached_result = await get_from_cache_async(cache_key)
-    if cached_result is not None:
-        return cached_result
+    async def calcular():
+        # Sesión propia: el refresco en segundo plano de la caché sigue tras la respuesta
+        async with AsyncSessionLocal() as db:
+            query = select(Vehiculo)
+            if estado:
+                query = query.where(Vehiculo.estado == estado)
+            vehiculos = (await db.execute(query.offset(skip).limit(limit))).scalars().all()
+            
+            # Contadores de rutas y mantenimientos de toda la página (una consulta agrupada cada uno)
+            vehiculo_ids = [veh.id for veh in vehiculos]
+            num_rutas = {}
+            num_mantenimientos = {}
+            if vehiculo_ids:
+                num_rutas = dict((await db.execute(
+                    select(Ruta.vehiculo_id, func.count(Ruta.id))
+                    .where(Ruta.vehiculo_id.in_(vehiculo_ids))
+                    .group_by(Ruta.vehiculo_id)
+                )).all())
+                num_mantenimientos = dict((await db.execute(
+                    select(Mantenimiento.vehiculo_id, func.count(Mantenimiento.id))
+                    .where(Mantenimiento.vehiculo_id.in_(vehiculo_ids))
+                    .group_by(Mantenimiento.vehiculo_id)
+                )).all())
+            
+            result = []
+            for veh in vehiculos:
+                data = VehiculoResponse.model_validate(veh).model_dump()
+                data["num_rutas"] = num_rutas.get(veh.id, 0)
+                data["num_mantenimientos"] = num_mantenimientos.get(veh.id, 0)
+                result.append(data)
+            # Cuerpo JSON final: un acierto de caché se devuelve sin validar ni serializar
+            return CachedJSON.from_value(List[VehiculoResponse], result)
     
     try:
-        query = db.query(Vehiculo)
-        if estado:
-            query = query.filter(Vehiculo.estado == estado)
-        vehiculos = query.offset(skip).limit(limit).all()
-        
-        for vehiculo in vehiculos:
-            db.refresh(vehiculo)
-        
-        result = []
-        for veh in vehiculos:
-            data = VehiculoResponse.model_validate(veh).model_dump()
-            data["num_rutas"] = db.query(func.count(Ruta.id)).filter(Ruta.vehiculo_id == veh.id).scalar() or 0
-            data["num_mantenimientos"] = db.query(func.count(Mantenimiento.id)).filter(Mantenimiento.vehiculo_id == veh.id).scalar() or 0
-            result.append(VehiculoResponse(**data))
-        
-        # Guardar en caché como list de dicts para evitar problemas de serialización
-        result_dicts = [r.model_dump() if hasattr(r, 'model_dump') else r for r in result]
-        await set_to_cache_async(cache_key, result_dicts, expire=300)
-        return result
+        # Caché fresca 5 minutos; después, y durante 15 minutos más, se sirve el valor
+        # anterior mientras se recalcula en segundo plano (stale-while-revalidate)
+        respuesta = await get_or_set_cache_async(cache_key, calcular, expire=300, stale_while_revalidate=900)
+        return respuesta.to_response(request)
     except Exception as e:
-        invalidate_vehiculos_cache()
+        await invalidate_vehiculos_cache_async()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error al listar vehículos: {str(e)}"
@@ -68,7 +81,7 @@ async def listar_vehiculos(
 async def obtener_historial_vehiculo(
     vehiculo_id: int,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     """Obtener historial completo de un vehículo (rutas con conductor y mantenimientos con datos importantes)"""
     vehiculo = db.query(Vehiculo).filter(Vehiculo.id == vehiculo_id).first()
@@ -125,10 +138,10 @@ async def obtener_historial_vehiculo(
 async def obtener_vehiculo(
     vehiculo_id: int,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     # Generar clave de caché
-    cache_key = generate_cache_key("vehiculos:item", id=vehiculo_id)
+    cache_key = await generate_cache_key_async("vehiculos:item", id=vehiculo_id)
     
     # Intentar obtener de caché (versión async con hilos - no bloquea el event loop)
     cached_result = await get_from_cache_async(cache_key)
@@ -153,7 +166,7 @@ async def obtener_vehiculo(
 async def crear_vehiculo(
     vehiculo_data: VehiculoCreate,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     # Verificar permisos
     if current_user.rol not in ["super_admin", "admin_transportes"]:
@@ -176,7 +189,7 @@ async def crear_vehiculo(
     db.refresh(nuevo_vehiculo)
     
     # Invalidar caché de vehículos
-    invalidate_vehiculos_cache()
+    await invalidate_vehiculos_cache_async()
     
     return VehiculoResponse.model_validate(nuevo_vehiculo)
 
@@ -185,7 +198,7 @@ async def actualizar_vehiculo(
     vehiculo_id: int,
     vehiculo_data: VehiculoUpdate,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     if current_user.rol not in ["super_admin", "admin_transportes"]:
         raise HTTPException(
@@ -266,13 +279,8 @@ async def actualizar_vehiculo(
         # Asegurar que el estado en memoria coincide con el de la BD
         vehiculo.estado = vehiculo_verificado.estado
     
-    # Invalidar TODA la caché de vehículos de forma más agresiva
-    invalidate_vehiculos_cache()
-    # También eliminar la clave específica del item
-    delete_from_cache(generate_cache_key("vehiculos:item", id=vehiculo_id))
-    # Eliminar todas las posibles claves de listado
-    from app.core.cache import invalidate_cache_pattern
-    invalidate_cache_pattern("vehiculos:list*")
+    # Invalidar TODA la caché de vehículos (listados e item): nueva generación del namespace
+    await invalidate_vehiculos_cache_async()
     
     return VehiculoResponse.model_validate(vehiculo)
 
@@ -280,7 +288,7 @@ async def actualizar_vehiculo(
 async def eliminar_vehiculo(
     vehiculo_id: int,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioActual = Depends(get_current_user)
 ):
     if current_user.rol not in ["super_admin", "admin_transportes"]:
         raise HTTPException(
@@ -299,8 +307,7 @@ async def eliminar_vehiculo(
     db.commit()
     
     # Invalidar caché de vehículos (incluye listados e items individuales)
-    invalidate_vehiculos_cache()
-    delete_from_cache(generate_cache_key("vehiculos:item", id=vehiculo_id))
+    await invalidate_vehiculos_cache_async()
     
     return None
 
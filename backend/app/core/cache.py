@@ -2,21 +2,42 @@
 Módulo de caché usando Redis (NoSQL) para mejorar el rendimiento de la API.
 
 Este módulo implementa un sistema de caché distribuido usando Redis como base de datos
-NoSQL, con operaciones asíncronas que utilizan hilos para no bloquear el event loop
-de FastAPI.
+NoSQL, con operaciones asíncronas nativas (redis.asyncio) para no bloquear el event
+loop de FastAPI.
 
 CARACTERÍSTICAS PRINCIPALES:
 - Base de datos NoSQL: Redis (almacenamiento clave-valor en memoria)
-- Operaciones asíncronas: Uso de asyncio.to_thread() para ejecutar operaciones
-  bloqueantes en hilos separados, evitando bloquear el event loop
-- Invalidación en segundo plano: Las operaciones de invalidación se ejecutan de forma
-  asíncrona (fire-and-forget) para no retrasar las respuestas HTTP
-- Optimización: Uso de SCAN en lugar de KEYS para mejor rendimiento con muchas claves
-
-IMPLEMENTACIÓN DE HILOS:
-- get_from_cache_async(): Lee de Redis en un hilo separado usando asyncio.to_thread()
-- set_to_cache_async(): Escribe en Redis en un hilo separado
-- invalidate_cache_pattern_async(): Invalida caché usando SCAN en un hilo separado
+- Operaciones asíncronas: cliente redis.asyncio sobre un pool de conexiones propio
+  (REDIS_MAX_CONNECTIONS, timeouts de socket, health check) creado en el lifespan con
+  init_async_redis(). No consume hilos del pool por defecto de asyncio. Sin ese pool
+  (scripts) las funciones *_async usan el cliente síncrono en un hilo
+- Cliente síncrono (get_redis_client) para código síncrono y scripts
+- Codec binario de los valores (encode_cache_value/decode_cache_value): orjson,
+  compresión zstd por encima de CACHE_COMPRESSION_MIN_BYTES y un byte de cabecera con
+  el formato, para poder cambiar de serializador o compresión sin invalidar la caché
+- Respuestas precodificadas (CachedJSON): los listados guardan el cuerpo JSON final
+  con su ETag; un acierto se devuelve como Response sin validar ni serializar de nuevo,
+  o como 304 Not Modified si el cliente ya tiene esa versión (If-None-Match). Se
+  guardan también comprimidas (gzip/brotli) para no comprimir en cada acierto
+- Reconexión con espera exponencial: si Redis no responde, ambos clientes dejan de
+  intentarlo durante 1, 2, 4... segundos (hasta REDIS_RECONNECT_MAX_BACKOFF_SECONDS)
+  y vuelven a probar; mientras tanto el sistema funciona sin caché
+- Invalidación por generaciones: cada namespace (vehiculos, rutas, pedidos...) tiene un
+  contador "gen:<namespace>" que forma parte de todas sus claves. Invalidar es un INCR
+  O(1) en lugar de recorrer y borrar claves; las entradas antiguas caducan por su TTL
+- invalidate_cache_pattern*(): borrado por patrón con SCAN para casos puntuales
+- Caché local (L1): LRU en memoria de cada worker delante de Redis, con tamaño máximo
+  (CACHE_LOCAL_MAX_ENTRIES) y TTL por entrada (CACHE_LOCAL_TTL_SECONDS). Un acierto
+  en L1 no pasa por Redis ni deserializa. La coherencia entre
+  workers la da el canal pub/sub "cache:invalidaciones": cada invalidación se publica
+  y el oyente de cada worker descarta sus entradas locales al recibirla. La L1 solo
+  está activa mientras el oyente está suscrito (se arranca en el lifespan); sin él
+  (scripts, Redis caído) todas las lecturas van a Redis
+
+FUNCIONES ASÍNCRONAS:
+- get_from_cache_async(): Lee de L1 o de Redis sin bloquear el event loop
+- set_to_cache_async(): Escribe en Redis sin bloquear el event loop
+- invalidate_cache_pattern_async(): Invalida caché usando SCAN
 - invalidate_cache_pattern_background(): Ejecuta invalidación en segundo plano sin esperar
 
 VENTAJAS:
@@ -25,54 +46,686 @@ VENTAJAS:
 - Escalabilidad mejorada
 - Tolerancia a fallos: Si Redis no está disponible, el sistema funciona sin caché
 """
-import os
+import hashlib
 import json
+import time
 import asyncio
-from typing import Optional, Any, Callable
+import threading
+from collections import OrderedDict
+from typing import Optional, Any, Awaitable, Callable, Dict, Iterable, List, Tuple
 from functools import wraps
 import redis
-from fastapi import Request
+import redis.asyncio as aioredis
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+
+from app.core.config import settings
+from app.core.compression import available_encodings, choose_encoding, compress
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-# Cliente Redis global (se inicializa al importar)
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Cliente Redis síncrono global (se inicializa en el primer uso). Los valores de la
+# caché son binarios (ver codec más abajo) y usan un cliente sin decode_responses;
+# el resto (generaciones, locks, pub/sub, otros módulos) trabaja con texto.
 _redis_client: Optional[redis.Redis] = None
+_redis_client_binario: Optional[redis.Redis] = None
+_redis_reintento_en = 0.0
+_redis_espera = 1
+
+# Clientes redis.asyncio y sus pools (se crean en el lifespan con init_async_redis)
+_async_pool: Optional[aioredis.BlockingConnectionPool] = None
+_async_client: Optional[aioredis.Redis] = None
+_async_pool_binario: Optional[aioredis.BlockingConnectionPool] = None
+_async_client_binario: Optional[aioredis.Redis] = None
+_async_reintento_en = 0.0
+_async_espera = 1
+
 
+def _redis_url() -> str:
+    redis_url = settings.REDIS_URL
+    # Si es Upstash (tiene .upstash.io), cambiar redis:// por rediss:// para SSL
+    if '.upstash.io' in redis_url and redis_url.startswith('redis://'):
+        redis_url = redis_url.replace('redis://', 'rediss://', 1)
+    return redis_url
 
-def get_redis_client() -> Optional[redis.Redis]:
-    """Obtiene el cliente Redis, inicializándolo si es necesario."""
-    global _redis_client
+
+def _opciones_conexion(decode_responses: bool = True) -> Dict[str, Any]:
+    return {
+        "decode_responses": decode_responses,
+        "socket_timeout": settings.REDIS_SOCKET_TIMEOUT,
+        "socket_connect_timeout": settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+        "health_check_interval": settings.REDIS_HEALTH_CHECK_INTERVAL,
+    }
+
+
+def get_redis_client(binario: bool = False) -> Optional[redis.Redis]:
+    """
+    Obtiene el cliente Redis síncrono, inicializándolo si es necesario.
     
-    if _redis_client is None:
-        redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
-        
-        # Si es Upstash (tiene .upstash.io), cambiar redis:// por rediss:// para SSL
-        if '.upstash.io' in redis_url and redis_url.startswith('redis://'):
-            redis_url = redis_url.replace('redis://', 'rediss://', 1)
-        
+    Con binario=True devuelve el cliente sin decode_responses (valores de la caché).
+    
+    Si Redis no responde devuelve None y no vuelve a intentarlo hasta pasado un
+    tiempo que se duplica en cada fallo (máximo REDIS_RECONNECT_MAX_BACKOFF_SECONDS),
+    en lugar de quedarse sin caché durante toda la vida del worker.
+    """
+    global _redis_client, _redis_client_binario, _redis_reintento_en, _redis_espera
+    
+    if _redis_client is None and time.monotonic() >= _redis_reintento_en:
         try:
-            _redis_client = redis.from_url(
-                redis_url, 
-                decode_responses=True
-            )
+            client = redis.Redis(connection_pool=redis.ConnectionPool.from_url(_redis_url(), **_opciones_conexion()))
             # Verificar conexión
-            _redis_client.ping()
+            client.ping()
+            _redis_client = client
+            _redis_client_binario = redis.Redis(
+                connection_pool=redis.ConnectionPool.from_url(_redis_url(), **_opciones_conexion(decode_responses=False))
+            )
+            _redis_espera = 1
         except (redis.ConnectionError, redis.TimeoutError) as e:
-            print(f"⚠️  Redis no disponible: {e}. El sistema funcionará sin caché.")
-            _redis_client = None
+            print(f"⚠️  Redis no disponible: {e}. El sistema funcionará sin caché; reintento en {_redis_espera}s.")
+            _redis_reintento_en = time.monotonic() + _redis_espera
+            _redis_espera = min(_redis_espera * 2, settings.REDIS_RECONNECT_MAX_BACKOFF_SECONDS)
     
-    return _redis_client
+    if _redis_client is None:
+        return None
+    return _redis_client_binario if binario else _redis_client
 
 
-def generate_cache_key(prefix: str, **kwargs) -> str:
+def _crear_pool_async(decode_responses: bool) -> aioredis.BlockingConnectionPool:
+    return aioredis.BlockingConnectionPool.from_url(
+        _redis_url(),
+        max_connections=settings.REDIS_MAX_CONNECTIONS,
+        # Con el pool lleno, esperar una conexión libre como mucho este tiempo
+        timeout=settings.REDIS_SOCKET_TIMEOUT,
+        **_opciones_conexion(decode_responses),
+    )
+
+
+async def init_async_redis() -> None:
+    """Crea los pools de conexiones redis.asyncio de este worker (se llama en el lifespan)."""
+    global _async_pool, _async_client, _async_pool_binario, _async_client_binario
+    _async_pool = _crear_pool_async(decode_responses=True)
+    _async_client = aioredis.Redis(connection_pool=_async_pool)
+    _async_pool_binario = _crear_pool_async(decode_responses=False)
+    _async_client_binario = aioredis.Redis(connection_pool=_async_pool_binario)
+    try:
+        await _async_client.ping()
+    except (redis.ConnectionError, redis.TimeoutError) as e:
+        _async_redis_caido(e)
+
+
+async def close_async_redis() -> None:
+    """Cierra los clientes redis.asyncio y sus pools (se llama al apagar la aplicación)."""
+    global _async_pool, _async_client, _async_pool_binario, _async_client_binario
+    for client in (_async_client, _async_client_binario):
+        if client is not None:
+            await client.aclose()
+    for pool in (_async_pool, _async_pool_binario):
+        if pool is not None:
+            await pool.disconnect()
+    _async_pool = _async_client = _async_pool_binario = _async_client_binario = None
+
+
+def _async_redis_caido(error: Exception) -> None:
+    global _async_reintento_en, _async_espera
+    print(f"⚠️  Redis no disponible: {error}. El sistema funcionará sin caché; reintento en {_async_espera}s.")
+    _async_reintento_en = time.monotonic() + _async_espera
+    _async_espera = min(_async_espera * 2, settings.REDIS_RECONNECT_MAX_BACKOFF_SECONDS)
+
+
+def get_async_redis_client(binario: bool = False) -> Optional[aioredis.Redis]:
     """
-    Genera una clave de caché única basada en un prefijo y parámetros.
+    Cliente redis.asyncio de este worker (binario=True: sin decode_responses), o None
+    si no se ha creado el pool o si Redis falló hace poco (espera exponencial antes
+    de volver a intentarlo).
+    """
+    if _async_client is None or time.monotonic() < _async_reintento_en:
+        return None
+    return _async_client_binario if binario else _async_client
+
+
+async def run_redis_command_async(command: str, *args, binario: bool = False, **kwargs) -> Any:
+    """
+    Ejecuta un comando de Redis sin bloquear el event loop.
     
-    Args:
-        prefix: Prefijo para la clave (ej: "vehiculos:list")
-        **kwargs: Parámetros que forman parte de la clave (skip, limit, estado, etc.)
+    Usa el cliente redis.asyncio si existe su pool; si no (scripts, tests), el
+    cliente síncrono en un hilo. Devuelve None si Redis no está disponible.
+    Con binario=True las respuestas son bytes (valores de la caché).
+    Los errores de Redis se propagan (redis.RedisError) para que el llamador los trate.
+    """
+    global _async_espera
+    if _async_client is None:
+        client = get_redis_client(binario)
+        if client is None:
+            return None
+        return await asyncio.to_thread(getattr(client, command), *args, **kwargs)
     
-    Returns:
-        Clave de caché formateada
+    client = get_async_redis_client(binario)
+    if client is None:
+        return None
+    try:
+        resultado = await getattr(client, command)(*args, **kwargs)
+    except (redis.ConnectionError, redis.TimeoutError) as e:
+        _async_redis_caido(e)
+        raise
+    _async_espera = 1
+    return resultado
+
+
+# ============================================================================
+# RESPUESTAS JSON PRECODIFICADAS
+# ============================================================================
+
+# TypeAdapter por response_model (crearlo es caro: se reutiliza entre peticiones)
+_adaptadores: Dict[Any, TypeAdapter] = {}
+
+
+def encode_json_response(response_model: Any, value: Any) -> bytes:
+    """
+    Valida `value` contra `response_model` y lo codifica a JSON como lo haría FastAPI
+    con el response_model del endpoint (pydantic en modo JSON, por alias).
+    """
+    adaptador = _adaptadores.get(response_model)
+    if adaptador is None:
+        adaptador = _adaptadores[response_model] = TypeAdapter(response_model)
+    return adaptador.dump_json(adaptador.validate_python(value), by_alias=True)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """True si la cabecera If-None-Match incluye el ETag (comparación débil, RFC 9110)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(valor.strip().removeprefix("W/") == etag for valor in if_none_match.split(","))
+
+
+class CachedJSON:
+    """
+    Cuerpo JSON final de una respuesta, tal como se guarda en la caché.
+    
+    Un acierto de caché se devuelve con to_response(): FastAPI no vuelve a validar
+    contra el response_model ni a serializar (ni se decodifica el JSON), y el ETag y
+    Content-Length se calculan una sola vez al crear la entrada. El ETag es un hash
+    del contenido: si tras una invalidación el listado no ha cambiado, sigue valiendo.
+    
+    Los cuerpos de al menos COMPRESSION_MIN_BYTES se guardan también comprimidos
+    (gzip y, si está instalado, brotli): a los clientes que lo aceptan se les envía
+    esa versión sin comprimir en cada petición (CompressionMiddleware no la toca).
+    """
+    __slots__ = ("body", "etag", "headers", "encodings")
+
+    def __init__(
+        self,
+        body: bytes,
+        headers: Optional[Dict[str, str]] = None,
+        etag: Optional[str] = None,
+        encodings: Optional[Dict[str, bytes]] = None,
+    ):
+        self.body = body
+        self.headers = headers or {}
+        self.etag = etag or f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+        self.encodings = encodings or {}
+
+    @classmethod
+    def from_value(cls, response_model: Any, value: Any, headers: Optional[Dict[str, str]] = None) -> "CachedJSON":
+        """Codifica el resultado de un endpoint (ver encode_json_response) y lo precomprime."""
+        body = encode_json_response(response_model, value)
+        encodings = {}
+        if len(body) >= settings.COMPRESSION_MIN_BYTES:
+            encodings = {codificacion: compress(body, codificacion) for codificacion in available_encodings()}
+        return cls(body, headers, encodings=encodings)
+
+    def _etag_codificado(self, codificacion: Optional[str]) -> str:
+        # Cada representación (identidad, gzip, br) lleva su propio ETag fuerte
+        return self.etag if codificacion is None else f'{self.etag[:-1]}-{codificacion}"'
+
+    def to_response(self, request: Optional[Request] = None) -> Response:
+        """
+        Respuesta HTTP con el cuerpo cacheado, comprimido si el cliente lo acepta. Con
+        la petición, si su If-None-Match coincide con el ETag (de cualquiera de las
+        representaciones: el contenido es el mismo) devuelve 304 Not Modified sin cuerpo.
+        """
+        codificacion = None
+        if request is not None and self.encodings:
+            codificacion = choose_encoding(request.headers.get("accept-encoding"), self.encodings)
+        # private: el contenido depende del usuario; no-cache: revalidar siempre con el ETag
+        headers = {"ETag": self._etag_codificado(codificacion), "Cache-Control": "private, no-cache", **self.headers}
+        if self.encodings:
+            headers["Vary"] = "Accept-Encoding"
+        if request is not None:
+            if_none_match = request.headers.get("if-none-match")
+            if any(etag_matches(if_none_match, self._etag_codificado(c)) for c in (None, *self.encodings)):
+                return Response(status_code=304, headers=headers)
+        body = self.body
+        if codificacion is not None:
+            body = self.encodings[codificacion]
+            headers["Content-Encoding"] = codificacion
+        headers["Content-Length"] = str(len(body))
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def _a_bytes(self, fresco_hasta: Optional[float] = None) -> bytes:
+        # Metadatos + "\n" + cuerpo + versiones comprimidas (sus longitudes, en los metadatos)
+        meta: Dict[str, Any] = {
+            "etag": self.etag,
+            "headers": self.headers,
+            "encodings": {codificacion: len(datos) for codificacion, datos in self.encodings.items()},
+        }
+        if fresco_hasta is not None:
+            meta["fresco_hasta"] = fresco_hasta
+        return b"".join((json.dumps(meta).encode("utf-8"), b"\n", self.body, *self.encodings.values()))
+
+    @classmethod
+    def _desde_bytes(cls, datos: bytes) -> Any:
+        meta, separador, body = datos.partition(b"\n")
+        if not separador:
+            raise ValueError("respuesta cacheada sin metadatos")
+        meta = json.loads(meta)
+        try:
+            posicion = len(body) - sum(meta["encodings"].values())
+            if posicion < 0:
+                raise ValueError("respuesta cacheada truncada")
+            cuerpo, encodings = body[:posicion], {}
+            for codificacion, longitud in meta["encodings"].items():
+                encodings[codificacion] = body[posicion:posicion + longitud]
+                posicion += longitud
+            respuesta = cls(cuerpo, meta["headers"], meta["etag"], encodings)
+        except (KeyError, TypeError, AttributeError) as e:
+            raise ValueError(f"metadatos de respuesta cacheada no válidos: {e}")
+        if "fresco_hasta" in meta:
+            # Entrada de stale-while-revalidate (ver get_or_set_cache_async)
+            return {"fresco_hasta": meta["fresco_hasta"], "valor": respuesta}
+        return respuesta
+
+
+# ============================================================================
+# CODEC DE LOS VALORES EN REDIS
+# ============================================================================
+# Cada valor se guarda como 1 byte de cabecera + datos. La cabecera indica el
+# serializador (bits 0-3) y la compresión (bits 4-7), así cualquier worker lee los
+# valores escritos con otra configuración (despliegues graduales, vuelta atrás). Una
+# cabecera desconocida se trata como fallo de caché.
+
+SERIALIZADOR_JSON = 0x01    # json de la librería estándar (default=str)
+SERIALIZADOR_ORJSON = 0x02  # orjson: datetime/date/UUID/Enum nativos, 5-10x más rápido
+SERIALIZADOR_RESPUESTA = 0x03  # CachedJSON: metadatos JSON + "\n" + cuerpo HTTP tal cual
+COMPRESION_ZSTD = 0x10
+_MASCARA_SERIALIZADOR = 0x0F
+_MASCARA_COMPRESION = 0xF0
+
+# Formato de los valores, incluido en las claves (generate_cache_key). Cambiarlo solo
+# si los workers anteriores no pueden leer los valores nuevos (la cabecera ya cubre
+# los cambios de serializador o compresión). c3: SERIALIZADOR_RESPUESTA; c4: CachedJSON
+# con versiones precomprimidas
+_FORMATO_VALORES = "c4"
+
+_OPCIONES_ORJSON = orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+_zstd_local = threading.local()  # los (des)compresores de zstandard no son thread-safe
+
+
+def _compresor_zstd():
+    if not hasattr(_zstd_local, "compresor"):
+        _zstd_local.compresor = zstandard.ZstdCompressor(level=settings.CACHE_COMPRESSION_LEVEL)
+        _zstd_local.descompresor = zstandard.ZstdDecompressor()
+    return _zstd_local.compresor, _zstd_local.descompresor
+
+
+def _serializar(value: Any) -> Tuple[int, bytes]:
+    """Serializa con el serializador configurado (CACHE_SERIALIZER); lanza TypeError si no se puede."""
+    if isinstance(value, CachedJSON):
+        return SERIALIZADOR_RESPUESTA, value._a_bytes()
+    if _es_entrada_swr(value) and isinstance(value["valor"], CachedJSON):
+        return SERIALIZADOR_RESPUESTA, value["valor"]._a_bytes(value["fresco_hasta"])
+    if settings.CACHE_SERIALIZER == "orjson" and orjson is not None:
+        return SERIALIZADOR_ORJSON, orjson.dumps(value, default=str, option=_OPCIONES_ORJSON)
+    return SERIALIZADOR_JSON, json.dumps(value, default=str).encode("utf-8")
+
+
+def _deserializar(serializador: int, datos: bytes) -> Any:
+    if serializador == SERIALIZADOR_ORJSON:
+        if orjson is None:
+            raise ValueError("valor serializado con orjson, que no está instalado")
+        return orjson.loads(datos)
+    if serializador == SERIALIZADOR_JSON:
+        return json.loads(datos)
+    if serializador == SERIALIZADOR_RESPUESTA:
+        return CachedJSON._desde_bytes(datos)
+    raise ValueError(f"serializador de caché desconocido: {serializador:#x}")
+
+
+def encode_cache_value(value: Any) -> bytes:
+    """
+    Codifica un valor para Redis: cabecera + datos serializados, comprimidos con zstd
+    si CACHE_COMPRESSION="zstd" y ocupan al menos CACHE_COMPRESSION_MIN_BYTES.
+    """
+    serializador, datos = _serializar(value)
+    cabecera = serializador
+    if (settings.CACHE_COMPRESSION == "zstd" and zstandard is not None
+            and len(datos) >= settings.CACHE_COMPRESSION_MIN_BYTES):
+        datos = _compresor_zstd()[0].compress(datos)
+        cabecera |= COMPRESION_ZSTD
+    return bytes((cabecera,)) + datos
+
+
+def decode_cache_value(datos: bytes) -> Any:
+    """
+    Decodifica un valor leído de Redis (ver encode_cache_value). Lanza ValueError si
+    el formato no es válido o no se puede leer en este worker.
+    """
+    cabecera = datos[0]
+    if cabecera >= 0x20:
+        # Sin cabecera: JSON en texto escrito antes del codec binario
+        return json.loads(datos)
+    compresion = cabecera & _MASCARA_COMPRESION
+    cuerpo = datos[1:]
+    if compresion == COMPRESION_ZSTD:
+        if zstandard is None:
+            raise ValueError("valor comprimido con zstd, que no está instalado")
+        try:
+            cuerpo = _compresor_zstd()[1].decompress(cuerpo)
+        except zstandard.ZstdError as e:
+            raise ValueError(f"valor zstd no válido: {e}")
+    elif compresion:
+        raise ValueError(f"compresión de caché desconocida: {compresion:#x}")
+    return _deserializar(cabecera & _MASCARA_SERIALIZADOR, cuerpo)
+
+
+# ============================================================================
+# CACHÉ LOCAL (L1) E INVALIDACIONES ENTRE WORKERS (pub/sub)
+# ============================================================================
+
+CANAL_INVALIDACIONES = "cache:invalidaciones"
+
+# Valores ya deserializados: quien los lee debe tratarlos como de solo lectura
+_l1: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+_generaciones_locales: Dict[str, Tuple[float, int]] = {}
+_l1_lock = threading.Lock()
+_l1_activa = False
+# Se incrementa con cada invalidación recibida; una lectura de Redis que se cruza con
+# una invalidación no se guarda en L1 (podría ser el valor que se acaba de invalidar)
+_secuencia_invalidaciones = 0
+_callbacks_invalidacion: List[Callable[[str], None]] = []
+_oyente: Optional[threading.Thread] = None
+_oyente_parar = threading.Event()
+_estadisticas = {"l1_hits": 0, "l1_misses": 0, "redis_hits": 0, "redis_misses": 0}
+
+
+def _contar(campo: str) -> None:
+    with _l1_lock:
+        _estadisticas[campo] += 1
+
+
+def _l1_leer(key: str) -> Tuple[bool, Any]:
+    """Devuelve (encontrado, valor) de la caché local."""
+    if not _l1_activa:
+        return False, None
+    with _l1_lock:
+        entrada = _l1.get(key)
+        if entrada is not None and entrada[0] < time.monotonic():
+            del _l1[key]
+            entrada = None
+        if entrada is None:
+            _estadisticas["l1_misses"] += 1
+            return False, None
+        _l1.move_to_end(key)
+        _estadisticas["l1_hits"] += 1
+        return True, entrada[1]
+
+
+def _l1_guardar(key: str, value: Any, expire: int, secuencia: Optional[int] = None) -> None:
+    """Guarda en L1 salvo que haya llegado una invalidación desde `secuencia`."""
+    if not _l1_activa:
+        return
+    ttl = min(expire, settings.CACHE_LOCAL_TTL_SECONDS)
+    with _l1_lock:
+        if secuencia is not None and secuencia != _secuencia_invalidaciones:
+            return
+        _l1[key] = (time.monotonic() + ttl, value)
+        _l1.move_to_end(key)
+        while len(_l1) > settings.CACHE_LOCAL_MAX_ENTRIES:
+            _l1.popitem(last=False)
+
+
+def _l1_descartar(keys: Iterable[str]) -> None:
+    global _secuencia_invalidaciones
+    with _l1_lock:
+        _secuencia_invalidaciones += 1
+        for key in keys:
+            _l1.pop(key, None)
+
+
+def _l1_vaciar() -> None:
+    global _secuencia_invalidaciones
+    with _l1_lock:
+        _secuencia_invalidaciones += 1
+        _l1.clear()
+        _generaciones_locales.clear()
+
+
+def _actualizar_generacion_local(namespace: str, generacion: int) -> None:
+    """Guarda la generación conocida del namespace y descarta sus entradas antiguas."""
+    global _secuencia_invalidaciones
+    if not _l1_activa:
+        return
+    caduca = time.monotonic() + settings.CACHE_LOCAL_TTL_SECONDS
+    with _l1_lock:
+        anterior = _generaciones_locales.get(namespace)
+        if anterior is not None and anterior[1] >= generacion:
+            _generaciones_locales[namespace] = (caduca, anterior[1])
+            return
+        _generaciones_locales[namespace] = (caduca, generacion)
+        if anterior is not None:
+            _secuencia_invalidaciones += 1
+            prefijo = f"{namespace}:"
+            for key in [k for k in _l1 if k.startswith(prefijo)]:
+                del _l1[key]
+
+
+def _generacion_local(namespace: str) -> Optional[int]:
+    if not _l1_activa:
+        return None
+    with _l1_lock:
+        entrada = _generaciones_locales.get(namespace)
+        if entrada is None or entrada[0] < time.monotonic():
+            return None
+        return entrada[1]
+
+
+def get_cache_stats() -> Dict[str, Any]:
+    """Contadores de aciertos/fallos por nivel (L1 y Redis) de este worker."""
+    with _l1_lock:
+        return {**_estadisticas, "l1_entries": len(_l1), "l1_activa": _l1_activa}
+
+
+def register_local_invalidation_callback(callback: Callable[[str], None]) -> None:
+    """
+    Registra una función que se llama con cada clave invalidada (en cualquier worker).
+    Permite a otras cachés en memoria (ej: usuario autenticado) mantenerse coherentes.
+    """
+    _callbacks_invalidacion.append(callback)
+
+
+def _publicar(client: redis.Redis, mensaje: Dict[str, Any]) -> None:
+    try:
+        client.publish(CANAL_INVALIDACIONES, json.dumps(mensaje))
+    except redis.RedisError as e:
+        print(f"⚠️  Error al publicar invalidación de caché: {e}")
+
+
+def _aplicar_invalidacion_claves(keys: List[str]) -> None:
+    _l1_descartar(keys)
+    for key in keys:
+        for callback in _callbacks_invalidacion:
+            callback(key)
+
+
+def publish_cache_invalidation(keys: Iterable[str]) -> None:
+    """Descarta las claves de la caché local de este worker y avisa al resto."""
+    keys = list(keys)
+    if not keys:
+        return
+    _aplicar_invalidacion_claves(keys)
+    client = get_redis_client()
+    if client:
+        _publicar(client, {"tipo": "del", "claves": keys})
+
+
+async def publish_cache_invalidation_async(keys: Iterable[str]) -> None:
+    """Versión asíncrona de publish_cache_invalidation (no bloquea el event loop)."""
+    keys = list(keys)
+    if not keys:
+        return
+    _aplicar_invalidacion_claves(keys)
+    try:
+        await run_redis_command_async("publish", CANAL_INVALIDACIONES, json.dumps({"tipo": "del", "claves": keys}))
+    except redis.RedisError as e:
+        print(f"⚠️  Error al publicar invalidación de caché: {e}")
+
+
+def _procesar_invalidacion(mensaje: Dict[str, Any]) -> None:
+    tipo = mensaje.get("tipo")
+    if tipo == "gen":
+        _actualizar_generacion_local(mensaje["namespace"], int(mensaje["generacion"]))
+    elif tipo == "del":
+        _aplicar_invalidacion_claves(list(mensaje.get("claves") or []))
+    elif tipo == "flush":
+        _l1_vaciar()
+
+
+def _escuchar_invalidaciones() -> None:
+    """
+    Hilo oyente del canal de invalidaciones. Mientras está suscrito la L1 está activa;
+    si se pierde la conexión se desactiva y vacía (se pueden haber perdido mensajes)
+    y se reintenta con espera exponencial.
+    """
+    global _l1_activa
+    espera = 1
+    while not _oyente_parar.is_set():
+        pubsub = None
+        try:
+            client = get_redis_client()
+            if client is None:
+                raise redis.ConnectionError("Redis no disponible")
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(CANAL_INVALIDACIONES)
+            _l1_vaciar()
+            _l1_activa = True
+            espera = 1
+            while not _oyente_parar.is_set():
+                mensaje = pubsub.get_message(timeout=1.0)
+                if not mensaje or mensaje.get("type") != "message":
+                    continue
+                try:
+                    _procesar_invalidacion(json.loads(mensaje["data"]))
+                except (ValueError, KeyError, TypeError) as e:
+                    print(f"⚠️  Mensaje de invalidación de caché no válido: {e}")
+        except redis.RedisError as e:
+            print(f"⚠️  Oyente de invalidaciones de caché desconectado: {e}. Reintento en {espera}s")
+        finally:
+            _l1_activa = False
+            _l1_vaciar()
+            if pubsub is not None:
+                try:
+                    pubsub.close()
+                except redis.RedisError:
+                    pass
+        _oyente_parar.wait(espera)
+        espera = min(espera * 2, 30)
+
+
+def start_cache_invalidation_listener() -> None:
+    """Arranca el oyente de invalidaciones (y con él la L1) en este worker."""
+    global _oyente
+    if _oyente is not None and _oyente.is_alive():
+        return
+    _oyente_parar.clear()
+    _oyente = threading.Thread(target=_escuchar_invalidaciones, name="cache-invalidaciones", daemon=True)
+    _oyente.start()
+
+
+def stop_cache_invalidation_listener() -> None:
+    """Detiene el oyente de invalidaciones (se llama al apagar la aplicación)."""
+    global _oyente
+    _oyente_parar.set()
+    if _oyente is not None:
+        _oyente.join(timeout=2)
+        _oyente = None
+
+
+def _key_generacion(namespace: str) -> str:
+    return f"gen:{namespace}"
+
+
+def get_cache_generation(namespace: str) -> int:
+    """
+    Generación actual de un namespace de caché (ej: "incidencias").
+
+    Si el contador no existe (primer uso, Redis reiniciado o clave expulsada) se
+    inicializa con la hora actual en milisegundos en lugar de 0, para no volver a
+    una generación que ya se usó y reutilizar claves antiguas que sigan vivas.
+    
+    Con la L1 activa la generación se recuerda en memoria: las invalidaciones llegan
+    por pub/sub, así que no hace falta consultar Redis en cada clave generada.
+    """
+    generacion = _generacion_local(namespace)
+    if generacion is not None:
+        return generacion
+    
+    client = get_redis_client()
+    if not client:
+        return 0
+    
+    try:
+        generacion = client.get(_key_generacion(namespace))
+        if generacion is None:
+            client.set(_key_generacion(namespace), int(time.time() * 1000), nx=True)
+            generacion = client.get(_key_generacion(namespace))
+        generacion = int(generacion or 0)
+        _actualizar_generacion_local(namespace, generacion)
+        return generacion
+    except (redis.RedisError, ValueError) as e:
+        print(f"⚠️  Error al leer generación de caché ({namespace}): {e}")
+    
+    return 0
+
+
+async def get_cache_generation_async(namespace: str) -> int:
     """
+    Versión asíncrona de get_cache_generation para los handlers async: las consultas
+    a Redis (run_redis_command_async) no bloquean el event loop aunque Redis no responda.
+    """
+    generacion = _generacion_local(namespace)
+    if generacion is not None:
+        return generacion
+    
+    try:
+        generacion = await run_redis_command_async("get", _key_generacion(namespace))
+        if generacion is None:
+            # nx: si otro worker la inicializa a la vez, se lee la suya
+            await run_redis_command_async("set", _key_generacion(namespace), int(time.time() * 1000), nx=True)
+            generacion = await run_redis_command_async("get", _key_generacion(namespace))
+        generacion = int(generacion or 0)
+        if generacion:
+            _actualizar_generacion_local(namespace, generacion)
+        return generacion
+    except (redis.RedisError, ValueError) as e:
+        print(f"⚠️  Error al leer generación de caché ({namespace}): {e}")
+    
+    return 0
+
+
+def _componer_clave(namespace: str, generacion: int, resto: str, kwargs: Dict[str, Any]) -> str:
+    prefix = f"{namespace}:{_FORMATO_VALORES}:g{generacion}"
+    if resto:
+        prefix = f"{prefix}:{resto}"
+    
     # Ordenar kwargs para consistencia
     sorted_params = sorted(kwargs.items())
     params_str = ":".join(f"{k}={v}" for k, v in sorted_params if v is not None)
@@ -82,6 +735,39 @@ def generate_cache_key(prefix: str, **kwargs) -> str:
     return prefix
 
 
+def generate_cache_key(prefix: str, **kwargs) -> str:
+    """
+    Genera una clave de caché única basada en un prefijo y parámetros.
+    
+    La clave incluye la generación del namespace (primer segmento del prefijo),
+    de modo que invalidar un recurso es un INCR del contador: las claves de la
+    generación anterior dejan de leerse y caducan por su TTL. Un valor calculado
+    con datos anteriores a una invalidación se guarda con la generación antigua y
+    nunca se sirve.
+    
+    Args:
+        prefix: Prefijo para la clave (ej: "vehiculos:list")
+        **kwargs: Parámetros que forman parte de la clave (skip, limit, estado, etc.)
+    
+    También incluye el formato de los valores (_FORMATO_VALORES): los workers de una
+    versión anterior del codec no leen nunca valores que no saben decodificar.
+    
+    Returns:
+        Clave de caché formateada (ej: "vehiculos:c2:g1718000000000:list:limit=100:skip=0")
+    """
+    namespace, _, resto = prefix.partition(":")
+    return _componer_clave(namespace, get_cache_generation(namespace), resto, kwargs)
+
+
+async def generate_cache_key_async(prefix: str, **kwargs) -> str:
+    """
+    Versión asíncrona de generate_cache_key (misma clave) para los handlers async:
+    si la generación no está en la L1, la lee de Redis sin bloquear el event loop.
+    """
+    namespace, _, resto = prefix.partition(":")
+    return _componer_clave(namespace, await get_cache_generation_async(namespace), resto, kwargs)
+
+
 def get_from_cache(key: str) -> Optional[Any]:
     """
     Obtiene un valor de la caché.
@@ -92,15 +778,24 @@ def get_from_cache(key: str) -> Optional[Any]:
     Returns:
         Valor deserializado o None si no existe
     """
-    client = get_redis_client()
+    encontrado, value = _l1_leer(key)
+    if encontrado:
+        return value
+    
+    client = get_redis_client(binario=True)
     if not client:
         return None
     
     try:
+        secuencia = _secuencia_invalidaciones
         value = client.get(key)
         if value:
-            return json.loads(value)
-    except (json.JSONDecodeError, redis.RedisError) as e:
+            _contar("redis_hits")
+            value = decode_cache_value(value)
+            _l1_guardar(key, value, settings.CACHE_LOCAL_TTL_SECONDS, secuencia)
+            return value
+        _contar("redis_misses")
+    except (ValueError, redis.RedisError) as e:
         print(f"⚠️  Error al leer de caché ({key}): {e}")
     
     return None
@@ -112,19 +807,21 @@ def set_to_cache(key: str, value: Any, expire: int = 300) -> bool:
     
     Args:
         key: Clave de caché
-        value: Valor a almacenar (debe ser serializable a JSON)
+        value: Valor a almacenar (serializable a JSON; se codifica con encode_cache_value)
         expire: Tiempo de expiración en segundos (por defecto 5 minutos)
     
     Returns:
         True si se almacenó correctamente, False en caso contrario
     """
-    client = get_redis_client()
+    client = get_redis_client(binario=True)
     if not client:
         return False
     
     try:
-        serialized = json.dumps(value, default=str)  # default=str para manejar datetime
+        serialized = encode_cache_value(value)
         client.setex(key, expire, serialized)
+        # En L1 se guarda lo mismo que devolvería Redis (datetime ya convertidos a str)
+        _l1_guardar(key, decode_cache_value(serialized), expire)
         return True
     except (TypeError, redis.RedisError) as e:
         print(f"⚠️  Error al escribir en caché ({key}): {e}")
@@ -148,6 +845,20 @@ def delete_from_cache(key: str) -> bool:
     
     try:
         client.delete(key)
+        publish_cache_invalidation([key])
+        return True
+    except redis.RedisError as e:
+        print(f"⚠️  Error al eliminar de caché ({key}): {e}")
+    
+    return False
+
+
+async def delete_from_cache_async(key: str) -> bool:
+    """Versión asíncrona de delete_from_cache para los handlers async (no bloquea el event loop)."""
+    try:
+        if await run_redis_command_async("delete", key) is None:
+            return False
+        await publish_cache_invalidation_async([key])
         return True
     except redis.RedisError as e:
         print(f"⚠️  Error al eliminar de caché ({key}): {e}")
@@ -159,9 +870,9 @@ def invalidate_cache_pattern(pattern: str) -> int:
     """
     Invalida todas las claves que coincidan con un patrón (versión síncrona).
     
-    NOTA: Esta función puede ser lenta con muchas claves. 
-    Para mejor rendimiento, usa invalidate_cache_pattern_async() o 
-    invalidate_cache_pattern_background().
+    NOTA: Esta función puede ser lenta con muchas claves. Para invalidar un
+    recurso completo usa invalidate_cache_namespace() / invalidate_<recurso>_cache(),
+    que solo incrementan la generación del namespace.
     
     Args:
         pattern: Patrón de búsqueda (ej: "vehiculos:*")
@@ -184,7 +895,9 @@ def invalidate_cache_pattern(pattern: str) -> int:
                 break
         
         if keys:
-            return client.delete(*keys)
+            borradas = client.delete(*keys)
+            publish_cache_invalidation(keys)
+            return borradas
     except redis.RedisError as e:
         print(f"⚠️  Error al invalidar caché ({pattern}): {e}")
     
@@ -197,15 +910,11 @@ def invalidate_cache_pattern(pattern: str) -> int:
 
 async def get_from_cache_async(key: str) -> Optional[Any]:
     """
-    Obtiene un valor de la caché de forma asíncrona usando hilos.
-    
-    Esta función ejecuta la operación bloqueante de Redis en un hilo separado
-    usando asyncio.to_thread(), evitando bloquear el event loop de FastAPI.
+    Obtiene un valor de la caché de forma asíncrona.
     
-    IMPLEMENTACIÓN DE HILOS:
-    - asyncio.to_thread() ejecuta client.get() en un ThreadPoolExecutor
-    - El event loop puede procesar otras peticiones mientras espera la respuesta de Redis
-    - Mejora significativamente el rendimiento con múltiples peticiones concurrentes
+    Primero consulta la L1 en memoria; si no está, lee de Redis con el cliente
+    redis.asyncio, de modo que el event loop puede procesar otras peticiones mientras
+    espera la respuesta sin ocupar un hilo.
     
     Args:
         key: Clave de caché
@@ -213,17 +922,25 @@ async def get_from_cache_async(key: str) -> Optional[Any]:
     Returns:
         Valor deserializado o None si no existe
     """
-    client = get_redis_client()
-    if not client:
-        return None
-    
+    # L1: acierto sin Redis y sin deserializar
+    encontrado, value = _l1_leer(key)
+    if encontrado:
+        return value
+    return await _leer_redis_async(key)
+
+
+async def _leer_redis_async(key: str) -> Optional[Any]:
+    """Lee la clave de Redis (sin mirar la L1) y, si existe, la guarda en L1."""
     try:
-        # Ejecutar operación bloqueante en un hilo separado
-        # Esto permite que FastAPI procese otras peticiones mientras espera Redis
-        value = await asyncio.to_thread(client.get, key)
+        secuencia = _secuencia_invalidaciones
+        value = await run_redis_command_async("get", key, binario=True)
         if value:
-            return json.loads(value)
-    except (json.JSONDecodeError, redis.RedisError) as e:
+            _contar("redis_hits")
+            value = decode_cache_value(value)
+            _l1_guardar(key, value, settings.CACHE_LOCAL_TTL_SECONDS, secuencia)
+            return value
+        _contar("redis_misses")
+    except (ValueError, redis.RedisError) as e:
         print(f"⚠️  Error al leer de caché ({key}): {e}")
     
     return None
@@ -231,15 +948,7 @@ async def get_from_cache_async(key: str) -> Optional[Any]:
 
 async def set_to_cache_async(key: str, value: Any, expire: int = 300) -> bool:
     """
-    Almacena un valor en la caché de forma asíncrona usando hilos.
-    
-    Esta función ejecuta la operación bloqueante de Redis en un hilo separado,
-    mejorando el rendimiento de la API al no bloquear el event loop.
-    
-    IMPLEMENTACIÓN DE HILOS:
-    - Serializa los datos en el hilo principal (operación rápida)
-    - Ejecuta client.setex() en un ThreadPoolExecutor usando asyncio.to_thread()
-    - El event loop puede procesar otras peticiones durante la escritura
+    Almacena un valor en la caché de forma asíncrona.
     
     Args:
         key: Clave de caché
@@ -249,16 +958,11 @@ async def set_to_cache_async(key: str, value: Any, expire: int = 300) -> bool:
     Returns:
         True si se almacenó correctamente, False en caso contrario
     """
-    client = get_redis_client()
-    if not client:
-        return False
-    
     try:
-        # Serializar en el hilo principal (operación rápida)
-        serialized = json.dumps(value, default=str)
-        
-        # Ejecutar escritura en Redis en un hilo separado
-        await asyncio.to_thread(client.setex, key, expire, serialized)
+        serialized = encode_cache_value(value)
+        if not await run_redis_command_async("setex", key, expire, serialized, binario=True):
+            return False
+        _l1_guardar(key, decode_cache_value(serialized), expire)
         return True
     except (TypeError, redis.RedisError) as e:
         print(f"⚠️  Error al escribir en caché ({key}): {e}")
@@ -268,15 +972,10 @@ async def set_to_cache_async(key: str, value: Any, expire: int = 300) -> bool:
 
 async def invalidate_cache_pattern_async(pattern: str) -> int:
     """
-    Invalida todas las claves que coincidan con un patrón de forma asíncrona usando hilos.
-    
-    Esta función usa SCAN en lugar de KEYS para mejor rendimiento y ejecuta
-    la operación en un hilo separado para no bloquear el event loop.
+    Invalida todas las claves que coincidan con un patrón de forma asíncrona.
     
-    IMPLEMENTACIÓN DE HILOS:
-    - Ejecuta SCAN y DELETE en un ThreadPoolExecutor usando asyncio.to_thread()
-    - SCAN es más eficiente que KEYS porque no bloquea Redis durante la búsqueda
-    - Permite procesar otras peticiones mientras se invalida la caché
+    Usa SCAN en lugar de KEYS (no bloquea Redis durante la búsqueda) con el cliente
+    redis.asyncio; sin su pool, ejecuta invalidate_cache_pattern() en un hilo.
     
     Args:
         pattern: Patrón de búsqueda (ej: "vehiculos:*")
@@ -284,44 +983,223 @@ async def invalidate_cache_pattern_async(pattern: str) -> int:
     Returns:
         Número de claves eliminadas
     """
-    client = get_redis_client()
-    if not client:
+    if _async_client is None:
+        return await asyncio.to_thread(invalidate_cache_pattern, pattern)
+    
+    client = get_async_redis_client()
+    if client is None:
         return 0
     
     try:
-        # Función auxiliar para ejecutar en hilo
-        def _invalidate():
-            keys = []
-            cursor = 0
-            # SCAN es más eficiente que KEYS (no bloquea Redis)
-            while True:
-                cursor, partial_keys = client.scan(cursor, match=pattern, count=100)
-                keys.extend(partial_keys)
-                if cursor == 0:
-                    break
-            
-            if keys:
-                return client.delete(*keys)
+        keys = [key async for key in client.scan_iter(match=pattern, count=100)]
+        if not keys:
             return 0
-        
-        # Ejecutar en un hilo separado para no bloquear el event loop
-        return await asyncio.to_thread(_invalidate)
+        borradas = await client.delete(*keys)
+        _aplicar_invalidacion_claves(keys)
+        await client.publish(CANAL_INVALIDACIONES, json.dumps({"tipo": "del", "claves": keys}))
+        return borradas
     except redis.RedisError as e:
         print(f"⚠️  Error al invalidar caché ({pattern}): {e}")
     
     return 0
 
 
+# ============================================================================
+# SINGLE-FLIGHT: UN SOLO CÁLCULO POR CLAVE ANTE FALLOS DE CACHÉ CONCURRENTES
+# ============================================================================
+
+# Cálculos en curso en este worker: las peticiones concurrentes esperan el mismo futuro
+_en_vuelo: Dict[str, asyncio.Future] = {}
+
+
+def redis_available() -> bool:
+    """True si hay un cliente Redis utilizable ahora mismo (sin esperar reconexión)."""
+    if _async_client is not None:
+        return get_async_redis_client() is not None
+    return get_redis_client() is not None
+
+
+async def _esperar_calculo_remoto(key: str, lock_key: str) -> Optional[Any]:
+    """
+    Otro worker tiene el lock de la clave: esperar a que publique el valor.
+    Devuelve None si el lock desaparece sin valor o se agota la espera.
+    """
+    limite = time.monotonic() + settings.CACHE_SINGLE_FLIGHT_WAIT_SECONDS
+    while time.monotonic() < limite:
+        await asyncio.sleep(0.05)
+        value = await get_from_cache_async(key)
+        if value is not None:
+            return value
+        try:
+            if not await run_redis_command_async("exists", lock_key):
+                return await get_from_cache_async(key)
+        except redis.RedisError:
+            return None
+    return None
+
+
+async def _calcular_con_lock(
+    key: str, calcular: Callable[[], Awaitable[Any]], expire: int, esperar: bool = True
+) -> Any:
+    """
+    Calcula el valor si este worker obtiene el lock de Redis; si no, espera al que lo
+    tiene (o, con esperar=False, devuelve None sin calcular).
+    """
+    lock_key = f"lock:{key}"
+    adquirido = True
+    if redis_available():
+        try:
+            adquirido = bool(await run_redis_command_async(
+                "set", lock_key, "1", nx=True, px=int(settings.CACHE_LOCK_TIMEOUT_SECONDS * 1000)
+            ))
+        except redis.RedisError:
+            adquirido = True
+    
+    if not adquirido:
+        if not esperar:
+            return None
+        value = await _esperar_calculo_remoto(key, lock_key)
+        if value is not None:
+            return value
+        # El otro cálculo falló o tarda demasiado: calcular aquí
+    
+    try:
+        value = await calcular()
+        if value is not None:
+            await set_to_cache_async(key, value, expire)
+        return value
+    finally:
+        if adquirido:
+            # Sin comprobar el propietario del lock: en el peor caso (lock caducado y
+            # tomado por otro worker) se repite un cálculo, sin afectar a los datos
+            try:
+                await run_redis_command_async("delete", lock_key)
+            except redis.RedisError:
+                pass
+
+
+async def _calcular_una_vez(key: str, calcular: Callable[[], Awaitable[Any]], expire: int) -> Any:
+    """Single-flight en el worker (futuro compartido) y en el clúster (lock de Redis)."""
+    vuelo = _en_vuelo.get(key)
+    if vuelo is not None:
+        try:
+            return await asyncio.shield(vuelo)
+        except asyncio.CancelledError:
+            if not vuelo.cancelled():
+                raise  # se canceló esta petición, no el cálculo
+            # La petición que calculaba se canceló (ej: cliente desconectado): reintentar
+            value = await get_from_cache_async(key)
+            if value is not None:
+                return value
+            return await _calcular_una_vez(key, calcular, expire)
+    
+    vuelo = asyncio.get_running_loop().create_future()
+    # Evitar el aviso "exception was never retrieved" si nadie esperaba el resultado
+    vuelo.add_done_callback(lambda f: f.cancelled() or f.exception())
+    _en_vuelo[key] = vuelo
+    try:
+        value = await _calcular_con_lock(key, calcular, expire)
+        vuelo.set_result(value)
+        return value
+    except asyncio.CancelledError:
+        vuelo.cancel()
+        raise
+    except Exception as e:
+        # Las peticiones que esperaban reciben el mismo error (mismos parámetros)
+        vuelo.set_exception(e)
+        raise
+    finally:
+        _en_vuelo.pop(key, None)
+
+
+# Refrescos stale-while-revalidate en curso en este worker (referencia a la tarea
+# para que no la recoja el recolector de basura antes de terminar)
+_refrescos: Dict[str, asyncio.Task] = {}
+
+
+def _es_entrada_swr(entrada: Any) -> bool:
+    return isinstance(entrada, dict) and "fresco_hasta" in entrada and "valor" in entrada
+
+
+async def _refrescar(key: str, calcular: Callable[[], Awaitable[Any]], expire: int) -> None:
+    try:
+        # La copia de L1 puede ser antigua aunque otro worker ya haya refrescado Redis
+        entrada = await _leer_redis_async(key)
+        if _es_entrada_swr(entrada) and entrada["fresco_hasta"] > time.time():
+            return
+        # Si otro worker tiene el lock ya está refrescando: no esperar ni repetir
+        await _calcular_con_lock(key, calcular, expire, esperar=False)
+    except Exception as e:
+        print(f"⚠️  Error al refrescar caché en segundo plano ({key}): {e}")
+
+
+def _refrescar_en_segundo_plano(key: str, calcular: Callable[[], Awaitable[Any]], expire: int) -> None:
+    if key in _refrescos or key in _en_vuelo:
+        return
+    tarea = asyncio.create_task(_refrescar(key, calcular, expire))
+    _refrescos[key] = tarea
+    tarea.add_done_callback(lambda _: _refrescos.pop(key, None))
+
+
+async def get_or_set_cache_async(
+    key: str,
+    calcular: Callable[[], Awaitable[Any]],
+    expire: int = 300,
+    stale_while_revalidate: int = 0,
+) -> Any:
+    """
+    Devuelve el valor cacheado o lo calcula con `calcular()` una sola vez por clave.
+    
+    Cuando una clave muy usada caduca o se invalida, todas las peticiones concurrentes
+    fallan a la vez. Aquí solo una la recalcula:
+    - En el worker: las peticiones con la misma clave esperan el mismo futuro.
+    - En el clúster: lock "lock:<clave>" con SET NX PX (CACHE_LOCK_TIMEOUT_SECONDS);
+      los demás workers esperan a que aparezca el valor en Redis (como mucho
+      CACHE_SINGLE_FLIGHT_WAIT_SECONDS, después calculan ellos).
+    
+    Con stale_while_revalidate > 0 el valor es fresco durante `expire` segundos (TTL
+    blando) y se conserva en Redis `expire + stale_while_revalidate` (TTL duro). Entre
+    ambos se devuelve el valor anterior al momento y se recalcula en una tarea en
+    segundo plano (una por clave en el clúster). En ese modo `calcular` no debe usar
+    recursos de la petición (ej: la sesión de base de datos de Depends), porque el
+    refresco termina después de la respuesta. Las invalidaciones cambian la clave, así
+    que tras una escritura nunca se sirve el valor anterior.
+    
+    Si `calcular()` devuelve None el resultado no se cachea. Las peticiones que esperan
+    reciben el mismo objeto: debe tratarse como de solo lectura.
+    """
+    if stale_while_revalidate <= 0:
+        value = await get_from_cache_async(key)
+        if value is not None:
+            return value
+        return await _calcular_una_vez(key, calcular, expire)
+    
+    async def calcular_con_frescura():
+        value = await calcular()
+        if value is None:
+            return None
+        return {"fresco_hasta": time.time() + expire, "valor": value}
+    
+    ttl = expire + stale_while_revalidate
+    entrada = await get_from_cache_async(key)
+    if _es_entrada_swr(entrada):
+        if entrada["fresco_hasta"] <= time.time():
+            _refrescar_en_segundo_plano(key, calcular_con_frescura, ttl)
+        return entrada["valor"]
+    
+    entrada = await _calcular_una_vez(key, calcular_con_frescura, ttl)
+    return entrada["valor"] if entrada is not None else None
+
+
 def invalidate_cache_pattern_background(pattern: str) -> None:
     """
-    Invalida la caché en segundo plano (fire-and-forget) usando hilos.
+    Invalida la caché en segundo plano (fire-and-forget).
     
     Esta función ejecuta la invalidación de forma asíncrona sin esperar a que termine,
     ideal para operaciones CRUD donde no queremos retrasar la respuesta al usuario.
     
-    IMPLEMENTACIÓN DE HILOS:
+    IMPLEMENTACIÓN:
     - Crea una tarea asíncrona (asyncio.create_task) que ejecuta la invalidación
-    - La invalidación se ejecuta en un hilo separado usando asyncio.to_thread()
     - La respuesta HTTP se envía inmediatamente sin esperar la invalidación
     - Mejora la experiencia del usuario al no retrasar las respuestas
     
@@ -333,7 +1211,6 @@ def invalidate_cache_pattern_background(pattern: str) -> None:
         loop = asyncio.get_event_loop()
         if loop.is_running():
             # Si el loop está corriendo, crear tarea en segundo plano
-            # Esta tarea ejecutará la invalidación en un hilo separado
             asyncio.create_task(invalidate_cache_pattern_async(pattern))
         else:
             # Si no hay loop corriendo, ejecutar directamente
@@ -344,24 +1221,23 @@ def invalidate_cache_pattern_background(pattern: str) -> None:
         invalidate_cache_pattern(pattern)
 
 
-def cached(prefix: str, expire: int = 300):
+def cached(prefix: str, expire: int = 300, stale_while_revalidate: int = 0):
     """
-    Decorador para cachear respuestas de funciones async usando hilos.
-    
-    Este decorador utiliza las funciones asíncronas que ejecutan operaciones
-    de Redis en hilos separados, mejorando el rendimiento de la API.
+    Decorador para cachear respuestas de funciones async.
     
-    IMPLEMENTACIÓN DE HILOS:
-    - Usa get_from_cache_async() que ejecuta Redis GET en un hilo
-    - Usa set_to_cache_async() que ejecuta Redis SET en un hilo
-    - No bloquea el event loop durante las operaciones de caché
+    Usa get_or_set_cache_async(): no bloquea el event loop y, ante un fallo de
+    caché con peticiones concurrentes, ejecuta la función una sola vez por clave.
     
     Args:
         prefix: Prefijo para las claves de caché
-        expire: Tiempo de expiración en segundos (por defecto 5 minutos)
+        expire: Tiempo de expiración en segundos (por defecto 5 minutos); con
+            stale_while_revalidate es el tiempo que el valor se considera fresco
+        stale_while_revalidate: Segundos adicionales durante los que se sirve el valor
+            anterior mientras se recalcula en segundo plano (0 = desactivado). La
+            función no debe depender de recursos de la petición (sesión de Depends)
     
     Uso:
-        @cached("vehiculos:list", expire=300)
+        @cached("vehiculos:list", expire=300, stale_while_revalidate=900)
         async def listar_vehiculos(skip: int, limit: int, estado: Optional[str] = None):
             # ... código ...
             return resultado
@@ -382,18 +1258,12 @@ def cached(prefix: str, expire: int = 300):
                     if i < 3:  # Solo los primeros 3 args típicamente
                         cache_kwargs[f"arg_{i}"] = arg
             
-            cache_key = generate_cache_key(prefix, **cache_kwargs)
-            
-            # Intentar obtener de caché (versión async con hilos)
-            cached_result = await get_from_cache_async(cache_key)
-            if cached_result is not None:
-                return cached_result
-            
-            # Ejecutar función y cachear resultado (versión async con hilos)
-            result = await func(*args, **kwargs)
-            await set_to_cache_async(cache_key, result, expire)
+            cache_key = await generate_cache_key_async(prefix, **cache_kwargs)
             
-            return result
+            # Leer de caché o ejecutar la función una sola vez por clave (single-flight)
+            return await get_or_set_cache_async(
+                cache_key, lambda: func(*args, **kwargs), expire, stale_while_revalidate
+            )
         
         return wrapper
     return decorator
@@ -401,95 +1271,196 @@ def cached(prefix: str, expire: int = 300):
 
 # ============================================================================
 # FUNCIONES DE INVALIDACIÓN POR TIPO DE RECURSO
-# Todas usan invalidación en segundo plano (fire-and-forget) con hilos
+# Cada una incrementa la generación del namespace (un INCR, sin recorrer claves)
 # ============================================================================
 
+def invalidate_cache_namespace(namespace: str) -> None:
+    """
+    Invalida toda la caché de un namespace incrementando su generación.
+    
+    Es una única operación O(1) en Redis, independiente del número de claves
+    cacheadas: las entradas de generaciones anteriores ya no se leen y expiran
+    por su TTL. Se ejecuta de forma síncrona para que la siguiente petición ya
+    vea la nueva generación.
+    """
+    client = get_redis_client()
+    if not client:
+        return
+    
+    try:
+        if not client.exists(_key_generacion(namespace)):
+            # Inicializar igual que get_cache_generation antes de incrementar
+            get_cache_generation(namespace)
+        generacion = client.incr(_key_generacion(namespace))
+        # Este worker ve la nueva generación al momento; el resto, al recibir el mensaje
+        _actualizar_generacion_local(namespace, generacion)
+        _publicar(client, {"tipo": "gen", "namespace": namespace, "generacion": generacion})
+    except redis.RedisError as e:
+        print(f"⚠️  Error al invalidar caché ({namespace}): {e}")
+
+
+async def invalidate_cache_namespace_async(namespace: str) -> None:
+    """
+    Versión asíncrona de invalidate_cache_namespace para los handlers async: se espera
+    (await) antes de responder, así que la siguiente petición ya ve la nueva generación,
+    pero sin bloquear el event loop si Redis tarda o no responde.
+    """
+    try:
+        if not await run_redis_command_async("exists", _key_generacion(namespace)):
+            # Inicializar igual que get_cache_generation antes de incrementar
+            await get_cache_generation_async(namespace)
+        generacion = await run_redis_command_async("incr", _key_generacion(namespace))
+        if generacion is None:
+            return
+        # Este worker ve la nueva generación al momento; el resto, al recibir el mensaje
+        _actualizar_generacion_local(namespace, generacion)
+        await run_redis_command_async(
+            "publish", CANAL_INVALIDACIONES,
+            json.dumps({"tipo": "gen", "namespace": namespace, "generacion": generacion})
+        )
+    except redis.RedisError as e:
+        print(f"⚠️  Error al invalidar caché ({namespace}): {e}")
+
+
 def invalidate_vehiculos_cache():
     """
-    Invalida toda la caché relacionada con vehículos (en segundo plano con hilos).
+    Invalida toda la caché relacionada con vehículos.
     
-    Esta función ejecuta la invalidación de forma asíncrona sin bloquear la respuesta HTTP.
+    Incrementa la generación del namespace: no bloquea la respuesta HTTP recorriendo claves.
     """
-    invalidate_cache_pattern_background("vehiculos:*")
+    invalidate_cache_namespace("vehiculos")
 
 
 def invalidate_rutas_cache():
-    """Invalida toda la caché relacionada con rutas (en segundo plano con hilos)."""
-    invalidate_cache_pattern_background("rutas:*")
+    """Invalida toda la caché relacionada con rutas (incrementa su generación)."""
+    invalidate_cache_namespace("rutas")
 
 
 def invalidate_incidencias_cache():
-    """Invalida toda la caché relacionada con incidencias (en segundo plano con hilos)."""
-    invalidate_cache_pattern_background("incidencias:*")
+    """Invalida toda la caché relacionada con incidencias (incrementa su generación)."""
+    invalidate_cache_namespace("incidencias")
 
 
 def invalidate_pedidos_cache():
-    """Invalida toda la caché relacionada con pedidos (en segundo plano con hilos)."""
-    invalidate_cache_pattern_background("pedidos:*")
+    """Invalida toda la caché relacionada con pedidos (incrementa su generación)."""
+    invalidate_cache_namespace("pedidos")
 
 
 def invalidate_mantenimientos_cache():
-    """Invalida toda la caché relacionada con mantenimientos (en segundo plano con hilos)."""
-    invalidate_cache_pattern_background("mantenimientos:*")
+    """Invalida toda la caché relacionada con mantenimientos (incrementa su generación)."""
+    invalidate_cache_namespace("mantenimientos")
 
 
 def invalidate_inmuebles_cache():
-    """Invalida toda la caché relacionada con inmuebles (en segundo plano con hilos)."""
-    invalidate_cache_pattern_background("inmuebles:*")
+    """Invalida toda la caché relacionada con inmuebles (incrementa su generación)."""
+    invalidate_cache_namespace("inmuebles")
 
 
 def invalidate_comunidades_cache():
-    """Invalida toda la caché relacionada con comunidades (en segundo plano con hilos)."""
-    invalidate_cache_pattern_background("comunidades:*")
+    """Invalida toda la caché relacionada con comunidades (incrementa su generación)."""
+    invalidate_cache_namespace("comunidades")
 
 
 def invalidate_conductores_cache():
-    """Invalida toda la caché relacionada con conductores (en segundo plano con hilos)."""
-    invalidate_cache_pattern_background("conductores:*")
+    """Invalida toda la caché relacionada con conductores (incrementa su generación)."""
+    invalidate_cache_namespace("conductores")
 
 
 def invalidate_proveedores_cache():
-    """Invalida toda la caché relacionada con proveedores (en segundo plano con hilos)."""
-    invalidate_cache_pattern_background("proveedores:*")
+    """Invalida toda la caché relacionada con proveedores (incrementa su generación)."""
+    invalidate_cache_namespace("proveedores")
 
 
 def invalidate_propietarios_cache():
-    """Invalida toda la caché relacionada con propietarios (en segundo plano con hilos)."""
-    invalidate_cache_pattern_background("propietarios:*")
+    """Invalida toda la caché relacionada con propietarios (incrementa su generación)."""
+    invalidate_cache_namespace("propietarios")
 
 
 def invalidate_usuarios_cache():
-    """Invalida toda la caché relacionada con usuarios (en segundo plano con hilos)."""
-    invalidate_cache_pattern_background("usuarios:*")
+    """Invalida toda la caché relacionada con usuarios (incrementa su generación)."""
+    invalidate_cache_namespace("usuarios")
 
 
 def invalidate_documentos_cache():
-    """Invalida toda la caché relacionada con documentos (en segundo plano con hilos)."""
-    invalidate_cache_pattern_background("documentos:*")
+    """Invalida toda la caché relacionada con documentos (incrementa su generación)."""
+    invalidate_cache_namespace("documentos")
 
 
 def invalidate_actuaciones_cache():
-    """Invalida toda la caché relacionada con actuaciones (en segundo plano con hilos)."""
-    invalidate_cache_pattern_background("actuaciones:*")
+    """Invalida toda la caché relacionada con actuaciones (incrementa su generación)."""
+    invalidate_cache_namespace("actuaciones")
 
 
 def invalidate_mensajes_cache():
-    """Invalida toda la caché relacionada con mensajes (en segundo plano con hilos)."""
-    invalidate_cache_pattern_background("mensajes:*")
+    """Invalida toda la caché relacionada con mensajes (incrementa su generación)."""
+    invalidate_cache_namespace("mensajes")
+
+
+# Variantes para handlers async (no bloquean el event loop): await invalidate_<recurso>_cache_async()
+async def invalidate_vehiculos_cache_async():
+    await invalidate_cache_namespace_async("vehiculos")
+
+
+async def invalidate_rutas_cache_async():
+    await invalidate_cache_namespace_async("rutas")
+
+
+async def invalidate_incidencias_cache_async():
+    await invalidate_cache_namespace_async("incidencias")
+
+
+async def invalidate_pedidos_cache_async():
+    await invalidate_cache_namespace_async("pedidos")
+
+
+async def invalidate_mantenimientos_cache_async():
+    await invalidate_cache_namespace_async("mantenimientos")
+
+
+async def invalidate_inmuebles_cache_async():
+    await invalidate_cache_namespace_async("inmuebles")
+
+
+async def invalidate_comunidades_cache_async():
+    await invalidate_cache_namespace_async("comunidades")
+
+
+async def invalidate_conductores_cache_async():
+    await invalidate_cache_namespace_async("conductores")
+
+
+async def invalidate_proveedores_cache_async():
+    await invalidate_cache_namespace_async("proveedores")
+
+
+async def invalidate_propietarios_cache_async():
+    await invalidate_cache_namespace_async("propietarios")
+
+
+async def invalidate_usuarios_cache_async():
+    await invalidate_cache_namespace_async("usuarios")
+
+
+async def invalidate_documentos_cache_async():
+    await invalidate_cache_namespace_async("documentos")
+
+
+async def invalidate_actuaciones_cache_async():
+    await invalidate_cache_namespace_async("actuaciones")
+
+
+async def invalidate_mensajes_cache_async():
+    await invalidate_cache_namespace_async("mensajes")
 
 
 async def invalidate_all_cache_async():
-    """
-    Invalida toda la caché de forma asíncrona usando hilos (usar con precaución).
-    
-    Esta función ejecuta FLUSHDB en un hilo separado para no bloquear el event loop.
-    """
-    client = get_redis_client()
-    if client:
-        try:
-            await asyncio.to_thread(client.flushdb)
-        except redis.RedisError as e:
-            print(f"⚠️  Error al limpiar caché: {e}")
+    """Invalida toda la caché de forma asíncrona (usar con precaución)."""
+    try:
+        if await run_redis_command_async("flushdb"):
+            _l1_vaciar()
+            await run_redis_command_async("publish", CANAL_INVALIDACIONES, json.dumps({"tipo": "flush"}))
+    except redis.RedisError as e:
+        print(f"⚠️  Error al limpiar caché: {e}")
 
 
 def invalidate_all_cache():
@@ -498,5 +1469,7 @@ def invalidate_all_cache():
     if client:
         try:
             client.flushdb()
+            _l1_vaciar()
+            _publicar(client, {"tipo": "flush"})
         except redis.RedisError as e:
             print(f"⚠️  Error al limpiar caché: {e}")
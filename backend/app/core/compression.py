@@ -0,0 +1,175 @@
+"""
+Compresión de respuestas HTTP (gzip y brotli).
+
+CompressionMiddleware comprime las respuestas de texto (JSON, NDJSON, HTML...) de al
+menos COMPRESSION_MIN_BYTES cuando el cliente lo acepta (Accept-Encoding), eligiendo
+brotli si está instalado y el cliente lo admite, y gzip en otro caso. Las respuestas
+en streaming se comprimen por fragmentos.
+
+No toca las respuestas que ya llevan Content-Encoding: los listados cacheados
+(app.core.cache.CachedJSON) guardan el cuerpo ya comprimido y lo sirven tal cual, sin
+gastar CPU en comprimir en cada acierto. Tampoco las de tipos ya comprimidos
+(imágenes, PDF, XLSX...).
+"""
+import gzip
+import zlib
+from typing import Dict, Iterable, Optional
+
+from app.core.config import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Tipos de contenido que compensa comprimir (texto); el resto ya suele ir comprimido
+_TIPOS_COMPRIMIBLES = (
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+    "text/",
+)
+
+
+def available_encodings() -> Iterable[str]:
+    """Codificaciones que puede generar este worker, por orden de preferencia."""
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def choose_encoding(accept_encoding: Optional[str], disponibles: Optional[Iterable[str]] = None) -> Optional[str]:
+    """
+    Elige la codificación para la cabecera Accept-Encoding del cliente (o None si no
+    acepta ninguna de las disponibles). Respeta q=0 y el comodín "*".
+    """
+    if not accept_encoding:
+        return None
+    aceptadas: Dict[str, float] = {}
+    for parte in accept_encoding.lower().split(","):
+        nombre, _, parametros = parte.strip().partition(";")
+        calidad = 1.0
+        parametro = parametros.strip()
+        if parametro.startswith("q="):
+            try:
+                calidad = float(parametro[2:])
+            except ValueError:
+                calidad = 0.0
+        aceptadas[nombre.strip()] = calidad
+    comodin = aceptadas.get("*", 0.0)
+    for codificacion in disponibles if disponibles is not None else available_encodings():
+        if aceptadas.get(codificacion, comodin) > 0:
+            return codificacion
+    return None
+
+
+def compress(data: bytes, codificacion: str) -> bytes:
+    """Comprime un cuerpo completo con gzip o brotli."""
+    if codificacion == "br":
+        return brotli.compress(data, quality=settings.COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=settings.COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+def _es_comprimible(content_type: str) -> bool:
+    return content_type.lower().startswith(_TIPOS_COMPRIMIBLES)
+
+
+class _CompresorStreaming:
+    """Compresión por fragmentos: cada fragmento se envía en cuanto llega (flush)."""
+
+    def __init__(self, codificacion: str):
+        self.codificacion = codificacion
+        if codificacion == "br":
+            self._compresor = brotli.Compressor(quality=settings.COMPRESSION_BROTLI_QUALITY)
+        else:
+            # wbits=31: formato gzip (cabecera y CRC) en lugar de zlib
+            self._compresor = zlib.compressobj(settings.COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def fragmento(self, data: bytes) -> bytes:
+        if self.codificacion == "br":
+            return self._compresor.process(data) + self._compresor.flush()
+        return self._compresor.compress(data) + self._compresor.flush(zlib.Z_SYNC_FLUSH)
+
+    def fin(self) -> bytes:
+        if self.codificacion == "br":
+            return self._compresor.finish()
+        return self._compresor.flush(zlib.Z_FINISH)
+
+
+class CompressionMiddleware:
+    """Middleware ASGI de compresión gzip/brotli con tamaño mínimo (COMPRESSION_MIN_BYTES)."""
+
+    def __init__(self, app, minimum_size: Optional[int] = None):
+        self.app = app
+        self.minimum_size = settings.COMPRESSION_MIN_BYTES if minimum_size is None else minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        cabeceras = dict(scope.get("headers") or [])
+        codificacion = choose_encoding(cabeceras.get(b"accept-encoding", b"").decode("latin-1"))
+        if codificacion is None:
+            await self.app(scope, receive, send)
+            return
+
+        inicio: Optional[dict] = None
+        compresor: Optional[_CompresorStreaming] = None
+        sin_comprimir = False
+
+        async def enviar(message):
+            nonlocal inicio, compresor, sin_comprimir
+            if message["type"] == "http.response.start":
+                # Se retiene hasta ver el primer fragmento del cuerpo (tamaño, streaming)
+                inicio = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            if inicio is not None:
+                mensaje_inicio, inicio = inicio, None
+                cabeceras_respuesta = {k.lower(): v for k, v in mensaje_inicio.get("headers", [])}
+                cuerpo = message.get("body", b"")
+                streaming = message.get("more_body", False)
+                if (
+                    b"content-encoding" in cabeceras_respuesta
+                    or not _es_comprimible(cabeceras_respuesta.get(b"content-type", b"").decode("latin-1"))
+                    or (not streaming and len(cuerpo) < self.minimum_size)
+                ):
+                    sin_comprimir = True
+                    await send(mensaje_inicio)
+                    await send(message)
+                    return
+
+                headers = [
+                    (k, v) for k, v in mensaje_inicio.get("headers", [])
+                    if k.lower() not in (b"content-length", b"etag")
+                ]
+                headers.append((b"content-encoding", codificacion.encode("latin-1")))
+                headers.append((b"vary", b"Accept-Encoding"))
+                etag = cabeceras_respuesta.get(b"etag")
+                if etag:
+                    # La representación comprimida es otra: el ETag fuerte debe distinguirla
+                    headers.append((b"etag", etag.rstrip(b'"') + b"-" + codificacion.encode("latin-1") + b'"'))
+                if streaming:
+                    compresor = _CompresorStreaming(codificacion)
+                    await send({**mensaje_inicio, "headers": headers})
+                    await send({"type": "http.response.body", "body": compresor.fragmento(cuerpo), "more_body": True})
+                    return
+                comprimido = compress(cuerpo, codificacion)
+                headers.append((b"content-length", str(len(comprimido)).encode("latin-1")))
+                await send({**mensaje_inicio, "headers": headers})
+                await send({"type": "http.response.body", "body": comprimido})
+                return
+
+            if sin_comprimir or compresor is None:
+                await send(message)
+                return
+            if message.get("more_body", False):
+                await send({"type": "http.response.body", "body": compresor.fragmento(message.get("body", b"")), "more_body": True})
+            else:
+                datos = compresor.fragmento(message.get("body", b"")) + compresor.fin()
+                await send({"type": "http.response.body", "body": datos})
+
+        await self.app(scope, receive, enviar)
@@ -9,12 +9,58 @@ class Settings(BaseSettings):
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     CORS_ORIGINS: Union[List[str], str] = ["http://localhost:4200", "http://localhost:80", "http://localhost"]
     REDIS_URL: str = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+    REDIS_MAX_CONNECTIONS: int = 50  # pool redis.asyncio por worker
+    REDIS_SOCKET_TIMEOUT: float = 2.0  # segundos por comando (y espera de conexión libre)
+    REDIS_SOCKET_CONNECT_TIMEOUT: float = 2.0
+    REDIS_HEALTH_CHECK_INTERVAL: int = 30  # PING si la conexión lleva este tiempo ociosa
+    REDIS_RECONNECT_MAX_BACKOFF_SECONDS: int = 30  # espera máxima entre reintentos si Redis cae
     CACHE_EXPIRE_SECONDS: int = 300  # 5 minutos por defecto
+    CACHE_LOCAL_TTL_SECONDS: int = 30  # caché en memoria (L1) de cada worker delante de Redis
+    CACHE_LOCAL_MAX_ENTRIES: int = 2000  # entradas en L1 por worker (LRU)
+    CACHE_LOCK_TIMEOUT_SECONDS: float = 10.0  # lock single-flight para recalcular una clave
+    CACHE_SINGLE_FLIGHT_WAIT_SECONDS: float = 5.0  # espera máxima al cálculo de otro worker
+    CACHE_SERIALIZER: str = "orjson"  # "orjson" o "json" (se usa json si orjson no está instalado)
+    CACHE_COMPRESSION: str = "zstd"  # "zstd" o "none" (sin comprimir si zstandard no está instalado)
+    CACHE_COMPRESSION_MIN_BYTES: int = 1024  # por debajo no compensa comprimir
+    CACHE_COMPRESSION_LEVEL: int = 3  # nivel zstd (1-22): 3 es rápido y ya reduce 5-10x el JSON
+
+    # Compresión de respuestas HTTP (CompressionMiddleware y listados cacheados)
+    COMPRESSION_MIN_BYTES: int = 1024  # respuestas más pequeñas se envían sin comprimir
+    COMPRESSION_GZIP_LEVEL: int = 6  # nivel gzip (1-9)
+    COMPRESSION_BROTLI_QUALITY: int = 5  # calidad brotli (0-11): a partir de 6-7 el coste crece mucho
+
+    # Sincronización incremental de rutas en la app móvil (GET /rutas/mis-rutas/cambios)
+    SYNC_CURSOR_OVERLAP_SECONDS: int = 60  # margen hacia atrás del cursor: cubre transacciones aún sin confirmar
+    SYNC_TOMBSTONE_RETENTION_DAYS: int = 30  # marcas de borrado; un cursor más antiguo recibe la lista completa
+
+    # Subida de archivos (app.core.uploads)
+    UPLOAD_CHUNK_SIZE: int = 1024 * 1024  # bytes leídos y escritos por fragmento (1MB)
+    BLOB_STORAGE_BACKEND: str = "local"  # almacén de contenidos (app.core.storage): "local"
+    BLOB_STORAGE_DIR: str = "/app/uploads/blobs"  # raíz del almacén local (un archivo por SHA-256)
+    BLOB_ORPHAN_GRACE_SECONDS: int = 3600  # antigüedad mínima del contenido sin referencias antes de borrarlo
+    BLOB_SWEEP_INTERVAL_SECONDS: int = 3600  # limpieza del almacén como mucho cada hora por worker
+
+    # Miniaturas de fotos de entrega (app.core.thumbnails)
+    THUMBNAIL_DIR: str = "/app/uploads/derivados"  # derivados WebP por tamaño y contenido
+    THUMBNAIL_SIZE: int = 320  # lado mayor (px) de la miniatura (?size=thumb)
+    THUMBNAIL_MEDIUM_SIZE: int = 1280  # lado mayor (px) de la previsualización (?size=medium)
+    THUMBNAIL_QUALITY: int = 80  # calidad WebP (0-100)
+    THUMBNAIL_WORKERS: int = 2  # hilos del pool que generan derivados
 
     # Protección contra fuerza bruta (login)
     LOGIN_MAX_ATTEMPTS: int = 5  # intentos fallidos antes de bloquear
     LOGIN_BLOCK_SECONDS: int = 900  # 15 minutos de bloqueo
     LOGIN_ATTEMPT_WINDOW_SECONDS: int = 300  # ventana de 5 min para contar intentos
+
+    # Exportaciones PDF en segundo plano
+    EXPORT_JOBS_DIR: str = "/app/uploads/exports"  # ficheros PDF generados
+    EXPORT_JOB_WORKERS: int = 2  # procesos del pool que renderizan PDFs
+    EXPORT_JOB_TTL_SECONDS: int = 3600  # 1 hora: estado en Redis y fichero generado
+
+    # Caché del usuario autenticado (get_current_user)
+    USER_CACHE_LOCAL_TTL_SECONDS: int = 15  # copia en memoria de cada worker
+    USER_CACHE_TTL_SECONDS: int = 300  # copia compartida en Redis
+    USER_CACHE_MAX_ENTRIES: int = 1000  # usuarios en memoria por worker (LRU)
     
     class Config:
         env_file = ".env"
@@ -0,0 +1,157 @@
+"""
+Exportación de informes en streaming (CSV y Excel).
+
+Los endpoints exportar_* de informes e historial reciben un iterable de filas
+(alimentado por un cursor de servidor con Query.yield_per) y lo envían al cliente
+sin construir el fichero completo en memoria:
+
+- CSV: un generador escribe las filas por bloques y StreamingResponse envía cada
+  bloque en cuanto está listo (el primer byte sale sin esperar al resto).
+- Excel: openpyxl en modo write-only sobre un SpooledTemporaryFile, que pasa a
+  disco cuando supera XLSX_SPOOL_MAX_SIZE. El fichero se envía después por trozos.
+
+Los generadores son síncronos, así que Starlette los itera en el threadpool y las
+consultas a la base de datos no bloquean el event loop.
+"""
+import csv
+import io
+import itertools
+import tempfile
+from typing import Any, Dict, Iterable, Iterator, Optional, Sequence
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+# Filas que se piden a PostgreSQL en cada vuelta del cursor de servidor
+EXPORT_YIELD_PER = 500
+# Filas CSV que se acumulan antes de enviar un bloque al cliente
+CSV_FLUSH_ROWS = 500
+# Tamaño a partir del cual el fichero Excel temporal pasa de memoria a disco
+XLSX_SPOOL_MAX_SIZE = 5 * 1024 * 1024
+# Tamaño de cada trozo al enviar el fichero Excel
+XLSX_CHUNK_SIZE = 64 * 1024
+
+MEDIA_TYPE_CSV = "text/csv"
+MEDIA_TYPE_XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+FORMATOS_EXPORTACION = ("csv", "excel", "pdf")
+
+
+def validar_formato(formato: str) -> str:
+    """Normaliza el formato de exportación o lanza 400 si no es válido."""
+    formato = (formato or "").lower()
+    if formato not in FORMATOS_EXPORTACION:
+        raise HTTPException(status_code=400, detail="Formato no válido. Use: csv, excel o pdf")
+    return formato
+
+
+def iterar_query(query, chunk_size: int = EXPORT_YIELD_PER):
+    """
+    Itera una Query de SQLAlchemy por bloques usando un cursor de servidor.
+
+    yield_per activa stream_results, de modo que psycopg2 usa un cursor con nombre
+    y solo mantiene chunk_size filas en memoria cada vez.
+    """
+    return query.yield_per(chunk_size)
+
+
+def _attachment(filename: str) -> Dict[str, str]:
+    return {"Content-Disposition": f"attachment; filename={filename}"}
+
+
+def csv_streaming_response(
+    filename: str,
+    encabezados: Sequence[Any],
+    filas: Iterable[Sequence[Any]],
+    titulo: Optional[str] = None,
+) -> StreamingResponse:
+    """
+    Devuelve un CSV en streaming.
+
+    Args:
+        filename: Nombre del fichero para Content-Disposition
+        encabezados: Fila de encabezados de columnas
+        filas: Iterable (normalmente un generador) con las filas de datos
+        titulo: Texto opcional en la primera línea, seguido de una línea en blanco
+    """
+    cabecera = [[titulo], []] if titulo else []
+
+    def generar() -> Iterator[str]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        pendientes = 0
+        for fila in itertools.chain(cabecera, [encabezados], filas):
+            writer.writerow(fila)
+            pendientes += 1
+            if pendientes >= CSV_FLUSH_ROWS:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate(0)
+                pendientes = 0
+        if pendientes:
+            yield buffer.getvalue()
+        buffer.close()
+
+    return StreamingResponse(generar(), media_type=MEDIA_TYPE_CSV, headers=_attachment(filename))
+
+
+def xlsx_streaming_response(
+    filename: str,
+    titulo_hoja: str,
+    encabezados: Sequence[Any],
+    filas: Iterable[Sequence[Any]],
+    titulo: Optional[str] = None,
+    anchos: Optional[Dict[str, float]] = None,
+) -> StreamingResponse:
+    """
+    Devuelve un Excel (.xlsx) escrito con openpyxl en modo write-only.
+
+    Args:
+        filename: Nombre del fichero para Content-Disposition
+        titulo_hoja: Nombre de la hoja
+        encabezados: Fila de encabezados (se escribe en negrita y centrada)
+        filas: Iterable (normalmente un generador) con las filas de datos
+        titulo: Texto opcional en negrita en la primera fila, seguido de una fila en blanco
+        anchos: Ancho por letra de columna (ej: {"A": 30})
+    """
+    try:
+        from openpyxl import Workbook
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.styles import Font, Alignment
+    except ImportError:
+        raise HTTPException(status_code=500, detail="openpyxl no está instalado. Instálelo con: pip install openpyxl")
+
+    def escribir(destino) -> None:
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet(titulo_hoja)
+        for columna, ancho in (anchos or {}).items():
+            ws.column_dimensions[columna].width = ancho
+
+        if titulo:
+            celda_titulo = WriteOnlyCell(ws, value=titulo)
+            celda_titulo.font = Font(bold=True, size=12)
+            ws.append([celda_titulo])
+            ws.append([])
+
+        fila_encabezados = []
+        for valor in encabezados:
+            celda = WriteOnlyCell(ws, value=valor)
+            celda.font = Font(bold=True)
+            celda.alignment = Alignment(horizontal="center")
+            fila_encabezados.append(celda)
+        ws.append(fila_encabezados)
+
+        for fila in filas:
+            ws.append(list(fila))
+        wb.save(destino)
+
+    def generar() -> Iterator[bytes]:
+        with tempfile.SpooledTemporaryFile(max_size=XLSX_SPOOL_MAX_SIZE) as destino:
+            escribir(destino)
+            destino.seek(0)
+            while True:
+                trozo = destino.read(XLSX_CHUNK_SIZE)
+                if not trozo:
+                    break
+                yield trozo
+
+    return StreamingResponse(generar(), media_type=MEDIA_TYPE_XLSX, headers=_attachment(filename))
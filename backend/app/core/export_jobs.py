@@ -0,0 +1,227 @@
+"""
+Trabajos de exportación PDF en segundo plano.
+
+Renderizar un PDF grande con ReportLab tarda segundos y es CPU pura, así que no se
+hace dentro del handler: el endpoint crea un trabajo y devuelve su id, un proceso de
+un pool local (ProcessPoolExecutor) consulta la base de datos y genera el fichero, y
+el cliente consulta el estado hasta poder descargarlo.
+
+- Estado de cada trabajo: hash de Redis "export_job:<id>" con expiración
+  EXPORT_JOB_TTL_SECONDS, visible desde cualquier worker de gunicorn.
+- Ficheros: EXPORT_JOBS_DIR/<id>.pdf, escritos como .part y renombrados al terminar.
+- Los procesos del pool se crean con "spawn" para no heredar las conexiones
+  abiertas (PostgreSQL, Redis) del proceso padre.
+
+Ciclo de vida: pendiente → procesando → completado | error
+"""
+import asyncio
+import importlib
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Set
+
+import redis
+
+from app.core.cache import get_redis_client, run_redis_command_async
+from app.core.config import settings
+
+ESTADO_PENDIENTE = "pendiente"
+ESTADO_PROCESANDO = "procesando"
+ESTADO_COMPLETADO = "completado"
+ESTADO_ERROR = "error"
+
+_pool: Optional[ProcessPoolExecutor] = None
+# Tareas lanzadas sin esperar: el event loop solo guarda referencias débiles
+_tareas: Set[asyncio.Task] = set()
+
+
+def _key_job(job_id: str) -> str:
+    return f"export_job:{job_id}"
+
+
+def _ahora() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _ruta_fichero(job_id: str) -> str:
+    return os.path.join(settings.EXPORT_JOBS_DIR, f"{job_id}.pdf")
+
+
+def get_export_pool() -> ProcessPoolExecutor:
+    """Obtiene el pool de procesos de exportación, creándolo si es necesario."""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.EXPORT_JOB_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+def shutdown_export_pool() -> None:
+    """Detiene el pool de procesos (se llama al apagar la aplicación)."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _actualizar_job(client: redis.Redis, job_id: str, **campos) -> None:
+    key = _key_job(job_id)
+    campos = {k: ("" if v is None else str(v)) for k, v in campos.items()}
+    pipe = client.pipeline()
+    pipe.hset(key, mapping=campos)
+    pipe.expire(key, settings.EXPORT_JOB_TTL_SECONDS)
+    pipe.execute()
+
+
+def _limpiar_ficheros_caducados() -> None:
+    """Borra ficheros de exportación más antiguos que EXPORT_JOB_TTL_SECONDS."""
+    limite = time.time() - settings.EXPORT_JOB_TTL_SECONDS
+    try:
+        with os.scandir(settings.EXPORT_JOBS_DIR) as entradas:
+            for entrada in entradas:
+                if entrada.is_file() and entrada.stat().st_mtime < limite:
+                    os.remove(entrada.path)
+    except OSError:
+        pass
+
+
+def ejecutar_job(job_id: str, generador: str, params: Dict[str, Any]) -> None:
+    """
+    Punto de entrada en el proceso del pool: genera el PDF de un trabajo.
+
+    Args:
+        job_id: Identificador del trabajo
+        generador: Función que devuelve el contenido del PDF, como "modulo:funcion".
+            Recibe (db, **params) y devuelve un dict con titulo, subtitulo,
+            headers, rows (iterable) y opcionalmente compacto.
+        params: Parámetros del informe (fechas, filtros)
+    """
+    from app.database import SessionLocal
+    from app.core.pdf import build_pdf
+
+    client = get_redis_client()
+    if client is None:
+        # El proceso padre marca el trabajo como fallido (_job_terminado)
+        raise RuntimeError("Redis no disponible en el proceso de exportación")
+
+    _actualizar_job(client, job_id, estado=ESTADO_PROCESANDO)
+    ruta = _ruta_fichero(job_id)
+    ruta_temporal = f"{ruta}.part"
+    db = SessionLocal()
+    try:
+        modulo, funcion = generador.split(":")
+        generar = getattr(importlib.import_module(modulo), funcion)
+        documento = generar(db, **params)
+
+        os.makedirs(settings.EXPORT_JOBS_DIR, exist_ok=True)
+        build_pdf(
+            documento["titulo"],
+            documento["subtitulo"],
+            documento["headers"],
+            documento["rows"],
+            destino=ruta_temporal,
+            compacto=documento.get("compacto", False),
+        )
+        os.replace(ruta_temporal, ruta)
+        _actualizar_job(
+            client, job_id,
+            estado=ESTADO_COMPLETADO,
+            filename=documento["filename"],
+            finalizado_en=_ahora(),
+        )
+    except Exception as e:
+        if os.path.exists(ruta_temporal):
+            os.remove(ruta_temporal)
+        _actualizar_job(client, job_id, estado=ESTADO_ERROR, error=str(e)[:500], finalizado_en=_ahora())
+    finally:
+        db.close()
+
+
+def _en_segundo_plano(funcion, *args) -> None:
+    """Ejecuta funcion en un hilo sin esperarla, conservando la tarea hasta que termine."""
+    tarea = asyncio.get_running_loop().create_task(asyncio.to_thread(funcion, *args))
+    _tareas.add(tarea)
+    tarea.add_done_callback(_tareas.discard)
+
+
+def _marcar_error(job_id: str, error: str) -> None:
+    client = get_redis_client()
+    if client:
+        try:
+            _actualizar_job(client, job_id, estado=ESTADO_ERROR, error=error, finalizado_en=_ahora())
+        except redis.RedisError:
+            pass
+
+
+def _job_terminado(job_id: str, futuro: asyncio.Future) -> None:
+    """
+    Marca el trabajo como fallido si el proceso del pool terminó de forma anómala.
+    Se ejecuta en el event loop: la escritura en Redis se hace en un hilo.
+    """
+    if futuro.cancelled() or futuro.exception() is None:
+        return
+    _en_segundo_plano(_marcar_error, job_id, str(futuro.exception())[:500])
+
+
+async def crear_job(tipo: str, generador: str, params: Dict[str, Any], usuario_id: int) -> Optional[Dict[str, str]]:
+    """
+    Registra un trabajo en Redis y lo envía al pool de procesos.
+
+    Returns:
+        Estado inicial del trabajo, o None si Redis no está disponible
+    """
+    # get_redis_client puede hacer un ping bloqueante (reconexión): fuera del event loop
+    client = await asyncio.to_thread(get_redis_client)
+    if not client:
+        return None
+
+    job_id = uuid.uuid4().hex
+    job = {
+        "id": job_id,
+        "tipo": tipo,
+        "estado": ESTADO_PENDIENTE,
+        "usuario_id": str(usuario_id),
+        "creado_en": _ahora(),
+    }
+    try:
+        await asyncio.to_thread(_actualizar_job, client, job_id, **job)
+    except redis.RedisError as e:
+        print(f"⚠️  Error al registrar trabajo de exportación: {e}")
+        return None
+
+    loop = asyncio.get_running_loop()
+    try:
+        futuro = loop.run_in_executor(get_export_pool(), ejecutar_job, job_id, generador, params)
+    except BrokenProcessPool:
+        # Un proceso del pool murió (ej: OOM): el pool queda inutilizable, se recrea
+        shutdown_export_pool()
+        futuro = loop.run_in_executor(get_export_pool(), ejecutar_job, job_id, generador, params)
+    futuro.add_done_callback(lambda f: _job_terminado(job_id, f))
+    # Aprovechar cada alta para borrar ficheros de trabajos caducados
+    _en_segundo_plano(_limpiar_ficheros_caducados)
+    return job
+
+
+async def obtener_job(job_id: str) -> Optional[Dict[str, str]]:
+    """Devuelve el estado de un trabajo o None si no existe (o ha caducado)."""
+    try:
+        job = await run_redis_command_async("hgetall", _key_job(job_id))
+    except redis.RedisError as e:
+        print(f"⚠️  Error al leer trabajo de exportación ({job_id}): {e}")
+        return None
+    return job or None
+
+
+def ruta_fichero_job(job_id: str) -> Optional[str]:
+    """Ruta del PDF generado si existe en disco."""
+    if not job_id.isalnum():
+        return None
+    ruta = _ruta_fichero(job_id)
+    return ruta if os.path.isfile(ruta) else None
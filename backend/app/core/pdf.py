@@ -0,0 +1,160 @@
+"""
+Generación de informes PDF con ReportLab (compartido por informes e historial).
+
+Las filas se reparten en tablas de PDF_CHUNK_ROWS filas, cada una con su fila de
+encabezados, en lugar de una única tabla Platypus con todas las filas: una tabla
+de 50.000 filas obliga a ReportLab a calcular y partir la tabla completa en cada
+salto de página, con un consumo de memoria y CPU que crece con el total. Además
+el documento se maqueta flowable a flowable (_construir) y cada tabla se crea
+cuando le toca, así que las filas pueden venir de un generador (cursor de
+servidor) sin cargarse todas en memoria.
+"""
+import io
+from itertools import chain, islice
+from typing import Any, Iterable, List, Optional, Sequence
+
+from fastapi import HTTPException
+from fastapi.responses import Response
+from starlette.concurrency import run_in_threadpool
+
+# Filas por tabla Platypus (par, para que las filas alternas sigan coincidiendo)
+PDF_CHUNK_ROWS = 500
+
+
+def _trozos(filas: Iterable[Sequence[Any]], tamano: int):
+    iterador = iter(filas)
+    while True:
+        trozo = [list(fila) for fila in islice(iterador, tamano)]
+        if not trozo:
+            return
+        yield trozo
+
+
+def _construir(doc, flowables: Iterable[Any]) -> None:
+    """
+    Maqueta los flowables de uno en uno con handle_flowable, igual que hace
+    BaseDocTemplate.build con una lista, pero consumiendo un iterable: cada tabla se
+    crea cuando le toca y se descarta al colocarla, así que en memoria solo hay una.
+    """
+    doc._startBuild()
+    for flowable in flowables:
+        # handle_flowable consume pendientes[0] y, si no cabe en la página, inserta
+        # al principio los trozos que quedan por colocar
+        pendientes = [flowable]
+        while pendientes:
+            doc.clean_hanging()
+            doc.handle_flowable(pendientes)
+    doc._endBuild()
+
+
+def build_pdf(
+    titulo: str,
+    subtitulo: str,
+    headers: Sequence[str],
+    rows: Iterable[Sequence[Any]],
+    destino: Optional[str] = None,
+    compacto: bool = False,
+) -> Optional[bytes]:
+    """
+    Genera un PDF apaisado con título, subtítulo y una tabla de datos.
+
+    Args:
+        titulo: Título del documento
+        subtitulo: Texto bajo el título (ej: período del informe)
+        headers: Encabezados de columnas (se repiten en cada página)
+        rows: Iterable de filas; se consume por bloques de PDF_CHUNK_ROWS
+        destino: Ruta del fichero de salida. Si es None se devuelven los bytes
+        compacto: Márgenes y fuentes más pequeños (tablas con muchas columnas)
+
+    Returns:
+        Bytes del PDF si no se indica destino, None en caso contrario
+    """
+    try:
+        from reportlab.lib.pagesizes import A4, landscape
+        from reportlab.lib import colors
+        from reportlab.lib.styles import getSampleStyleSheet
+        from reportlab.platypus import Frame, PageTemplate, SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+    except ImportError:
+        raise HTTPException(status_code=500, detail="reportlab no está instalado. Instálelo con: pip install reportlab")
+
+    margen_lateral = 20 if compacto else 24
+    fuente_encabezado, fuente_datos = (9, 8) if compacto else (10, 9)
+    padding_h, padding_v = (4, 3) if compacto else (6, 4)
+
+    buffer = io.BytesIO() if destino is None else None
+    doc = SimpleDocTemplate(
+        buffer if destino is None else destino,
+        pagesize=landscape(A4),
+        leftMargin=margen_lateral, rightMargin=margen_lateral, topMargin=24, bottomMargin=24
+    )
+    styles = getSampleStyleSheet()
+    estilo_tabla = TableStyle([
+        ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#f2f4f7")),
+        ("TEXTCOLOR", (0, 0), (-1, 0), colors.HexColor("#2f343d")),
+        ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+        ("FONTSIZE", (0, 0), (-1, 0), fuente_encabezado),
+        ("ALIGN", (0, 0), (-1, 0), "CENTER"),
+        ("GRID", (0, 0), (-1, -1), 0.25, colors.HexColor("#e0e0e0")),
+        ("FONTSIZE", (0, 1), (-1, -1), fuente_datos),
+        ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+        ("ROWBACKGROUNDS", (0, 1), (-1, -1), [colors.white, colors.HexColor("#fafafa")]),
+        ("LEFTPADDING", (0, 0), (-1, -1), padding_h),
+        ("RIGHTPADDING", (0, 0), (-1, -1), padding_h),
+        ("TOPPADDING", (0, 0), (-1, -1), padding_v),
+        ("BOTTOMPADDING", (0, 0), (-1, -1), padding_v),
+    ])
+
+    def tabla(filas: List[list]):
+        table = Table([list(headers)] + filas, repeatRows=1)
+        table.setStyle(estilo_tabla)
+        return table
+
+    def tablas():
+        vacio = True
+        for trozo in _trozos(rows, PDF_CHUNK_ROWS):
+            vacio = False
+            yield tabla(trozo)
+        if vacio:
+            yield tabla([])
+
+    # Las mismas plantillas de página que crea SimpleDocTemplate.build
+    marco = Frame(doc.leftMargin, doc.bottomMargin, doc.width, doc.height, id="normal")
+    doc.addPageTemplates([
+        PageTemplate(id="First", frames=marco, pagesize=doc.pagesize),
+        PageTemplate(id="Later", frames=marco, pagesize=doc.pagesize),
+    ])
+    _construir(
+        doc,
+        chain(
+            [Paragraph(titulo, styles["Title"]), Paragraph(subtitulo, styles["Normal"]), Spacer(1, 12)],
+            tablas(),
+        ),
+    )
+    if buffer is None:
+        return None
+    pdf = buffer.getvalue()
+    buffer.close()
+    return pdf
+
+
+async def pdf_response(documento: dict) -> Response:
+    """
+    Genera el PDF descrito por documento en el threadpool y lo devuelve como descarga.
+
+    documento es el dict que devuelven los generadores pdf_* de informes e historial
+    (filename, titulo, subtitulo, headers, rows y opcionalmente compacto). Para
+    informes muy grandes es preferible crear un trabajo en /exportaciones.
+    """
+    pdf_bytes = await run_in_threadpool(
+        build_pdf,
+        documento["titulo"],
+        documento["subtitulo"],
+        documento["headers"],
+        documento["rows"],
+        compacto=documento.get("compacto", False),
+    )
+    return Response(
+        content=pdf_bytes,
+        media_type="application/pdf",
+        headers={"Content-Disposition": f"attachment; filename={documento['filename']}"},
+    )
@@ -0,0 +1,400 @@
+"""
+Almacén de archivos subidos direccionado por contenido (SHA-256) y deduplicado.
+
+Los archivos subidos (documentos de incidencias, fotos y firmas de paradas, fotos de
+incidencias de ruta) se guardan una sola vez por contenido: subir el mismo PDF a diez
+incidencias ocupa lo que uno. Cada registro guarda una referencia
+"blob:<sha256><extensión>" (la extensión solo sirve para deducir el tipo al
+servirlo) y la tabla blobs (app.models.blob.Blob) cuenta las referencias de cada
+contenido; el archivo se borra del almacén cuando la cuenta llega a cero.
+
+El almacén es intercambiable (BlobStorage): ahora en disco local (LocalBlobStorage,
+BLOB_STORAGE_DIR/ab/cd/<sha256>); un almacén compatible con S3 solo tiene que
+implementar la misma interfaz y registrarse en get_blob_storage.
+
+Ciclo de vida y concurrencia:
+- store_upload suma la referencia (INSERT ... ON CONFLICT DO UPDATE) y coloca el
+  archivo antes del commit. Si la transacción no llega a confirmarse, el contenido
+  queda en el almacén sin contar: sweep_blobs lo borra pasado BLOB_ORPHAN_GRACE_SECONDS
+  (cada subida refresca la fecha del archivo, así que nunca se borra uno que una
+  transacción en curso acaba de volver a usar).
+- release_file solo decrementa la cuenta. Tras el commit (evento after_commit) se borra
+  la fila que haya quedado a cero con DELETE ... RETURNING y, con la fila aún
+  bloqueada, el archivo: si el commit falla, el contenido sigue intacto, y una subida
+  simultánea del mismo contenido espera al bloqueo y vuelve a colocar el archivo.
+  Lo que no se llegue a borrar entonces (error, caída del proceso) lo recoge
+  sweep_blobs, que se lanza en segundo plano desde store_upload como mucho cada
+  BLOB_SWEEP_INTERVAL_SECONDS.
+
+"""
+import asyncio
+import hashlib
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Set
+
+from fastapi import UploadFile
+from fastapi.responses import FileResponse, Response
+from sqlalchemy import delete, event, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.uploads import ArchivoGuardado, guardar_upload
+from app.database import engine
+from app.models.blob import Blob
+
+BLOB_PREFIX = "blob:"
+
+
+class BlobStorage(ABC):
+    """Interfaz de un almacén de contenidos por SHA-256."""
+
+    # Directorio local donde se reciben las subidas antes de pasarlas al almacén
+    staging_dir: str
+
+    @abstractmethod
+    async def put(self, sha256: str, ruta_temporal: str) -> None:
+        """
+        Guarda el contenido del fichero temporal (y lo elimina). Si ya existe, solo
+        elimina el temporal y renueva su fecha (ver sweep_blobs).
+        """
+
+    @abstractmethod
+    def exists(self, sha256: str) -> bool:
+        ...
+
+    @abstractmethod
+    def open(self, sha256: str) -> BinaryIO:
+        """Abre el contenido para leerlo (FileNotFoundError si no existe)."""
+
+    @abstractmethod
+    def delete(self, sha256: str) -> None:
+        """Borra el contenido (sin error si no existe)."""
+
+    @abstractmethod
+    def list_older_than(self, limite: float) -> Iterator[str]:
+        """SHA-256 de los contenidos guardados o renovados antes de limite (timestamp)."""
+
+    @abstractmethod
+    def delete_if_older_than(self, sha256: str, limite: float) -> bool:
+        """Borra el contenido si no se ha guardado ni renovado desde limite. Devuelve si lo ha borrado."""
+
+    @abstractmethod
+    def response(self, sha256: str, media_type: str, filename: Optional[str] = None,
+                 headers: Optional[Dict[str, str]] = None) -> Response:
+        """Respuesta HTTP que sirve el contenido."""
+
+
+class LocalBlobStorage(BlobStorage):
+    """Contenidos en disco: <raíz>/ab/cd/<sha256> (dos niveles para no llenar un directorio)."""
+
+    def __init__(self, raiz: str):
+        self.raiz = raiz
+        self.staging_dir = os.path.join(raiz, ".staging")
+
+    def _ruta(self, sha256: str) -> str:
+        return os.path.join(self.raiz, sha256[:2], sha256[2:4], sha256)
+
+    def _colocar(self, sha256: str, ruta_temporal: str) -> None:
+        ruta = self._ruta(sha256)
+        try:
+            # Ya existe: basta con renovar su fecha para que sweep_blobs no lo tome por huérfano
+            os.utime(ruta)
+            os.remove(ruta_temporal)
+            return
+        except FileNotFoundError:
+            pass
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        os.replace(ruta_temporal, ruta)
+
+    async def put(self, sha256: str, ruta_temporal: str) -> None:
+        await asyncio.to_thread(self._colocar, sha256, ruta_temporal)
+
+    def exists(self, sha256: str) -> bool:
+        return os.path.exists(self._ruta(sha256))
+
+    def open(self, sha256: str) -> BinaryIO:
+        return open(self._ruta(sha256), "rb")
+
+    def delete_if_older_than(self, sha256: str, limite: float) -> bool:
+        ruta = self._ruta(sha256)
+        try:
+            if os.stat(ruta).st_mtime >= limite:
+                return False
+            os.remove(ruta)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def list_older_than(self, limite: float) -> Iterator[str]:
+        for directorio, subdirectorios, ficheros in os.walk(self.raiz):
+            if directorio == self.raiz:
+                subdirectorios[:] = [d for d in subdirectorios if d != ".staging"]
+            for nombre in ficheros:
+                if len(nombre) != 64:
+                    continue
+                try:
+                    if os.stat(os.path.join(directorio, nombre)).st_mtime < limite:
+                        yield nombre
+                except FileNotFoundError:
+                    pass
+
+    def delete(self, sha256: str) -> None:
+        try:
+            os.remove(self._ruta(sha256))
+        except FileNotFoundError:
+            pass
+
+    def response(self, sha256: str, media_type: str, filename: Optional[str] = None,
+                 headers: Optional[Dict[str, str]] = None) -> Response:
+        return FileResponse(self._ruta(sha256), media_type=media_type, filename=filename, headers=headers)
+
+
+_storage: Optional[BlobStorage] = None
+_callbacks_borrado: List[Callable[[str], None]] = []
+_ultima_limpieza: Optional[float] = None
+# Tareas lanzadas sin esperar: el event loop solo guarda referencias débiles
+_tareas: Set[asyncio.Task] = set()
+
+
+def get_blob_storage() -> BlobStorage:
+    """Almacén configurado (BLOB_STORAGE_BACKEND), creado una vez por proceso."""
+    global _storage
+    if _storage is None:
+        if settings.BLOB_STORAGE_BACKEND == "local":
+            _storage = LocalBlobStorage(settings.BLOB_STORAGE_DIR)
+        else:
+            raise ValueError(f"BLOB_STORAGE_BACKEND no soportado: {settings.BLOB_STORAGE_BACKEND}")
+    return _storage
+
+
+def register_release_callback(callback: Callable[[str], None]) -> None:
+    """
+    Registra una función a la que se llama con la referencia (o ruta antigua) de un
+    archivo cuyo contenido se acaba de borrar, para limpiar lo que dependa de él
+    (por ejemplo, sus miniaturas).
+    """
+    _callbacks_borrado.append(callback)
+
+
+def _notificar_borrado(ruta: str) -> None:
+    for callback in _callbacks_borrado:
+        try:
+            callback(ruta)
+        except Exception as e:
+            print(f"⚠️  Error limpiando derivados de {ruta}: {e}")
+
+
+def is_blob_ref(ruta: Optional[str]) -> bool:
+    return bool(ruta) and ruta.startswith(BLOB_PREFIX)
+
+
+def _sha256_de(referencia: str) -> str:
+    return referencia[len(BLOB_PREFIX):len(BLOB_PREFIX) + 64]
+
+
+def _insert(db: Session):
+    return pg_insert if db.get_bind().dialect.name == "postgresql" else sqlite_insert
+
+
+def _sumar_referencia(db: Session, sha256: str, tamano: int) -> None:
+    insert = _insert(db)
+    sentencia = insert(Blob).values(sha256=sha256, tamano=tamano, referencias=1)
+    db.execute(sentencia.on_conflict_do_update(
+        index_elements=[Blob.sha256],
+        set_={"referencias": Blob.referencias + 1}
+    ))
+
+
+async def store_upload(
+    db: Session,
+    archivo: UploadFile,
+    extension: str,
+    max_bytes: int,
+    detalle_tamano: str,
+) -> ArchivoGuardado:
+    """
+    Guarda un archivo subido en el almacén. Devuelve su referencia "blob:<sha256><ext>"
+    (campo ruta, lo que se guarda en el registro), el tamaño y el hash.
+
+    Suma una referencia en la transacción de db: el commit del registro que la guarda
+    la confirma. Si se hace rollback, el contenido queda sin contar y sweep_blobs lo
+    borra pasado BLOB_ORPHAN_GRACE_SECONDS.
+    """
+    storage = get_blob_storage()
+    recibido = await guardar_upload(archivo, storage.staging_dir, uuid.uuid4().hex, max_bytes, detalle_tamano)
+    try:
+        _sumar_referencia(db, recibido.sha256, recibido.tamano)
+        await storage.put(recibido.sha256, recibido.ruta)
+    except BaseException:
+        if os.path.exists(recibido.ruta):
+            os.remove(recibido.ruta)
+        raise
+    _programar_limpieza()
+    referencia = f"{BLOB_PREFIX}{recibido.sha256}{(extension or '').lower()}"
+    return recibido._replace(ruta=referencia)
+
+
+def release_file(db: Session, ruta: Optional[str]) -> None:
+    """
+    Quita una referencia a un archivo (al borrar o sustituir el registro que la guarda).
+
+    Solo decrementa la cuenta en la transacción de db: si era la última, el contenido
+    se borra del almacén después del commit (_borrar_liberados). Las rutas antiguas
+    (archivo en disco propio) también se borran después del commit.
+    """
+    if not ruta:
+        return
+    if not is_blob_ref(ruta):
+        db.info.setdefault("archivos_liberados", []).append(ruta)
+        return
+    sha256 = _sha256_de(ruta)
+    restantes = db.execute(
+        update(Blob).where(Blob.sha256 == sha256).values(referencias=Blob.referencias - 1).returning(Blob.referencias)
+    ).scalar()
+    if restantes is not None and restantes <= 0:
+        db.info.setdefault("blobs_liberados", set()).add(sha256)
+
+
+def _borrar_si_sin_referencias(sha256: str) -> bool:
+    """
+    Borra la fila de un contenido sin referencias y, con la fila aún bloqueada, su
+    archivo: una subida simultánea del mismo contenido espera al bloqueo y lo vuelve
+    a colocar. Devuelve si lo ha borrado.
+    """
+    with engine.begin() as conexion:
+        borrado = conexion.execute(
+            delete(Blob).where(Blob.sha256 == sha256, Blob.referencias <= 0).returning(Blob.sha256)
+        ).first()
+        if borrado is None:
+            return False
+        get_blob_storage().delete(sha256)
+    _notificar_borrado(f"{BLOB_PREFIX}{sha256}")
+    return True
+
+
+@event.listens_for(Session, "after_commit")
+def _borrar_liberados(session):
+    """Tras el commit, borra el contenido cuya última referencia ha liberado la transacción."""
+    for sha256 in session.info.pop("blobs_liberados", ()):
+        try:
+            _borrar_si_sin_referencias(sha256)
+        except Exception as e:
+            # Queda con la cuenta a cero: lo recoge sweep_blobs
+            print(f"⚠️  Error borrando del almacén el contenido {sha256}: {e}")
+    for ruta in session.info.pop("archivos_liberados", ()):
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass  # Si no se puede eliminar, el registro ya no existe igualmente
+        _notificar_borrado(ruta)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _descartar_liberados(session, transaction):
+    """
+    Al terminar la transacción sin commit (rollback o close), las referencias siguen
+    vigentes: no se borra nada. Tras un commit, _borrar_liberados ya las ha procesado.
+    """
+    if transaction.parent is None:
+        session.info.pop("blobs_liberados", None)
+        session.info.pop("archivos_liberados", None)
+
+
+def sweep_blobs() -> int:
+    """
+    Borra del almacén el contenido que ya no usa ningún registro y devuelve cuántos:
+
+    - filas con la cuenta a cero cuyo borrado tras el commit no llegó a hacerse;
+    - contenido sin fila (subidas cuya transacción no se confirmó) sin usar desde
+      hace BLOB_ORPHAN_GRACE_SECONDS;
+    - temporales de subidas interrumpidas igual de antiguos.
+    """
+    storage = get_blob_storage()
+    borrados = 0
+    with engine.connect() as conexion:
+        a_cero = conexion.execute(select(Blob.sha256).where(Blob.referencias <= 0)).scalars().all()
+    for sha256 in a_cero:
+        borrados += _borrar_si_sin_referencias(sha256)
+
+    limite = time.time() - settings.BLOB_ORPHAN_GRACE_SECONDS
+    candidatos = list(storage.list_older_than(limite))
+    for inicio in range(0, len(candidatos), 500):
+        lote = candidatos[inicio:inicio + 500]
+        with engine.connect() as conexion:
+            contados = set(conexion.execute(select(Blob.sha256).where(Blob.sha256.in_(lote))).scalars())
+        for sha256 in lote:
+            # Se vuelve a comprobar la fecha: una subida en curso del mismo contenido la renueva
+            if sha256 not in contados and storage.delete_if_older_than(sha256, limite):
+                _notificar_borrado(f"{BLOB_PREFIX}{sha256}")
+                borrados += 1
+
+    try:
+        with os.scandir(storage.staging_dir) as entradas:
+            for entrada in entradas:
+                if entrada.is_file() and entrada.stat().st_mtime < limite:
+                    os.remove(entrada.path)
+    except OSError:
+        pass
+    return borrados
+
+
+def _limpiar() -> None:
+    try:
+        sweep_blobs()
+    except Exception as e:
+        print(f"⚠️  Error limpiando el almacén de archivos: {e}")
+
+
+def _programar_limpieza() -> None:
+    """Lanza sweep_blobs en un hilo si hace más de BLOB_SWEEP_INTERVAL_SECONDS de la última."""
+    global _ultima_limpieza
+    ahora = time.monotonic()
+    if _ultima_limpieza is not None and ahora - _ultima_limpieza < settings.BLOB_SWEEP_INTERVAL_SECONDS:
+        return
+    _ultima_limpieza = ahora
+    tarea = asyncio.get_running_loop().create_task(asyncio.to_thread(_limpiar))
+    _tareas.add(tarea)
+    tarea.add_done_callback(_tareas.discard)
+
+
+def file_exists(ruta: Optional[str]) -> bool:
+    if not ruta:
+        return False
+    if is_blob_ref(ruta):
+        return get_blob_storage().exists(_sha256_de(ruta))
+    return os.path.exists(ruta)
+
+
+def open_file(ruta: str) -> BinaryIO:
+    """Abre un archivo para leerlo a partir de su referencia (o de su ruta antigua en disco)."""
+    if is_blob_ref(ruta):
+        return get_blob_storage().open(_sha256_de(ruta))
+    return open(ruta, "rb")
+
+
+def file_key(ruta: str) -> str:
+    """
+    Identificador estable del contenido: el SHA-256 de una referencia, o el de la ruta
+    en los archivos antiguos (su nombre es único y no se reescriben).
+    """
+    if is_blob_ref(ruta):
+        return _sha256_de(ruta)
+    return hashlib.sha256(ruta.encode("utf-8")).hexdigest()
+
+
+def file_name(ruta: str) -> str:
+    """Nombre para Content-Disposition: el hash y la extensión, sin el prefijo."""
+    return ruta[len(BLOB_PREFIX):] if is_blob_ref(ruta) else os.path.basename(ruta)
+
+
+def file_response(ruta: str, media_type: str, filename: Optional[str] = None,
+                  headers: Optional[Dict[str, str]] = None) -> Response:
+    """Sirve un archivo a partir de su referencia (o de su ruta antigua en disco)."""
+    if is_blob_ref(ruta):
+        return get_blob_storage().response(_sha256_de(ruta), media_type, filename=filename, headers=headers)
+    return FileResponse(ruta, media_type=media_type, filename=filename, headers=headers)
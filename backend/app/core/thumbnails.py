@@ -0,0 +1,167 @@
+"""
+Miniaturas y previsualizaciones (derivados) de las fotos de entrega.
+
+Las fotos de paradas e incidencias de ruta llegan a pesar varios MB; el panel y la app
+solo necesitan una miniatura para listarlas o una versión mediana para verlas. Para
+cada foto se generan derivados WebP reducidos:
+
+- thumb: lado mayor THUMBNAIL_SIZE px.
+- medium: lado mayor THUMBNAIL_MEDIUM_SIZE px.
+
+Se generan en segundo plano al subir la foto (schedule_derivatives, tras el commit),
+en un pool de hilos local (Pillow libera el GIL al decodificar y redimensionar), y
+se guardan en disco: THUMBNAIL_DIR/<tamaño>/ab/<clave>.webp, donde la clave es el
+SHA-256 del contenido (app.core.storage.file_key). Al ir por contenido, una foto
+subida varias veces comparte derivados, y un derivado nunca queda desfasado.
+
+Si un derivado aún no existe cuando se pide (foto antigua o generación en curso),
+derivative_response lo genera en ese momento; una petición que llega mientras se
+genera espera al mismo trabajo en lugar de repetirlo. Si la imagen no se puede
+procesar, el endpoint sirve el original.
+
+Los derivados se borran cuando se borra el contenido del almacén
+(register_release_callback).
+"""
+import asyncio
+import os
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from fastapi.responses import FileResponse, Response
+from PIL import Image, ImageOps
+
+from app.core.config import settings
+from app.core.storage import file_exists, file_key, file_name, open_file, register_release_callback
+
+TAMANO_ORIGINAL = "original"
+TAMANOS = {
+    "thumb": settings.THUMBNAIL_SIZE,
+    "medium": settings.THUMBNAIL_MEDIUM_SIZE,
+}
+
+_pool: Optional[ThreadPoolExecutor] = None
+_en_curso: Dict[Tuple[str, str], Future] = {}
+_en_curso_lock = threading.Lock()
+
+
+def get_thumbnail_pool() -> ThreadPoolExecutor:
+    """Obtiene el pool de hilos que genera derivados, creándolo si es necesario."""
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(
+            max_workers=settings.THUMBNAIL_WORKERS,
+            thread_name_prefix="miniaturas",
+        )
+    return _pool
+
+
+def shutdown_thumbnail_pool() -> None:
+    """Detiene el pool de hilos (se llama al apagar la aplicación)."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _ruta_derivado(clave: str, tamano: str) -> str:
+    return os.path.join(settings.THUMBNAIL_DIR, tamano, clave[:2], f"{clave}.webp")
+
+
+def _generar(ruta: str, clave: str, tamano: str) -> str:
+    """Genera (si no existe) el derivado de un tamaño y devuelve su ruta en disco."""
+    destino = _ruta_derivado(clave, tamano)
+    if os.path.exists(destino):
+        return destino
+    lado = TAMANOS[tamano]
+    with open_file(ruta) as fichero, Image.open(fichero) as imagen:
+        # En JPEG decodifica directamente a una escala reducida (mucho menos CPU y memoria)
+        imagen.draft("RGB", (lado, lado))
+        reducida = ImageOps.exif_transpose(imagen)
+        if reducida.mode not in ("RGB", "RGBA"):
+            con_alfa = "A" in reducida.getbands() or "transparency" in reducida.info
+            reducida = reducida.convert("RGBA" if con_alfa else "RGB")
+        reducida.thumbnail((lado, lado), Image.Resampling.LANCZOS)
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        ruta_temporal = f"{destino}.{uuid.uuid4().hex}.part"
+        try:
+            reducida.save(ruta_temporal, "WEBP", quality=settings.THUMBNAIL_QUALITY, method=4)
+            os.replace(ruta_temporal, destino)
+        except BaseException:
+            if os.path.exists(ruta_temporal):
+                os.remove(ruta_temporal)
+            raise
+    # Si el original se borró mientras se generaba, el derivado no debe quedar huérfano
+    if not file_exists(ruta):
+        _borrar_derivados(ruta)
+        raise FileNotFoundError(f"El archivo original ya no existe: {ruta}")
+    return destino
+
+
+def _encolar(ruta: str, tamano: str) -> Future:
+    """Encola la generación de un derivado, o devuelve el trabajo que ya lo está generando."""
+    clave = file_key(ruta)
+    trabajo = (clave, tamano)
+    with _en_curso_lock:
+        futuro = _en_curso.get(trabajo)
+        if futuro is not None:
+            return futuro
+        futuro = get_thumbnail_pool().submit(_generar, ruta, clave, tamano)
+        _en_curso[trabajo] = futuro
+
+    def _terminar(f: Future) -> None:
+        with _en_curso_lock:
+            if _en_curso.get(trabajo) is f:
+                del _en_curso[trabajo]
+
+    futuro.add_done_callback(_terminar)
+    return futuro
+
+
+def _avisar_error(ruta: str, tamano: str):
+    def _callback(f: Future) -> None:
+        if not f.cancelled() and f.exception() is not None:
+            print(f"⚠️  No se pudo generar la miniatura {tamano} de {ruta}: {f.exception()}")
+    return _callback
+
+
+def schedule_derivatives(ruta: Optional[str]) -> None:
+    """Encola en segundo plano la generación de todos los derivados de una foto recién guardada."""
+    if not ruta:
+        return
+    for tamano in TAMANOS:
+        _encolar(ruta, tamano).add_done_callback(_avisar_error(ruta, tamano))
+
+
+async def derivative_response(ruta: str, tamano: str) -> Optional[Response]:
+    """
+    Respuesta con el derivado WebP de una foto, generándolo si aún no existe.
+    Devuelve None si la imagen no se puede procesar (el endpoint sirve el original).
+    """
+    destino = _ruta_derivado(file_key(ruta), tamano)
+    if not await asyncio.to_thread(os.path.exists, destino):
+        try:
+            destino = await asyncio.wrap_future(_encolar(ruta, tamano))
+        except Exception as e:
+            print(f"⚠️  No se pudo generar la miniatura {tamano} de {ruta}: {e}")
+            return None
+    nombre = f"{os.path.splitext(file_name(ruta))[0]}_{tamano}.webp"
+    return FileResponse(
+        destino,
+        media_type="image/webp",
+        headers={"Content-Disposition": f"inline; filename={nombre}"}
+    )
+
+
+def _borrar_derivados(ruta: str) -> None:
+    """Borra los derivados de un contenido eliminado del almacén."""
+    clave = file_key(ruta)
+    for tamano in TAMANOS:
+        try:
+            os.remove(_ruta_derivado(clave, tamano))
+        except FileNotFoundError:
+            pass
+
+
+register_release_callback(_borrar_derivados)
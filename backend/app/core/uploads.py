@@ -0,0 +1,79 @@
+"""
+Guardado de archivos subidos (UploadFile) sin cargarlos enteros en memoria.
+
+guardar_upload lee el archivo por fragmentos de UPLOAD_CHUNK_SIZE y los escribe en un
+fichero temporal del directorio de destino. La escritura (y el hash SHA-256, que
+suelta el GIL) se hace en un hilo (asyncio.to_thread) para no bloquear el event loop.
+El límite de tamaño se comprueba mientras se lee: un archivo demasiado grande se
+rechaza en cuanto lo supera, sin escribirlo entero. Al terminar, el temporal se
+renombra (os.replace, atómico en el mismo sistema de ficheros) a su nombre final:
+nunca se sirve un archivo a medio escribir.
+"""
+import asyncio
+import hashlib
+import os
+import uuid
+from typing import NamedTuple
+
+from fastapi import HTTPException, UploadFile, status
+
+from app.core.config import settings
+
+
+class ArchivoGuardado(NamedTuple):
+    ruta: str  # ruta completa del archivo guardado
+    tamano: int  # bytes
+    sha256: str  # hash del contenido (hex)
+
+
+def _escribir_fragmento(fichero, resumen, fragmento: bytes) -> None:
+    resumen.update(fragmento)
+    fichero.write(fragmento)
+
+
+def _descartar(fichero, ruta_temporal: str) -> None:
+    fichero.close()
+    try:
+        os.remove(ruta_temporal)
+    except FileNotFoundError:
+        pass
+
+
+async def guardar_upload(
+    archivo: UploadFile,
+    directorio: str,
+    nombre: str,
+    max_bytes: int,
+    detalle_tamano: str,
+) -> ArchivoGuardado:
+    """
+    Guarda archivo en directorio/nombre por fragmentos y devuelve ruta, tamaño y hash.
+
+    Si supera max_bytes responde 400 con detalle_tamano y no deja nada en disco.
+    """
+    excedido = HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detalle_tamano)
+    # Starlette ya conoce el tamaño si el multipart lo ha volcado a disco
+    if archivo.size is not None and archivo.size > max_bytes:
+        raise excedido
+
+    await asyncio.to_thread(os.makedirs, directorio, exist_ok=True)
+    ruta = os.path.join(directorio, nombre)
+    ruta_temporal = os.path.join(directorio, f".{nombre}.{uuid.uuid4().hex}.part")
+    fichero = await asyncio.to_thread(open, ruta_temporal, "wb")
+    resumen = hashlib.sha256()
+    tamano = 0
+    try:
+        while True:
+            fragmento = await archivo.read(settings.UPLOAD_CHUNK_SIZE)
+            if not fragmento:
+                break
+            tamano += len(fragmento)
+            if tamano > max_bytes:
+                raise excedido
+            await asyncio.to_thread(_escribir_fragmento, fichero, resumen, fragmento)
+        await asyncio.to_thread(fichero.close)
+        await asyncio.to_thread(os.replace, ruta_temporal, ruta)
+    except BaseException:
+        await asyncio.to_thread(_descartar, fichero, ruta_temporal)
+        raise
+    return ArchivoGuardado(ruta=ruta, tamano=tamano, sha256=resumen.hexdigest())
@@ -0,0 +1,211 @@
+"""
+Caché del usuario autenticado para get_current_user.
+
+Cada petición autenticada consultaba la tabla usuarios por el email del token. Aquí
+se guarda solo lo necesario para autorizar (id, nombre, email, rol, activo), indexado
+por el subject del token (email), en dos niveles:
+
+- L1: LRU en memoria del proceso con TTL corto (USER_CACHE_LOCAL_TTL_SECONDS).
+- L2: Redis "auth:usuario:<email>" (USER_CACHE_TTL_SECONDS), compartido entre workers.
+
+Un acierto en cualquiera de los dos niveles no hace ninguna consulta a la base de
+datos. Los endpoints que cambian el rol, el email o el estado de un usuario, o lo
+eliminan, llaman a invalidar_usuario_cache(email): se borra la entrada de Redis y la
+invalidación se publica por el canal de app.core.cache, de modo que todos los workers
+descartan su copia local al momento (o como mucho al caducar el L1 si el oyente de
+invalidaciones no está conectado). Solo se guardan usuarios activos.
+
+Para que una petición que leyó el usuario de la base de datos antes de una
+invalidación no vuelva a guardar la copia antigua, invalidar_usuario_cache incrementa
+además una versión por email ("auth:usuario_version:<email>"). get_current_user lee
+la versión (leer_version_usuario) antes de consultar la base de datos, y
+guardar_usuario_cache solo escribe si sigue siendo la misma (comparación y escritura
+atómicas en un script Lua). En la L1 se hace lo mismo con un contador de
+invalidaciones del worker.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Optional, Tuple
+
+import redis
+
+from app.core.cache import (
+    publish_cache_invalidation_async, register_local_invalidation_callback, run_redis_command_async
+)
+from app.core.config import settings
+
+
+@dataclass(frozen=True)
+class UsuarioActual:
+    """Usuario autenticado tal como lo reciben los endpoints (current_user)."""
+    id: int
+    nombre: str
+    email: str
+    rol: str
+    activo: bool
+
+    @classmethod
+    def desde_modelo(cls, usuario) -> "UsuarioActual":
+        return cls(
+            id=usuario.id,
+            nombre=usuario.nombre,
+            email=usuario.email,
+            rol=usuario.rol,
+            activo=bool(usuario.activo),
+        )
+
+
+_local: "OrderedDict[str, Tuple[float, UsuarioActual]]" = OrderedDict()
+_lock = threading.Lock()
+# Se incrementa con cada invalidación recibida en este worker (ver guardar_usuario_cache)
+_secuencia_invalidaciones = 0
+
+
+_PREFIJO_KEY = "auth:usuario:"
+_PREFIJO_VERSION = "auth:usuario_version:"
+
+# Escribe la entrada solo si la versión del usuario no ha cambiado desde que se leyó
+_SCRIPT_GUARDAR = """
+if (redis.call('get', KEYS[1]) or '') == ARGV[1] then
+    redis.call('setex', KEYS[2], ARGV[2], ARGV[3])
+    return 1
+end
+return 0
+"""
+
+
+@dataclass(frozen=True)
+class VersionUsuario:
+    """Versión de la caché de un usuario leída antes de consultarlo en la base de datos."""
+    secuencia_local: int
+    redis: str
+
+
+def _key_usuario(email: str) -> str:
+    return f"{_PREFIJO_KEY}{email}"
+
+
+def _key_version(email: str) -> str:
+    return f"{_PREFIJO_VERSION}{email}"
+
+
+def _leer_local(email: str) -> Optional[UsuarioActual]:
+    with _lock:
+        entrada = _local.get(email)
+        if entrada is None:
+            return None
+        caduca, usuario = entrada
+        if caduca < time.monotonic():
+            del _local[email]
+            return None
+        _local.move_to_end(email)
+        return usuario
+
+
+def _guardar_local(usuario: UsuarioActual, secuencia: int) -> None:
+    with _lock:
+        if secuencia != _secuencia_invalidaciones:
+            return
+        _local[usuario.email] = (time.monotonic() + settings.USER_CACHE_LOCAL_TTL_SECONDS, usuario)
+        _local.move_to_end(usuario.email)
+        while len(_local) > settings.USER_CACHE_MAX_ENTRIES:
+            _local.popitem(last=False)
+
+
+def _descartar_local(key: str) -> None:
+    """Callback de invalidación: descarta la copia local si la clave es de un usuario."""
+    global _secuencia_invalidaciones
+    if key.startswith(_PREFIJO_KEY):
+        with _lock:
+            _secuencia_invalidaciones += 1
+            _local.pop(key[len(_PREFIJO_KEY):], None)
+
+
+register_local_invalidation_callback(_descartar_local)
+
+
+async def obtener_usuario_cache(email: str) -> Optional[UsuarioActual]:
+    """Devuelve el usuario cacheado para el subject del token, o None si no está."""
+    usuario = _leer_local(email)
+    if usuario is not None:
+        return usuario
+
+    with _lock:
+        secuencia = _secuencia_invalidaciones
+    try:
+        valor = await run_redis_command_async("get", _key_usuario(email))
+        if not valor:
+            return None
+        usuario = UsuarioActual(**json.loads(valor))
+    except (redis.RedisError, json.JSONDecodeError, TypeError) as e:
+        print(f"⚠️  Error al leer usuario de caché ({email}): {e}")
+        return None
+
+    _guardar_local(usuario, secuencia)
+    return usuario
+
+
+async def leer_version_usuario(email: str) -> VersionUsuario:
+    """
+    Versión actual de la caché del usuario. Leerla antes de consultar el usuario en
+    la base de datos y pasarla a guardar_usuario_cache.
+    """
+    with _lock:
+        secuencia = _secuencia_invalidaciones
+    try:
+        version = await run_redis_command_async("get", _key_version(email))
+    except redis.RedisError as e:
+        print(f"⚠️  Error al leer versión de usuario en caché ({email}): {e}")
+        version = None
+    return VersionUsuario(secuencia_local=secuencia, redis=version or "")
+
+
+async def guardar_usuario_cache(usuario: UsuarioActual, version: VersionUsuario) -> None:
+    """
+    Guarda el usuario en L1 y en Redis (solo usuarios activos), salvo que se haya
+    invalidado después de leer `version`: en ese caso lo leído puede estar desfasado.
+    """
+    if not usuario.activo:
+        return
+
+    try:
+        guardado = await run_redis_command_async(
+            "eval", _SCRIPT_GUARDAR, 2, _key_version(usuario.email), _key_usuario(usuario.email),
+            version.redis, settings.USER_CACHE_TTL_SECONDS, json.dumps(asdict(usuario))
+        )
+    except redis.RedisError as e:
+        print(f"⚠️  Error al escribir usuario en caché ({usuario.email}): {e}")
+        guardado = None
+    # 0: invalidado en Redis entre la lectura y la escritura; None: Redis no disponible
+    if guardado != 0:
+        _guardar_local(usuario, version.secuencia_local)
+
+
+async def invalidar_usuario_cache(*emails: Optional[str]) -> None:
+    """
+    Elimina de la caché los usuarios con esos emails (subject del token).
+    Llamar (await) tras cambiar rol, email o estado activo de un usuario, o al eliminarlo.
+    """
+    global _secuencia_invalidaciones
+    emails = [email for email in emails if email]
+    if not emails:
+        return
+    with _lock:
+        _secuencia_invalidaciones += 1
+        for email in emails:
+            _local.pop(email, None)
+
+    keys = [_key_usuario(email) for email in emails]
+    try:
+        # Primero la versión: una petición que ya leyó el usuario de la BD no lo reescribe.
+        # Sin caducidad: si la versión desapareciera, una lectura anterior volvería a coincidir
+        for email in emails:
+            await run_redis_command_async("incr", _key_version(email))
+        await run_redis_command_async("delete", *keys)
+    except redis.RedisError as e:
+        print(f"⚠️  Error al invalidar usuario en caché ({', '.join(emails)}): {e}")
+    # Aviso al resto de workers para que descarten su copia local
+    await publish_cache_invalidation_async(keys)
@@ -1,4 +1,5 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -21,6 +22,39 @@ engine = create_engine(
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+
+def _url_async(url: str) -> str:
+    """Traduce la URL síncrona al driver asíncrono equivalente (asyncpg / aiosqlite)."""
+    for prefijo, prefijo_async in (
+        ("postgresql+psycopg2://", "postgresql+asyncpg://"),
+        ("postgresql://", "postgresql+asyncpg://"),
+        ("sqlite://", "sqlite+aiosqlite://"),
+    ):
+        if url.startswith(prefijo):
+            return prefijo_async + url[len(prefijo):]
+    return url
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", _url_async(DATABASE_URL))
+
+# Motor asíncrono (asyncpg) para los endpoints de lectura más usados: las consultas
+# ceden el event loop mientras esperan a PostgreSQL en lugar de bloquearlo.
+# Pool más pequeño que el síncrono: cada conexión atiende muchas peticiones seguidas
+# y ambos pools comparten el max_connections de PostgreSQL.
+# (con SQLite, solo para scripts locales, aiosqlite usa NullPool y no admite tamaño de pool)
+_async_pool = {} if ASYNC_DATABASE_URL.startswith("sqlite") else {"pool_size": 10, "max_overflow": 10}
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    pool_pre_ping=True,
+    pool_recycle=3600,
+    echo=False,
+    **_async_pool
+)
+
+# expire_on_commit=False: los objetos siguen legibles tras el commit sin recargas
+# implícitas (que en AsyncSession no están permitidas)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 def get_db():
@@ -30,3 +64,18 @@ def get_db():
     finally:
         db.close()
 
+
+async def get_async_db():
+    """Sesión asíncrona para endpoints migrados a SQLAlchemy asyncio."""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def run_sync_in_session(fn, *args):
+    """
+    Ejecuta fn(session, *args) con run_sync en una AsyncSession propia.
+    Para cálculos que pueden terminar después de la petición (refresco de la caché en
+    segundo plano), que no deben usar la sesión de la petición.
+    """
+    async with AsyncSessionLocal() as db:
+        return await db.run_sync(fn, *args)
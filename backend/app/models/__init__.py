@@ -12,8 +12,10 @@ from app.models.conductor import Conductor
 from app.models.pedido import Pedido
 from app.models.ruta import Ruta, RutaParada
 from app.models.incidencia_ruta import IncidenciaRuta, IncidenciaRutaFoto
+from app.models.ruta_eliminacion import RutaEliminacion
 from app.models.mantenimiento import Mantenimiento
 from app.models.historial_incidencia import HistorialIncidencia
+from app.models.blob import Blob
 
 __all__ = [
     "Usuario",
@@ -32,7 +34,9 @@ __all__ = [
     "RutaParada",
     "IncidenciaRuta",
     "IncidenciaRutaFoto",
+    "RutaEliminacion",
     "Mantenimiento",
     "HistorialIncidencia",
+    "Blob",
 ]
 
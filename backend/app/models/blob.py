@@ -0,0 +1,20 @@
+from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy.sql import func
+from app.database import Base
+
+class Blob(Base):
+    """
+    Contenido de un archivo subido, guardado una sola vez aunque se adjunte muchas
+    veces (documentos, fotos y firmas de paradas, fotos de incidencias de ruta).
+
+    La clave es el SHA-256 del contenido; los registros que lo usan guardan la
+    referencia "blob:<sha256><extensión>" (app.core.storage). referencias cuenta
+    cuántos registros apuntan al contenido: el archivo se borra del almacén cuando
+    llega a cero.
+    """
+    __tablename__ = "blobs"
+
+    sha256 = Column(String(64), primary_key=True)  # hash del contenido (hex)
+    tamano = Column(Integer, nullable=False)  # Tamaño en bytes
+    referencias = Column(Integer, nullable=False, default=0)  # registros que usan el contenido
+    creado_en = Column(DateTime(timezone=True), server_default=func.now())
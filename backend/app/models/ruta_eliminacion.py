@@ -0,0 +1,74 @@
+from sqlalchemy import Column, Integer, String, DateTime, event, delete, inspect
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import func
+from datetime import datetime, timedelta, timezone
+from app.database import Base
+from app.core.config import settings
+from app.models.ruta import Ruta, RutaParada
+from app.models.incidencia_ruta import IncidenciaRuta
+
+class RutaEliminacion(Base):
+    """
+    Marca de borrado (tombstone) para la sincronización incremental de la app móvil
+    (GET /rutas/mis-rutas/cambios): registra las rutas, paradas e incidencias de ruta
+    que un conductor ya no debe tener, porque se borraron o porque la ruta pasó a
+    otro conductor.
+
+    - tipo "ruta": conductor_id es el conductor que tenía la ruta.
+    - tipo "parada" / "incidencia": ruta_id es la ruta a la que pertenecían (el
+      conductor es el de la ruta).
+
+    Se guardan SYNC_TOMBSTONE_RETENTION_DAYS días; un cursor más antiguo obliga a
+    una sincronización completa.
+    """
+    __tablename__ = "rutas_eliminaciones"
+
+    id = Column(Integer, primary_key=True, index=True)
+    tipo = Column(String(20), nullable=False)  # ruta, parada o incidencia
+    registro_id = Column(Integer, nullable=False)  # id de la ruta, parada o incidencia
+    ruta_id = Column(Integer, nullable=True, index=True)  # sin FK: la ruta puede haberse borrado
+    conductor_id = Column(Integer, nullable=True, index=True)  # solo en tipo "ruta"
+    eliminado_en = Column(DateTime(timezone=True), server_default=func.now(), nullable=False, index=True)
+
+
+def _conductor_anterior(ruta: Ruta):
+    """conductor_id que tenía la ruta antes de este flush (o None si no ha cambiado)."""
+    historial = inspect(ruta).attrs.conductor_id.history
+    if historial.deleted and historial.deleted[0] is not None:
+        return historial.deleted[0]
+    return None
+
+
+@event.listens_for(Session, "before_flush")
+def _registrar_eliminaciones(session, flush_context, instances):
+    """Añade las marcas de borrado de lo que este flush elimina o cambia de conductor."""
+    marcas = []
+    rutas_borradas = set()
+    for obj in session.deleted:
+        if isinstance(obj, Ruta):
+            rutas_borradas.add(obj.id)
+            conductor_id = _conductor_anterior(obj) or obj.conductor_id
+            if conductor_id is not None:
+                marcas.append(RutaEliminacion(tipo="ruta", registro_id=obj.id, ruta_id=obj.id, conductor_id=conductor_id))
+    for obj in session.dirty:
+        if isinstance(obj, Ruta) and obj.id not in rutas_borradas:
+            conductor_id = _conductor_anterior(obj)
+            if conductor_id is not None and conductor_id != obj.conductor_id:
+                marcas.append(RutaEliminacion(tipo="ruta", registro_id=obj.id, ruta_id=obj.id, conductor_id=conductor_id))
+    for obj in session.deleted:
+        # Las paradas e incidencias de una ruta borrada ya quedan cubiertas por su marca
+        if isinstance(obj, RutaParada) and obj.ruta_id not in rutas_borradas:
+            marcas.append(RutaEliminacion(tipo="parada", registro_id=obj.id, ruta_id=obj.ruta_id))
+        elif isinstance(obj, IncidenciaRuta) and obj.ruta_id not in rutas_borradas:
+            marcas.append(RutaEliminacion(tipo="incidencia", registro_id=obj.id, ruta_id=obj.ruta_id))
+    if marcas:
+        session.add_all(marcas)
+        session.info["rutas_eliminaciones"] = True
+
+
+@event.listens_for(Session, "after_flush_postexec")
+def _purgar_eliminaciones(session, flush_context):
+    """Tras registrar marcas nuevas, borra las que superan el periodo de retención."""
+    if session.info.pop("rutas_eliminaciones", False):
+        limite = datetime.now(timezone.utc) - timedelta(days=settings.SYNC_TOMBSTONE_RETENTION_DAYS)
+        session.execute(delete(RutaEliminacion).where(RutaEliminacion.eliminado_en < limite))
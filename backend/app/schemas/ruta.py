@@ -103,3 +103,38 @@ class RutaResponse(BaseModel):
     class Config:
         from_attributes = True
 
+
+class VehiculoDisponible(BaseModel):
+    id: int
+    nombre: str
+    matricula: str
+    capacidad: Optional[float] = None
+
+class ConductorDisponible(BaseModel):
+    id: int
+    nombre: str
+    apellidos: Optional[str] = None
+    licencia: str
+    fecha_caducidad_licencia: date
+
+class DisponibilidadResponse(BaseModel):
+    """Vehículos y conductores libres en [desde, hasta] (GET /rutas/disponibilidad)"""
+    desde: datetime
+    hasta: datetime
+    vehiculos: List[VehiculoDisponible] = []
+    conductores: List[ConductorDisponible] = []
+
+class EliminacionesRutas(BaseModel):
+    """ids que el cliente debe borrar de su copia local"""
+    rutas: List[int] = []
+    paradas: List[int] = []
+    incidencias: List[int] = []
+
+class CambiosRutasResponse(BaseModel):
+    """Cambios en las rutas del conductor desde un cursor (GET /rutas/mis-rutas/cambios)"""
+    cursor: str  # enviar como ?desde= en la siguiente sincronización
+    completo: bool  # True: rutas es la lista completa y sustituye a la copia local
+    rutas: List[RutaResponse] = []  # rutas nuevas o modificadas, completas
+    paradas: List[RutaParadaResponse] = []  # paradas modificadas de rutas que no están en rutas
+    incidencias: List[IncidenciaRutaResponse] = []  # incidencias nuevas de rutas que no están en rutas
+    eliminadas: EliminacionesRutas = EliminacionesRutas()  # aplicar antes que rutas/paradas/incidencias
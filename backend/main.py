@@ -6,8 +6,14 @@ from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
 from sqlalchemy import text
 from app.core.config import settings
-from app.api import auth, incidencias, vehiculos, comunidades, conductores, pedidos, rutas, mantenimientos, inmuebles, propietarios, proveedores, actuaciones, documentos, mensajes, usuarios, informes, historial
-from app.database import engine, Base
+from app.api import auth, incidencias, vehiculos, comunidades, conductores, pedidos, rutas, mantenimientos, inmuebles, propietarios, proveedores, actuaciones, documentos, mensajes, usuarios, informes, historial, exportaciones
+from app.database import engine, async_engine, Base
+from app.core.export_jobs import shutdown_export_pool
+from app.core.thumbnails import shutdown_thumbnail_pool
+from app.core.compression import CompressionMiddleware
+from app.core.cache import (
+    init_async_redis, close_async_redis, start_cache_invalidation_listener, stop_cache_invalidation_listener
+)
 import app.models  # noqa: F401  (asegura que se registren todos los modelos)
 
 
@@ -18,7 +24,15 @@ async def lifespan(app: FastAPI):
         Base.metadata.create_all(bind=engine)
     except Exception:
         pass
+    # Pool redis.asyncio de este worker y caché local (L1), coherente con el resto vía pub/sub
+    await init_async_redis()
+    start_cache_invalidation_listener()
     yield
+    stop_cache_invalidation_listener()
+    await close_async_redis()
+    shutdown_export_pool()
+    shutdown_thumbnail_pool()
+    await async_engine.dispose()
 
 
 app = FastAPI(
@@ -110,7 +124,10 @@ app.add_middleware(
     allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
+# Compresión gzip/brotli de respuestas de texto a partir de COMPRESSION_MIN_BYTES
+app.add_middleware(CompressionMiddleware)
 
 # Incluir routers
 app.include_router(auth.router, prefix="/api")
@@ -130,6 +147,7 @@ app.include_router(mensajes.router, prefix="/api")
 app.include_router(usuarios.router, prefix="/api")
 app.include_router(informes.router, prefix="/api")
 app.include_router(historial.router, prefix="/api")
+app.include_router(exportaciones.router, prefix="/api")
 
 @app.get("/")
 async def root():
@@ -144,7 +162,7 @@ async def ping():
 async def health_check():
     """Health check endpoint que verifica el estado del sistema"""
     from app.database import SessionLocal
-    from app.core.cache import get_redis_client
+    from app.core.cache import get_redis_client, get_cache_stats
     import redis
     
     health_status = {
@@ -194,6 +212,9 @@ async def health_check():
             "message": error_msg
         }
     
+    # Aciertos/fallos de caché por nivel (L1 en memoria y Redis) de este worker
+    health_status["cache"] = get_cache_stats()
+    
     # Siempre devolver 200 para que el healthcheck de Docker funcione
     # El estado real se indica en el JSON
     status_code = 200 if health_status["status"] == "healthy" else (503 if health_status["status"] == "unhealthy" else 200)
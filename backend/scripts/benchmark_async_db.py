@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Benchmark: throughput de un worker con sesión síncrona frente a AsyncSession (asyncpg).
+
+Simula, dentro de un único event loop (lo mismo que un worker de uvicorn), N
+peticiones concurrentes a un handler `async def` que lista pedidos:
+
+- sync:  el patrón anterior, SessionLocal (psycopg2) llamado desde el handler.
+         Cada consulta bloquea el event loop, así que las peticiones se atienden
+         de una en una mientras se espera a PostgreSQL.
+- async: AsyncSessionLocal (asyncpg). Mientras una consulta espera, el event loop
+         atiende a las demás.
+
+--latencia-ms añade un pg_sleep a cada petición para simular la latencia de red
+entre el backend y la base de datos (en Docker suele ser de 1-5 ms; con la base
+de datos en otra máquina, bastante más). Con SQLite (requiere aiosqlite) se
+registra en cada conexión una función pg_sleep equivalente, que espera en el hilo
+de la conexión igual que el servidor; sirve para probar el script sin PostgreSQL,
+pero las cifras representativas son las de PostgreSQL.
+
+Uso (desde backend/, con PostgreSQL accesible en DATABASE_URL):
+    python scripts/benchmark_async_db.py --peticiones 500 --concurrencia 20 --latencia-ms 5
+    docker-compose exec backend python scripts/benchmark_async_db.py
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import event, select, text
+
+from app.database import SessionLocal, AsyncSessionLocal, async_engine, engine
+import app.models  # noqa: F401  (registra todos los modelos)
+from app.models.pedido import Pedido
+
+
+def _registrar_pg_sleep(conexion, _registro) -> None:
+    """pg_sleep para SQLite: la espera ocurre en el hilo que ejecuta la consulta."""
+    conexion.create_function("pg_sleep", 1, time.sleep)
+
+
+def crear_peticiones(latencia_ms: int, limite: int):
+    """Devuelve las dos versiones (sync y async) del mismo handler de listado."""
+    listado = select(Pedido).order_by(Pedido.creado_en.desc()).limit(limite)
+    latencia = None
+    if latencia_ms:
+        if engine.dialect.name == "sqlite":
+            for motor in (engine, async_engine.sync_engine):
+                event.listen(motor, "connect", _registrar_pg_sleep)
+        latencia = text("SELECT pg_sleep(:segundos)").bindparams(segundos=latencia_ms / 1000.0)
+
+    async def peticion_sync():
+        db = SessionLocal()
+        try:
+            if latencia is not None:
+                db.execute(latencia)
+            db.execute(listado).scalars().all()
+        finally:
+            db.close()
+
+    async def peticion_async():
+        async with AsyncSessionLocal() as db:
+            if latencia is not None:
+                await db.execute(latencia)
+            (await db.execute(listado)).scalars().all()
+
+    return peticion_sync, peticion_async
+
+
+async def medir(peticion, total: int, concurrencia: int) -> dict:
+    """Lanza total peticiones con como mucho concurrencia en vuelo y mide el resultado."""
+    semaforo = asyncio.Semaphore(concurrencia)
+    tiempos = []
+
+    async def una():
+        async with semaforo:
+            inicio = time.perf_counter()
+            await peticion()
+            tiempos.append(time.perf_counter() - inicio)
+
+    # Calentar el pool de conexiones antes de medir
+    await asyncio.gather(*(peticion() for _ in range(concurrencia)))
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(una() for _ in range(total)))
+    duracion = time.perf_counter() - inicio
+
+    tiempos.sort()
+    return {
+        "req_s": total / duracion,
+        "p50_ms": statistics.median(tiempos) * 1000,
+        "p95_ms": tiempos[int(len(tiempos) * 0.95) - 1] * 1000,
+    }
+
+
+async def main_async(args) -> None:
+    peticion_sync, peticion_async = crear_peticiones(args.latencia_ms, args.limite)
+    print(
+        f"Base de datos: {engine.dialect.name} | peticiones: {args.peticiones} | "
+        f"concurrencia: {args.concurrencia} | latencia simulada: {args.latencia_ms} ms"
+    )
+    resultados = {}
+    for nombre, peticion in (("sync", peticion_sync), ("async", peticion_async)):
+        resultados[nombre] = await medir(peticion, args.peticiones, args.concurrencia)
+        r = resultados[nombre]
+        print(f"  {nombre:<6} {r['req_s']:8.1f} req/s   p50 {r['p50_ms']:7.1f} ms   p95 {r['p95_ms']:7.1f} ms")
+    print(f"Mejora de throughput por worker: x{resultados['async']['req_s'] / resultados['sync']['req_s']:.2f}")
+    await async_engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Throughput por worker: SessionLocal vs AsyncSession")
+    parser.add_argument("--peticiones", type=int, default=500, help="Peticiones totales por modo")
+    parser.add_argument("--concurrencia", type=int, default=20, help="Peticiones simultáneas en vuelo")
+    parser.add_argument("--latencia-ms", type=int, default=5, help="pg_sleep añadido a cada petición")
+    parser.add_argument("--limite", type=int, default=100, help="Pedidos por listado")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
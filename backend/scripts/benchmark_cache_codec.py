@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Benchmark: formato de los valores de la caché (tamaño, codificación y decodificación).
+
+Construye un listado de rutas con la forma de RutaResponse (paradas con su pedido,
+conductor, vehículo e incidencias), que es la entrada más grande que se guarda en
+Redis (clave "rutas:list"), y compara:
+
+- json:       json.dumps(default=str), el formato anterior a encode_cache_value
+- orjson:     orjson sin comprimir
+- orjson+zstd: encode_cache_value con la configuración por defecto (orjson + zstd
+               por encima de CACHE_COMPRESSION_MIN_BYTES)
+
+No necesita Redis ni base de datos.
+
+Uso (desde backend/):
+    python scripts/benchmark_cache_codec.py --rutas 100 --paradas 12 --repeticiones 200
+    docker-compose exec backend python scripts/benchmark_cache_codec.py
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from app.core import cache
+from app.schemas.ruta import RutaResponse
+
+
+def crear_rutas(num_rutas: int, num_paradas: int) -> list:
+    """Listado de rutas tal como lo cachea GET /rutas/ (RutaResponse.model_dump())."""
+    base = datetime(2024, 5, 6, 8, 0)
+    rutas = []
+    for r in range(1, num_rutas + 1):
+        inicio = base + timedelta(days=r % 30)
+        paradas = []
+        for p in range(1, num_paradas + 1):
+            pedido_id = r * 100 + p
+            paradas.append({
+                "id": pedido_id,
+                "ruta_id": r,
+                "pedido_id": pedido_id,
+                "orden": p,
+                "direccion": f"Calle Mayor {p * 7}, {28000 + p} Madrid",
+                "tipo_operacion": "ENTREGA" if p % 2 else "RECOGIDA",
+                "ventana_horaria": "09:00-11:00",
+                "fecha_hora_llegada": (inicio + timedelta(minutes=25 * p)).isoformat(),
+                "fecha_hora_completada": None,
+                "estado": "PENDIENTE",
+                "ruta_foto": None,
+                "ruta_firma": None,
+                "creado_en": inicio.isoformat(),
+                "pedido": {
+                    "id": pedido_id,
+                    "cliente": f"Cliente {pedido_id % 50}",
+                    "origen": "Almacén central, Polígono Industrial Norte",
+                    "destino": f"Calle Mayor {p * 7}, {28000 + p} Madrid",
+                    "peso": 120.5 + p,
+                    "volumen": 1.75,
+                    "tipo_mercancia": "paletizada",
+                    "fecha_entrega_deseada": (inicio + timedelta(days=1)).date().isoformat(),
+                    "estado": "PENDIENTE",
+                },
+            })
+        rutas.append(RutaResponse(
+            id=r,
+            fecha=inicio.date().isoformat(),
+            fecha_inicio=inicio.isoformat(),
+            fecha_fin=(inicio + timedelta(hours=9)).isoformat(),
+            conductor_id=r % 20 + 1,
+            vehiculo_id=r % 15 + 1,
+            observaciones="Ruta generada para el benchmark del codec de caché",
+            estado="PLANIFICADA",
+            creado_en=inicio.isoformat(),
+            paradas=paradas,
+            conductor={"id": r % 20 + 1, "nombre": "Juan", "apellidos": "García López", "telefono": "600123456"},
+            vehiculo={"id": r % 15 + 1, "nombre": "Furgoneta 3", "matricula": "1234ABC", "capacidad": 1500},
+            incidencias=[],
+            incidencias_count=0,
+            tiene_incidencias=False,
+        ).model_dump())
+    return rutas
+
+
+def medir(funcion, argumento, repeticiones: int) -> float:
+    """Mediana en milisegundos de repeticiones llamadas a funcion(argumento)."""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion(argumento)
+        tiempos.append(time.perf_counter() - inicio)
+    return statistics.median(tiempos) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Tamaño y coste de los formatos de valor de la caché")
+    parser.add_argument("--rutas", type=int, default=100, help="Rutas en el listado")
+    parser.add_argument("--paradas", type=int, default=12, help="Paradas por ruta")
+    parser.add_argument("--repeticiones", type=int, default=200, help="Repeticiones por medida")
+    args = parser.parse_args()
+
+    if cache.orjson is None or cache.zstandard is None:
+        print("⚠️  orjson o zstandard no están instalados: encode_cache_value usará json / sin comprimir")
+
+    rutas = crear_rutas(args.rutas, args.paradas)
+    formatos = [("json", lambda v: json.dumps(v, default=str).encode("utf-8"), json.loads)]
+    if cache.orjson is not None:
+        formatos.append(("orjson", lambda v: cache.orjson.dumps(v, default=str), cache.orjson.loads))
+    formatos.append(("orjson+zstd", cache.encode_cache_value, cache.decode_cache_value))
+
+    print(f"Listado: {args.rutas} rutas x {args.paradas} paradas | repeticiones: {args.repeticiones}")
+    referencia = None
+    for nombre, codificar, decodificar in formatos:
+        datos = codificar(rutas)
+        assert decodificar(datos) == json.loads(json.dumps(rutas, default=str))
+        codificacion = medir(codificar, rutas, args.repeticiones)
+        decodificacion = medir(decodificar, datos, args.repeticiones)
+        referencia = referencia or len(datos)
+        print(
+            f"  {nombre:<12} {len(datos) / 1024:9.1f} KiB ({len(datos) / referencia:5.1%})   "
+            f"codificar {codificacion:7.2f} ms   decodificar {decodificacion:7.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Comprobación de regresión: el número de sentencias SQL de los informes no debe
+crecer con el volumen de datos (RNF1: respuesta < 2 segundos).
+
+Crea una base de datos SQLite en memoria, inserta proveedores, comunidades,
+incidencias y actuaciones a dos escalas distintas y cuenta las sentencias que
+ejecutan obtener_informes_proveedores y obtener_informes_comunidades.
+Termina con código de salida 1 si alguna supera MAX_SENTENCIAS o si el número
+de sentencias cambia al aumentar los datos.
+
+Uso (desde backend/):
+    PYTHONPATH=. python scripts/check_informes_queries.py
+"""
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+import app.models  # noqa: F401  (registra todos los modelos)
+from app.models import Usuario, Proveedor, Comunidad, Inmueble, Incidencia, Actuacion
+from app.models.incidencia import EstadoIncidencia
+from app.api.informes import obtener_informes_proveedores, obtener_informes_comunidades
+
+MAX_SENTENCIAS = 2
+ESCALAS = [10, 200]
+
+
+def _crear_datos(db, num_proveedores: int) -> Usuario:
+    admin = Usuario(nombre="Admin", email="admin@fyntra.com", hash_password="x", rol="super_admin")
+    db.add(admin)
+    db.flush()
+
+    comunidad = Comunidad(nombre="Comunidad prueba", cif="H00000000")
+    db.add(comunidad)
+    db.flush()
+    inmueble = Inmueble(comunidad_id=comunidad.id, referencia="1A")
+    db.add(inmueble)
+    db.flush()
+
+    estados = list(EstadoIncidencia)
+    ahora = datetime.now()
+    for i in range(num_proveedores):
+        proveedor = Proveedor(nombre=f"Proveedor {i}", email=f"proveedor{i}@fyntra.com")
+        db.add(proveedor)
+        db.flush()
+        for j in range(3):
+            incidencia = Incidencia(
+                inmueble_id=inmueble.id,
+                creador_usuario_id=admin.id,
+                proveedor_id=proveedor.id,
+                titulo=f"Incidencia {i}-{j}",
+                estado=estados[(i + j) % len(estados)],
+                fecha_alta=ahora - timedelta(hours=j),
+            )
+            db.add(incidencia)
+            db.flush()
+            for coste in (10, 25.5):
+                db.add(Actuacion(
+                    incidencia_id=incidencia.id,
+                    proveedor_id=proveedor.id,
+                    descripcion="Actuación",
+                    fecha=ahora,
+                    coste=coste,
+                ))
+    db.commit()
+    return admin
+
+
+def _contar_sentencias(num_proveedores: int) -> dict:
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    admin = _crear_datos(db, num_proveedores)
+
+    contador = {"n": 0}
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _contar(*args):
+        contador["n"] += 1
+
+    hoy = datetime.now().date()
+    desde = (hoy - timedelta(days=1)).isoformat()
+    hasta = hoy.isoformat()
+
+    resultados = {}
+    for nombre, informe in (
+        ("proveedores", obtener_informes_proveedores),
+        ("comunidades", obtener_informes_comunidades),
+    ):
+        contador["n"] = 0
+        datos = asyncio.run(informe(desde, hasta, db, admin))
+        resultados[nombre] = contador["n"]
+        if nombre == "proveedores" and len(datos["proveedores"]) != num_proveedores:
+            raise AssertionError(
+                f"Se esperaban {num_proveedores} proveedores en el informe, hay {len(datos['proveedores'])}"
+            )
+
+    db.close()
+    engine.dispose()
+    return resultados
+
+
+def main() -> int:
+    por_escala = {n: _contar_sentencias(n) for n in ESCALAS}
+    errores = []
+    for informe in ("proveedores", "comunidades"):
+        conteos = [por_escala[n][informe] for n in ESCALAS]
+        print(f"informes/{informe}: " + ", ".join(
+            f"{n} proveedores -> {c} sentencias" for n, c in zip(ESCALAS, conteos)
+        ))
+        if max(conteos) > MAX_SENTENCIAS:
+            errores.append(f"informes/{informe} supera {MAX_SENTENCIAS} sentencias SQL")
+        if len(set(conteos)) > 1:
+            errores.append(f"informes/{informe} crece con el número de proveedores")
+
+    for error in errores:
+        print(f"❌ {error}")
+    if not errores:
+        print("✅ Número de sentencias SQL acotado")
+    return 1 if errores else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
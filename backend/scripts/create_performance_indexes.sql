@@ -19,6 +19,11 @@ CREATE INDEX IF NOT EXISTS idx_incidencias_proveedor_id
 CREATE INDEX IF NOT EXISTS idx_incidencias_fecha_alta_desc 
     ON incidencias(fecha_alta DESC);
 
+-- Paginación por keyset de /incidencias/sin-resolver: (fecha_alta, id) descendente
+-- solo sobre las incidencias no cerradas (el enum se guarda por nombre)
+CREATE INDEX IF NOT EXISTS idx_incidencias_sin_resolver_keyset 
+    ON incidencias(fecha_alta DESC, id DESC) WHERE estado <> 'CERRADA';
+
 -- Índices para la tabla RUTAS
 -- Consultas frecuentes: filtrar por fecha y estado
 CREATE INDEX IF NOT EXISTS idx_rutas_fecha_estado 
@@ -36,6 +41,73 @@ CREATE INDEX IF NOT EXISTS idx_rutas_vehiculo_id
 CREATE INDEX IF NOT EXISTS idx_rutas_fecha_desc 
     ON rutas(fecha DESC);
 
+-- Disponibilidad de vehículos y conductores (validar_vehiculo / validar_conductor):
+-- solape del periodo de la ruta como rango cerrado, tstzrange(fecha_inicio, fecha_fin, '[]') &&,
+-- con un índice GiST sobre (recurso, periodo) en lugar de cuatro comparaciones con OR.
+-- Además, una restricción de exclusión impide asignar dos veces el recurso aunque se
+-- planifiquen rutas a la vez. Solo cubre las rutas planificadas: al iniciar y finalizar
+-- una ruta fecha_inicio / fecha_fin pasan a ser las horas reales, que pueden solaparse
+-- con la siguiente ruta planificada (un conductor que termina tarde) y no deben
+-- impedir iniciarla o finalizarla.
+-- Si ya hay rutas planificadas solapadas no se crea la restricción y se avisa para
+-- revisarlas antes de repetir.
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+DO $$
+DECLARE
+    recurso TEXT;
+    solapadas BOOLEAN;
+BEGIN
+    FOREACH recurso IN ARRAY ARRAY['vehiculo', 'conductor'] LOOP
+        -- Versión anterior de la restricción (todas las rutas no canceladas): se sustituye
+        IF EXISTS (
+            SELECT 1 FROM pg_constraint
+            WHERE conname = format('excl_rutas_%s_periodo', recurso)
+              AND pg_get_constraintdef(oid) NOT LIKE '%planificada%'
+        ) THEN
+            EXECUTE format('ALTER TABLE rutas DROP CONSTRAINT excl_rutas_%s_periodo', recurso);
+            RAISE NOTICE 'Se sustituye la restricción excl_rutas_%_periodo (solo rutas planificadas)', recurso;
+        END IF;
+
+        IF EXISTS (
+            SELECT 1 FROM rutas
+            WHERE estado <> 'cancelada' AND fecha_fin < fecha_inicio
+        ) THEN
+            RAISE WARNING 'Hay rutas con fecha_fin anterior a fecha_inicio: corrígelas y vuelve a ejecutar este script';
+            CONTINUE;
+        END IF;
+
+        EXECUTE format(
+            'CREATE INDEX IF NOT EXISTS idx_rutas_%1$s_periodo ON rutas USING gist (%1$s_id, tstzrange(fecha_inicio, fecha_fin, ''[]''))
+             WHERE estado <> ''cancelada'' AND fecha_inicio IS NOT NULL AND fecha_fin IS NOT NULL',
+            recurso
+        );
+
+        IF EXISTS (SELECT 1 FROM pg_constraint WHERE conname = format('excl_rutas_%s_periodo', recurso)) THEN
+            RAISE NOTICE 'La restricción excl_rutas_%_periodo ya existe', recurso;
+            CONTINUE;
+        END IF;
+        EXECUTE format(
+            'SELECT EXISTS (SELECT 1 FROM rutas a JOIN rutas b ON a.%1$I = b.%1$I AND a.id < b.id
+             WHERE a.estado = ''planificada'' AND b.estado = ''planificada''
+               AND a.fecha_inicio IS NOT NULL AND a.fecha_fin IS NOT NULL
+               AND b.fecha_inicio IS NOT NULL AND b.fecha_fin IS NOT NULL
+               AND tstzrange(a.fecha_inicio, a.fecha_fin, ''[]'') && tstzrange(b.fecha_inicio, b.fecha_fin, ''[]''))',
+            recurso || '_id'
+        ) INTO solapadas;
+        IF solapadas THEN
+            RAISE WARNING 'Hay rutas planificadas solapadas por %: no se crea la restricción excl_rutas_%_periodo', recurso, recurso;
+        ELSE
+            EXECUTE format(
+                'ALTER TABLE rutas ADD CONSTRAINT excl_rutas_%1$s_periodo
+                 EXCLUDE USING gist (%1$s_id WITH =, tstzrange(fecha_inicio, fecha_fin, ''[]'') WITH &&)
+                 WHERE (estado = ''planificada'' AND fecha_inicio IS NOT NULL AND fecha_fin IS NOT NULL)',
+                recurso
+            );
+        END IF;
+    END LOOP;
+END $$;
+
 -- Índices para la tabla PEDIDOS
 -- Consultas frecuentes: filtrar por estado y fecha de creación
 CREATE INDEX IF NOT EXISTS idx_pedidos_estado_creado_en 
@@ -83,6 +155,40 @@ CREATE INDEX IF NOT EXISTS idx_propietarios_usuario_id
 CREATE INDEX IF NOT EXISTS idx_ruta_paradas_ruta_id_orden 
     ON ruta_paradas(ruta_id, orden);
 
+-- Consultas frecuentes: historial de pedidos (primera parada y descarga entregada de cada pedido)
+CREATE INDEX IF NOT EXISTS idx_ruta_paradas_pedido_id 
+    ON ruta_paradas(pedido_id, id);
+
+CREATE INDEX IF NOT EXISTS idx_ruta_paradas_pedido_descarga_entregada 
+    ON ruta_paradas(pedido_id, id)
+    WHERE tipo_operacion = 'descarga' AND estado = 'entregado';
+
+-- Sincronización incremental de la app móvil (GET /rutas/mis-rutas/cambios):
+-- filas modificadas desde el cursor, por conductor (rutas) o por ruta (paradas, incidencias).
+-- COALESCE(actualizado_en, creado_en): actualizado_en solo se rellena al modificar la fila
+CREATE INDEX IF NOT EXISTS idx_rutas_conductor_modificado 
+    ON rutas(conductor_id, (COALESCE(actualizado_en, creado_en)));
+
+CREATE INDEX IF NOT EXISTS idx_ruta_paradas_ruta_id_modificado 
+    ON ruta_paradas(ruta_id, (COALESCE(actualizado_en, creado_en)));
+
+CREATE INDEX IF NOT EXISTS idx_incidencias_ruta_ruta_id_creado_en 
+    ON incidencias_ruta(ruta_id, creado_en);
+
+-- Marcas de borrado desde el cursor: de rutas por conductor y de paradas/incidencias por ruta
+CREATE INDEX IF NOT EXISTS idx_rutas_eliminaciones_conductor 
+    ON rutas_eliminaciones(conductor_id, eliminado_en)
+    WHERE tipo = 'ruta';
+
+CREATE INDEX IF NOT EXISTS idx_rutas_eliminaciones_ruta 
+    ON rutas_eliminaciones(ruta_id, eliminado_en)
+    WHERE tipo <> 'ruta';
+
+-- Índices para la tabla PEDIDOS (historial)
+-- Paginación por keyset del historial: (fecha_entrega_deseada, creado_en, id) descendente
+CREATE INDEX IF NOT EXISTS idx_pedidos_historial_keyset 
+    ON pedidos(fecha_entrega_deseada DESC, creado_en DESC, id DESC);
+
 -- Índices para la tabla ACTUACIONES
 -- Consultas frecuentes: filtrar por incidencia_id
 CREATE INDEX IF NOT EXISTS idx_actuaciones_incidencia_id 
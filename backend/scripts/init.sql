@@ -3,6 +3,8 @@
 
 -- Crear extensiones necesarias
 CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
+-- Restricciones de exclusión sobre (id, rango) de las rutas (create_performance_indexes.sql)
+CREATE EXTENSION IF NOT EXISTS btree_gist;
 
 -- La estructura de la base de datos se creará mediante Alembic migrations
 -- Este script solo contiene configuraciones iniciales